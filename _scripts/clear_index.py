@@ -1,53 +1,77 @@
-"""Clear Weaviate index."""
+"""Clear Weaviate index.
+
+The build the alias points to is serving queries, so it is only dropped with
+`--force`. Its pointer is removed first, and queries fail until the next ingest.
+"""
+import argparse
 import logging
 import os
 
 import weaviate
-from langchain.embeddings import OpenAIEmbeddings
-from langchain.indexes import SQLRecordManager, index
-from langchain.vectorstores import Weaviate
+
+from backend.constants import WEAVIATE_DOCS_INDEX_NAME
+from backend.index_alias import (
+    IndexAliases,
+    drop_build,
+    drop_old_builds,
+    list_builds,
+)
 
 logger = logging.getLogger(__name__)
 
 WEAVIATE_URL = os.environ["WEAVIATE_URL"]
 WEAVIATE_API_KEY = os.environ["WEAVIATE_API_KEY"]
 RECORD_MANAGER_DB_URL = os.environ["RECORD_MANAGER_DB_URL"]
-WEAVIATE_DOCS_INDEX_NAME = "LangChain_Combined_Docs_OpenAI_text_embedding_3_small"
-
-
-def clear():
-    client = weaviate.Client(
-        url=WEAVIATE_URL,
-        auth_client_secret=weaviate.AuthApiKey(api_key=WEAVIATE_API_KEY),
-    )
-    vectorstore = Weaviate(
-        client=client,
-        index_name=WEAVIATE_DOCS_INDEX_NAME,
-        text_key="text",
-        embedding=OpenAIEmbeddings(),
-        by_text=False,
-        attributes=["source", "title"],
-    )
 
-    record_manager = SQLRecordManager(
-        f"weaviate/{WEAVIATE_DOCS_INDEX_NAME}", db_url=RECORD_MANAGER_DB_URL
-    )
-    record_manager.create_schema()
-
-    indexing_stats = index(
-        [],
-        record_manager,
-        vectorstore,
-        cleanup="full",
-        source_id_key="source",
-    )
 
-    logger.info("Indexing stats: ", indexing_stats)
-    logger.info(
-        "LangChain now has this many vectors: ",
-        client.query.aggregate(WEAVIATE_DOCS_INDEX_NAME).with_meta_count().do(),
+def clear(old_only: bool = False, force: bool = False):
+    client = weaviate.connect_to_wcs(
+        cluster_url=WEAVIATE_URL,
+        auth_credentials=weaviate.classes.init.Auth.api_key(WEAVIATE_API_KEY),
+        skip_init_checks=True,
     )
+    try:
+        # Collections are dropped whole, which is much faster than deleting
+        # their vectors.
+        if old_only:
+            dropped = drop_old_builds(
+                client, WEAVIATE_DOCS_INDEX_NAME, RECORD_MANAGER_DB_URL
+            )
+        else:
+            aliases = IndexAliases(client)
+            live = aliases.resolve(WEAVIATE_DOCS_INDEX_NAME) or WEAVIATE_DOCS_INDEX_NAME
+            dropped = list_builds(client, WEAVIATE_DOCS_INDEX_NAME)
+            if force:
+                logger.warning(
+                    f"Dropping the live collection {live}, queries will fail "
+                    "until the next ingest"
+                )
+                aliases.remove(WEAVIATE_DOCS_INDEX_NAME)
+            elif live in dropped:
+                logger.info(f"Keeping the live collection {live}, see --force")
+                dropped.remove(live)
+            for name in dropped:
+                drop_build(client, name, RECORD_MANAGER_DB_URL)
+        logger.info(f"Dropped {len(dropped)} collections: {dropped}")
+        logger.info(
+            f"Collections left: {list_builds(client, WEAVIATE_DOCS_INDEX_NAME)}"
+        )
+    finally:
+        client.close()
 
 
 if __name__ == "__main__":
-    clear()
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--old-only",
+        action="store_true",
+        help="Only drop the builds older than the current and previous ones",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Also drop the live collection, which fails queries until an ingest",
+    )
+    args = parser.parse_args()
+    clear(old_only=args.old_only, force=args.force)
@@ -0,0 +1,404 @@
+"""Latency and throughput of the compiled chat graph, offline.
+
+Runs `backend.graph.graph` with local stand-ins for every network call: a fake
+chat model streaming a fixed answer after `--llm-latency` seconds at
+`--tokens-per-second`, deterministic fake embeddings taking
+`--embedding-latency` seconds, and an in-memory vector store over synthetic
+docs. Feedback URLs, which need LangSmith, are left empty. What is left is the
+graph's own overhead: prompt building, message conversion, state updates and
+streaming.
+
+Requests reuse a handful of questions, so identical first turns are in flight
+at once: they are not coalesced (see `backend.coalescing`) unless `--coalesce`
+is given, as that would measure the shared work instead of the graph.
+
+Both paths are measured, first turns (`retriever`) and follow-ups
+(`retriever_with_chat_history`, which also runs the condense step), at each
+`--concurrency` level, with that many requests in flight at once. Reports the
+p50/p95/p99 end-to-end latency, the time to the first answer token, the
+latency of every node and the requests per second.
+
+    python -m backend.benchmarks.graph_bench --concurrency 1 8 32 --requests 200 \\
+        --output graph-bench.json --baseline graph-baseline.json
+
+With `--baseline`, exits with status 1 if the p95 latency or the throughput of
+any run is more than `--tolerance` worse than in the baseline.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+from unittest.mock import patch
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models import BaseChatModel
+from langchain_core.language_models.chat_models import generate_from_stream
+from langchain_core.messages import AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import InMemoryVectorStore
+
+# The chat models are instantiated on import and need keys, although they are
+# never called. Nothing is traced to LangSmith.
+os.environ.setdefault("OPENAI_API_KEY", "not_provided")
+os.environ["LANGCHAIN_TRACING_V2"] = "false"
+
+from backend import graph as graph_module  # noqa: E402
+
+NODES = (
+    "retriever",
+    "retriever_with_chat_history",
+    "response_synthesizer",
+    "response_synthesizer_cohere",
+)
+
+QUESTIONS = [
+    "How do I create a new workspace?",
+    "What are the permission levels of a page?",
+    "How can I export a table to Excel?",
+    "How do I configure a custom type?",
+    "What does the low-code platform offer for automation?",
+]
+
+ANSWER = (
+    "To do this, open the workspace settings and select the type you want to "
+    "change [1]. Permissions are inherited from the workspace unless they are "
+    "overridden on the page itself [2]. Changes are applied immediately and "
+    "are recorded in the history of the page [3]."
+)
+
+
+def sample_latency(median: float, p95: float = 0.0) -> float:
+    """A log-normal latency with the given median and 95th percentile.
+
+    Without a `p95` above the median, the latency is always the median.
+    """
+    if p95 <= median:
+        return median
+    sigma = math.log(p95 / median) / 1.645
+    return random.lognormvariate(math.log(median), sigma)
+
+
+class FakeChatModel(BaseChatModel):
+    """Streams a fixed answer after a latency, at a fixed token rate."""
+
+    answer: str = ANSWER
+    latency: float = 0.0
+    latency_p95: float = 0.0
+    tokens_per_second: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark"
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        time.sleep(sample_latency(self.latency, self.latency_p95))
+        for i, token in enumerate(re.findall(r"\S+\s*", self.answer)):
+            if i and self.tokens_per_second:
+                time.sleep(1 / self.tokens_per_second)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return generate_from_stream(self._stream(messages, stop, run_manager))
+
+
+class SlowFakeEmbedding(DeterministicFakeEmbedding):
+    """Deterministic fake embeddings, taking `latency` seconds per query."""
+
+    latency: float = 0.0
+    latency_p95: float = 0.0
+
+    def embed_query(self, text: str) -> list[float]:
+        time.sleep(sample_latency(self.latency, self.latency_p95))
+        return super().embed_query(text)
+
+
+def build_vectorstore(
+    num_docs: int,
+    dim: int,
+    embedding_latency: float,
+    embedding_latency_p95: float = 0.0,
+) -> InMemoryVectorStore:
+    vectorstore = InMemoryVectorStore(
+        SlowFakeEmbedding(
+            size=dim, latency=embedding_latency, latency_p95=embedding_latency_p95
+        )
+    )
+    vectorstore.add_documents(
+        [
+            Document(
+                page_content=f"Section {i}. " + ANSWER,
+                metadata={
+                    "source": f"https://docs.cplace.io/page-{i}",
+                    "title": f"Page {i}",
+                },
+            )
+            for i in range(num_docs)
+        ]
+    )
+    return vectorstore
+
+
+@contextmanager
+def stubbed_graph(
+    model: BaseChatModel, vectorstore: InMemoryVectorStore
+) -> Iterator[None]:
+    """Point the graph's model and retriever at local stand-ins."""
+
+    def get_retriever(k: Optional[int] = None) -> BaseRetriever:
+        return vectorstore.as_retriever(search_kwargs=dict(k=k or 6))
+
+    with patch.object(graph_module, "llm", model), patch.object(
+        graph_module, "get_retriever", get_retriever
+    ), patch.object(graph_module, "get_feedback_urls", lambda config: {}):
+        yield
+
+
+def make_messages(path: str, i: int) -> list[dict]:
+    question = QUESTIONS[i % len(QUESTIONS)]
+    if path == "first_turn":
+        return [{"role": "user", "content": question}]
+    return [
+        {"role": "user", "content": QUESTIONS[(i + 1) % len(QUESTIONS)]},
+        {"role": "assistant", "content": ANSWER},
+        {"role": "user", "content": f"And {question[0].lower()}{question[1:]}"},
+    ]
+
+
+async def run_request(messages: list[dict], config: dict) -> dict[str, Any]:
+    """Time one run of the graph, its first answer token and its nodes."""
+    started: dict[str, float] = {}
+    nodes: dict[str, float] = {}
+    ttft = None
+    start = time.perf_counter()
+    async for event in graph_module.graph.astream_events(
+        {"messages": messages}, config, version="v2"
+    ):
+        now = time.perf_counter()
+        kind = event["event"]
+        if event["name"] in NODES and kind in ("on_chain_start", "on_chain_end"):
+            if kind == "on_chain_start":
+                started[event["run_id"]] = now
+            else:
+                nodes[event["name"]] = now - started.pop(event["run_id"])
+        elif (
+            kind == "on_chat_model_stream"
+            and ttft is None
+            and "nostream" not in event.get("tags", [])
+        ):
+            ttft = now - start
+    return {"seconds": time.perf_counter() - start, "ttft": ttft, "nodes": nodes}
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {"p50": p50, "p95": p95, "p99": p99}
+
+
+async def run_level(
+    path: str, concurrency: int, num_requests: int, config: dict
+) -> dict[str, Any]:
+    """Run `num_requests` requests, `concurrency` of them at a time."""
+    results: list[dict[str, Any]] = []
+    next_request = iter(range(num_requests))
+
+    async def worker() -> None:
+        for i in next_request:
+            results.append(await run_request(make_messages(path, i), config))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    node_seconds: dict[str, list[float]] = {}
+    for result in results:
+        for name, seconds in result["nodes"].items():
+            node_seconds.setdefault(name, []).append(seconds)
+    return {
+        "requests": len(results),
+        "coalesce": config["configurable"].get("coalesce", False),
+        "requests_per_second": len(results) / elapsed,
+        "latency": percentiles([result["seconds"] for result in results]),
+        "ttft": percentiles([result["ttft"] for result in results]),
+        "nodes": {name: percentiles(seconds) for name, seconds in node_seconds.items()},
+    }
+
+
+async def run_benchmark(
+    paths: list[str],
+    concurrency_levels: list[int],
+    num_requests: int,
+    warmup: int,
+    config: dict,
+) -> dict[str, dict[str, Any]]:
+    # Nodes are sync functions, run in the default executor: size it so that
+    # requests only queue on the graph, not on the thread pool.
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=max(concurrency_levels))
+    )
+    results: dict[str, dict[str, Any]] = {}
+    for path in paths:
+        for i in range(warmup):
+            await run_request(make_messages(path, i), config)
+        results[path] = {
+            str(concurrency): await run_level(path, concurrency, num_requests, config)
+            for concurrency in concurrency_levels
+        }
+    return results
+
+
+def benchmark(
+    paths: list[str],
+    concurrency_levels: list[int],
+    num_requests: int,
+    warmup: int = 2,
+    llm_latency: float = 0.0,
+    tokens_per_second: float = 0.0,
+    embedding_latency: float = 0.0,
+    num_docs: int = 500,
+    dim: int = 256,
+    k: int = 6,
+    model_name: str = graph_module.OPENAI_MODEL_KEY,
+    coalesce: bool = False,
+) -> dict[str, dict[str, Any]]:
+    vectorstore = build_vectorstore(num_docs, dim, embedding_latency)
+    model = FakeChatModel(latency=llm_latency, tokens_per_second=tokens_per_second)
+    config = {"configurable": {"model_name": model_name, "k": k, "coalesce": coalesce}}
+    with stubbed_graph(model, vectorstore):
+        return asyncio.run(
+            run_benchmark(paths, concurrency_levels, num_requests, warmup, config)
+        )
+
+
+def find_regressions(
+    baseline: dict, results: dict, tolerance: float = 0.2
+) -> list[str]:
+    """Describe the runs slower or with less throughput than in the baseline."""
+    regressions = []
+    for path, levels in results.items():
+        for concurrency, stats in levels.items():
+            before = baseline.get(path, {}).get(concurrency)
+            if not before:
+                continue
+            name = f"{path} x{concurrency}"
+            p95 = stats["latency"]["p95"] / before["latency"]["p95"] - 1
+            if p95 > tolerance:
+                regressions.append(
+                    f"{name}: p95 {stats['latency']['p95'] * 1000:.1f} ms, "
+                    f"{before['latency']['p95'] * 1000:.1f} ms in the baseline "
+                    f"({p95:+.0%})"
+                )
+            throughput = (
+                stats["requests_per_second"] / before["requests_per_second"] - 1
+            )
+            if throughput < -tolerance:
+                regressions.append(
+                    f"{name}: {stats['requests_per_second']:.1f} requests/s, "
+                    f"{before['requests_per_second']:.1f} in the baseline "
+                    f"({throughput:+.0%})"
+                )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--path",
+        nargs="+",
+        choices=["first_turn", "follow_up"],
+        default=["first_turn", "follow_up"],
+    )
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--llm-latency", type=float, default=0.0)
+    parser.add_argument("--tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--embedding-latency", type=float, default=0.0)
+    parser.add_argument("--docs", type=int, default=500)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--k", type=int, default=6)
+    parser.add_argument("--model-name", default=graph_module.OPENAI_MODEL_KEY)
+    parser.add_argument(
+        "--coalesce",
+        action="store_true",
+        help="Let identical concurrent first turns share their work",
+    )
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = benchmark(
+        args.path,
+        args.concurrency,
+        args.requests,
+        warmup=args.warmup,
+        llm_latency=args.llm_latency,
+        tokens_per_second=args.tokens_per_second,
+        embedding_latency=args.embedding_latency,
+        num_docs=args.docs,
+        dim=args.dim,
+        k=args.k,
+        model_name=args.model_name,
+        coalesce=args.coalesce,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for path, levels in results.items():
+            for concurrency, stats in levels.items():
+                latency, ttft = stats["latency"], stats["ttft"]
+                print(
+                    f"{path:>10} x{concurrency:<3}"
+                    f"{' coalesced' if stats['coalesce'] else ''}: "
+                    f"{stats['requests_per_second']:7.1f} requests/s  "
+                    f"p50 {latency['p50'] * 1000:7.1f} ms  "
+                    f"p95 {latency['p95'] * 1000:7.1f} ms  "
+                    f"p99 {latency['p99'] * 1000:7.1f} ms  "
+                    f"ttft p50 {ttft['p50'] * 1000:7.1f} ms"
+                )
+                for name, node in stats["nodes"].items():
+                    print(
+                        f"{'':>16}{name}: p50 {node['p50'] * 1000:.1f} ms  "
+                        f"p95 {node['p95'] * 1000:.1f} ms"
+                    )
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(json.load(f), results, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+"""Load test of a graph worker with simulated users holding conversations.
+
+Each user asks a first question, then `--turns - 1` follow-ups that go through
+`retriever_with_chat_history`, pausing for an exponentially distributed think
+time between turns, and starts a new conversation after the last one. Users
+join over `--ramp-up` seconds, continuously or in `--steps` equal steps, and
+stop after `--duration` seconds. Every turn streams `graph.astream` against the
+stub backend of a `--profile`, whose latencies are log-normal (see
+`graph_bench`).
+
+The graph's sync nodes run in the event loop's default executor, whose size is
+what a worker's capacity depends on. The test runs once per `--workers` size
+and reports:
+
+- the saturation throughput, the most turns completed per second over any
+  `--window`,
+- the p50/p95/p99 latency and time to first answer token of the turns,
+- the queueing delay, how long node calls waited for an executor thread,
+- the event loop lag, how late a timer firing every 10ms runs,
+
+and, per window, the active users, throughput, p95 latency and queueing delay,
+to see where the worker saturates.
+
+First turns are drawn from a handful of questions, so identical ones run at
+once: they are not coalesced (see `backend.coalescing`) unless `--coalesce` is
+given, which would measure the shared work instead of the worker.
+
+    python -m backend.benchmarks.load_test --profile openai --users 200 \\
+        --ramp-up 60 --duration 120 --workers 8 16 32 --output load.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+from backend.benchmarks.graph_bench import (
+    ANSWER,
+    QUESTIONS,
+    FakeChatModel,
+    build_vectorstore,
+    graph_module,
+    stubbed_graph,
+)
+
+LOOP_LAG_INTERVAL = 0.01
+
+
+@dataclass
+class StubProfile:
+    """Median and 95th percentile latencies of the stub backends, in seconds."""
+
+    llm_latency: float = 0.0
+    llm_latency_p95: float = 0.0
+    tokens_per_second: float = 0.0
+    embedding_latency: float = 0.0
+    embedding_latency_p95: float = 0.0
+
+
+PROFILES = {
+    "instant": StubProfile(),
+    "openai": StubProfile(
+        llm_latency=0.5,
+        llm_latency_p95=1.5,
+        tokens_per_second=80,
+        embedding_latency=0.15,
+        embedding_latency_p95=0.4,
+    ),
+    "slow": StubProfile(
+        llm_latency=1.5,
+        llm_latency_p95=5.0,
+        tokens_per_second=30,
+        embedding_latency=0.3,
+        embedding_latency_p95=1.0,
+    ),
+}
+
+
+@dataclass
+class Turn:
+    start: float
+    seconds: float
+    ttft: Optional[float]
+    follow_up: bool
+    ok: bool
+
+
+class TimedExecutor(ThreadPoolExecutor):
+    """Thread pool recording how long each call waited for a thread."""
+
+    def __init__(self, max_workers: int, clock: Callable[[], float]):
+        super().__init__(max_workers=max_workers)
+        self.clock = clock
+        self.waits: list[tuple[float, float]] = []
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        submitted = self.clock()
+
+        def timed():
+            started = self.clock()
+            self.waits.append((submitted, started - submitted))
+            return fn(*args, **kwargs)
+
+        return super().submit(timed)
+
+
+def user_start_times(users: int, ramp_up: float, steps: int = 0) -> list[float]:
+    """Users spread evenly over `ramp_up` seconds, in `steps` steps if not 0."""
+    if steps:
+        return [(i * steps // users) * ramp_up / steps for i in range(users)]
+    return [i * ramp_up / users for i in range(users)]
+
+
+async def run_turn(
+    messages: list[dict], config: dict, clock: Callable[[], float]
+) -> tuple[Turn, str]:
+    start = clock()
+    ttft = None
+    answer = []
+    ok = True
+    try:
+        async for chunk, metadata in graph_module.graph.astream(
+            {"messages": messages}, config, stream_mode="messages"
+        ):
+            if metadata.get("langgraph_node", "").startswith("response_synthesizer"):
+                if ttft is None:
+                    ttft = clock() - start
+                answer.append(chunk.content)
+    except Exception:
+        ok = False
+    turn = Turn(start, clock() - start, ttft, len(messages) > 1, ok)
+    return turn, "".join(answer) or ANSWER
+
+
+async def simulate_user(
+    user: int,
+    start: float,
+    deadline: float,
+    turns: int,
+    think_time: float,
+    config: dict,
+    clock: Callable[[], float],
+    results: list[Turn],
+) -> None:
+    rng = random.Random(user)
+    await asyncio.sleep(start)
+    while True:
+        messages: list[dict] = []
+        for _ in range(turns):
+            if clock() >= deadline:
+                return
+            messages.append({"role": "user", "content": rng.choice(QUESTIONS)})
+            turn, answer = await run_turn(list(messages), config, clock)
+            results.append(turn)
+            messages.append({"role": "assistant", "content": answer})
+            if think_time:
+                await asyncio.sleep(rng.expovariate(1 / think_time))
+
+
+async def monitor_loop_lag(lags: list[float], stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lags.append(max(0.0, time.perf_counter() - start - LOOP_LAG_INTERVAL))
+
+
+def percentiles(samples: list[float]) -> dict[str, Optional[float]]:
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None}
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+
+def summarize(
+    turns: list[Turn],
+    waits: list[tuple[float, float]],
+    lags: list[float],
+    start_times: list[float],
+    elapsed: float,
+    window: float,
+) -> dict[str, Any]:
+    ok = [turn for turn in turns if turn.ok]
+    timeline = []
+    for i in range(math.ceil(elapsed / window)):
+        start, end = i * window, (i + 1) * window
+        done = [turn for turn in ok if start <= turn.start + turn.seconds < end]
+        queued = [wait for submitted, wait in waits if start <= submitted < end]
+        timeline.append(
+            {
+                "start": start,
+                "active_users": sum(t < end for t in start_times),
+                "turns_per_second": len(done) / window,
+                "latency_p95": percentiles([turn.seconds for turn in done])["p95"],
+                "queue_delay_p95": percentiles(queued)["p95"],
+            }
+        )
+    return {
+        "turns": len(turns),
+        "errors": len(turns) - len(ok),
+        "follow_ups": sum(turn.follow_up for turn in ok),
+        "turns_per_second": len(ok) / elapsed,
+        "saturation_turns_per_second": max(
+            (w["turns_per_second"] for w in timeline), default=0.0
+        ),
+        "latency": percentiles([turn.seconds for turn in ok]),
+        "ttft": percentiles([turn.ttft for turn in ok if turn.ttft is not None]),
+        "queue_delay": percentiles([wait for _, wait in waits]),
+        "loop_lag": {**percentiles(lags), "max": max(lags, default=0.0)},
+        "timeline": timeline,
+    }
+
+
+async def run_load_test(
+    workers: int,
+    users: int,
+    ramp_up: float,
+    steps: int,
+    duration: float,
+    turns: int,
+    think_time: float,
+    window: float,
+    config: dict,
+) -> dict[str, Any]:
+    t0 = time.perf_counter()
+
+    def clock() -> float:
+        return time.perf_counter() - t0
+
+    executor = TimedExecutor(workers, clock)
+    asyncio.get_running_loop().set_default_executor(executor)
+    lags: list[float] = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_loop_lag(lags, stop))
+    start_times = user_start_times(users, ramp_up, steps)
+    results: list[Turn] = []
+    await asyncio.gather(
+        *(
+            simulate_user(
+                user, start, duration, turns, think_time, config, clock, results
+            )
+            for user, start in enumerate(start_times)
+        )
+    )
+    elapsed = clock()
+    stop.set()
+    await monitor
+    return summarize(results, executor.waits, lags, start_times, elapsed, window)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profile", choices=list(PROFILES), default="openai")
+    parser.add_argument("--workers", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--ramp-up", type=float, default=30.0)
+    parser.add_argument("--steps", type=int, default=0, help="0 for a linear ramp")
+    parser.add_argument("--duration", type=float, default=60.0)
+    parser.add_argument("--turns", type=int, default=3, help="Turns per conversation")
+    parser.add_argument("--think-time", type=float, default=2.0)
+    parser.add_argument("--window", type=float, default=5.0)
+    parser.add_argument("--k", type=int, default=6)
+    parser.add_argument("--docs", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--coalesce",
+        action="store_true",
+        help="Let identical concurrent first turns share their work",
+    )
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    profile = PROFILES[args.profile]
+    model = FakeChatModel(
+        latency=profile.llm_latency,
+        latency_p95=profile.llm_latency_p95,
+        tokens_per_second=profile.tokens_per_second,
+    )
+    vectorstore = build_vectorstore(
+        args.docs, 256, profile.embedding_latency, profile.embedding_latency_p95
+    )
+    config = {"configurable": {"k": args.k, "coalesce": args.coalesce}}
+    results = {}
+    with stubbed_graph(model, vectorstore):
+        for workers in args.workers:
+            results[str(workers)] = {"coalesce": args.coalesce} | asyncio.run(
+                run_load_test(
+                    workers,
+                    args.users,
+                    args.ramp_up,
+                    args.steps,
+                    args.duration,
+                    args.turns,
+                    args.think_time,
+                    args.window,
+                    config,
+                )
+            )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        return
+    for workers, stats in results.items():
+        latency, queue_delay, lag = (
+            stats["latency"],
+            stats["queue_delay"],
+            stats["loop_lag"],
+        )
+        print(
+            f"{workers:>3} workers{' coalesced' if stats['coalesce'] else ''}: "
+            f"{stats['turns']} turns, {stats['errors']} errors, "
+            f"{stats['turns_per_second']:.1f} turns/s, "
+            f"saturation {stats['saturation_turns_per_second']:.1f} turns/s\n"
+            f"    latency p50 {latency['p50']:.3f}s p95 {latency['p95']:.3f}s "
+            f"p99 {latency['p99']:.3f}s, ttft p50 {stats['ttft']['p50']:.3f}s\n"
+            f"    queueing p50 {queue_delay['p50'] * 1000:.1f}ms "
+            f"p99 {queue_delay['p99'] * 1000:.1f}ms, "
+            f"loop lag p99 {lag['p99'] * 1000:.1f}ms max {lag['max'] * 1000:.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
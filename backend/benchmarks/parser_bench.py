@@ -0,0 +1,226 @@
+"""Microbenchmark of `langchain_docs_extractor` against the recursive baseline.
+
+Runs both extractors over the saved HTML pages in the test fixtures and reports
+pages/s and the peak memory allocated during extraction. `--scale N` repeats the
+article body of every page N times to simulate large pages.
+
+    python -m backend.benchmarks.parser_bench --rounds 20 --scale 10
+"""
+import argparse
+import json
+import re
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Generator
+
+from bs4 import BeautifulSoup, Doctype, NavigableString, SoupStrainer, Tag
+
+from backend.parser import langchain_docs_extractor
+
+FIXTURES_DIR = Path(__file__).parents[1] / "tests" / "unit_tests" / "fixtures" / "html"
+
+
+# The recursive generator implementation that `langchain_docs_extractor` replaced,
+# kept verbatim as the baseline.
+def recursive_langchain_docs_extractor(soup: BeautifulSoup) -> str:
+    # Remove all the tags that are not meaningful for the extraction.
+    SCAPE_TAGS = ["nav", "footer", "aside", "script", "style"]
+    [tag.decompose() for tag in soup.find_all(SCAPE_TAGS)]
+
+    def get_text(tag: Tag) -> Generator[str, None, None]:
+        for child in tag.children:
+            if isinstance(child, Doctype):
+                continue
+
+            if isinstance(child, NavigableString):
+                yield child
+            elif isinstance(child, Tag):
+                if child.name in ["h1", "h2", "h3", "h4", "h5", "h6"]:
+                    yield f"{'#' * int(child.name[1:])} {child.get_text()}\n\n"
+                elif child.name == "a":
+                    yield f"[{child.get_text(strip=False)}]({child.get('href')})"
+                elif child.name == "img":
+                    yield f"![{child.get('alt', '')}]({child.get('src')})"
+                elif child.name in ["strong", "b"]:
+                    yield f"**{child.get_text(strip=False)}**"
+                elif child.name in ["em", "i"]:
+                    yield f"_{child.get_text(strip=False)}_"
+                elif child.name == "br":
+                    yield "\n"
+                elif child.name == "code":
+                    parent = child.find_parent()
+                    if parent is not None and parent.name == "pre":
+                        classes = parent.attrs.get("class", "")
+
+                        language = next(
+                            filter(lambda x: re.match(r"language-\w+", x), classes),
+                            None,
+                        )
+                        if language is None:
+                            language = ""
+                        else:
+                            language = language.split("-")[1]
+
+                        lines: list[str] = []
+                        for span in child.find_all("span", class_="token-line"):
+                            line_content = "".join(
+                                token.get_text() for token in span.find_all("span")
+                            )
+                            lines.append(line_content)
+
+                        code_content = "\n".join(lines)
+                        yield f"```{language}\n{code_content}\n```\n\n"
+                    else:
+                        yield f"`{child.get_text(strip=False)}`"
+
+                elif child.name == "p":
+                    yield from get_text(child)
+                    yield "\n\n"
+                elif child.name == "ul":
+                    for li in child.find_all("li", recursive=False):
+                        yield "- "
+                        yield from get_text(li)
+                        yield "\n\n"
+                elif child.name == "ol":
+                    for i, li in enumerate(child.find_all("li", recursive=False)):
+                        yield f"{i + 1}. "
+                        yield from get_text(li)
+                        yield "\n\n"
+                elif child.name == "div" and "tabs-container" in child.attrs.get(
+                    "class", [""]
+                ):
+                    tabs = child.find_all("li", {"role": "tab"})
+                    tab_panels = child.find_all("div", {"role": "tabpanel"})
+                    for tab, tab_panel in zip(tabs, tab_panels):
+                        tab_name = tab.get_text(strip=True)
+                        yield f"{tab_name}\n"
+                        yield from get_text(tab_panel)
+                elif child.name == "table":
+                    thead = child.find("thead")
+                    header_exists = isinstance(thead, Tag)
+                    if header_exists:
+                        headers = thead.find_all("th")
+                        if headers:
+                            yield "| "
+                            yield " | ".join(header.get_text() for header in headers)
+                            yield " |\n"
+                            yield "| "
+                            yield " | ".join("----" for _ in headers)
+                            yield " |\n"
+
+                    tbody = child.find("tbody")
+                    tbody_exists = isinstance(tbody, Tag)
+                    if tbody_exists:
+                        for row in tbody.find_all("tr"):
+                            yield "| "
+                            yield " | ".join(
+                                cell.get_text(strip=True) for cell in row.find_all("td")
+                            )
+                            yield " |\n"
+
+                    yield "\n\n"
+                elif child.name in ["button"]:
+                    continue
+                else:
+                    yield from get_text(child)
+
+    joined = "".join(get_text(soup))
+    return re.sub(r"\n\n+", "\n\n", joined).strip()
+
+
+EXTRACTORS: dict[str, Callable[[BeautifulSoup], str]] = {
+    "recursive": recursive_langchain_docs_extractor,
+    "iterative": langchain_docs_extractor,
+}
+
+_ARTICLE_REGEX = re.compile(r"(<article[^>]*>)(.*)(</article>)", re.DOTALL)
+
+
+def load_pages(fixtures_dir: Path, scale: int) -> dict[str, str]:
+    pages = {}
+    for path in sorted(fixtures_dir.glob("*.html")):
+        html = path.read_text()
+        if scale > 1:
+            html = _ARTICLE_REGEX.sub(
+                lambda m: m.group(1) + m.group(2) * scale + m.group(3), html
+            )
+        pages[path.stem] = html
+    return pages
+
+
+def parse(html: str) -> BeautifulSoup:
+    # Same parser options as `get_langchain_docs_loader`.
+    return BeautifulSoup(
+        html,
+        "lxml",
+        parse_only=SoupStrainer(name=("article", "title", "html", "lang", "content")),
+    )
+
+
+def benchmark(
+    extract: Callable[[BeautifulSoup], str], pages: dict[str, str], rounds: int
+) -> dict[str, float]:
+    # The extractors mutate the soup, so every run gets a freshly parsed copy.
+    # Parsing is not part of the measurement.
+    elapsed = 0.0
+    num_pages = 0
+    for _ in range(rounds):
+        for html in pages.values():
+            soup = parse(html)
+            start = time.perf_counter()
+            extract(soup)
+            elapsed += time.perf_counter() - start
+            num_pages += 1
+
+    # Measured in a separate pass since tracing allocations slows everything down.
+    peak = 0
+    for html in pages.values():
+        soup = parse(html)
+        tracemalloc.start()
+        extract(soup)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return {
+        "pages_per_s": num_pages / elapsed,
+        "ms_per_page": 1000 * elapsed / num_pages,
+        "peak_kib": peak / 1024,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fixtures-dir", type=Path, default=FIXTURES_DIR)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    pages = load_pages(args.fixtures_dir, args.scale)
+    outputs = {
+        name: [extract(parse(html)) for html in pages.values()]
+        for name, extract in EXTRACTORS.items()
+    }
+    if outputs["iterative"] != outputs["recursive"]:
+        raise SystemExit("Extractors produced different output")
+
+    results = {
+        name: benchmark(extract, pages, args.rounds)
+        for name, extract in EXTRACTORS.items()
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{len(pages)} pages x {args.rounds} rounds, scale {args.scale}")
+    print(f"{'extractor':<12}{'pages/s':>12}{'ms/page':>12}{'peak KiB':>12}")
+    for name, result in results.items():
+        print(
+            f"{name:<12}{result['pages_per_s']:>12.1f}"
+            f"{result['ms_per_page']:>12.2f}{result['peak_kib']:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Recall and memory of quantized embeddings against exact float32 search.
+
+Runs over the vectors of the embedding cache (`--cache-dir`, by default
+EMBEDDING_CACHE_DIR), or over synthetic clustered vectors without one. Queries
+are perturbed copies of corpus vectors, and the float32 inner-product top-k is
+the ground truth. Reports, for each encoding, recall@k, the bytes per vector
+held in RAM, the total for the corpus and the latency per query.
+
+    python -m backend.benchmarks.quantization_bench --cache-dir .cache/embeddings \\
+        --model text-embedding-3-small --queries 200 --k 10
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from backend.embedding_cache import EmbeddingStore
+from backend.quantization import QuantizedIndex, to_float16
+
+
+def synthetic_corpus(
+    num_vectors: int, dim: int, num_clusters: int, seed: int
+) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    # Embedding dimensions have uneven variances.
+    spread = rng.gamma(2.0, 0.5, size=dim).astype(np.float32)
+    centers = rng.standard_normal((num_clusters, dim)).astype(np.float32) * spread
+    labels = rng.integers(0, num_clusters, size=num_vectors)
+    noise = rng.standard_normal((num_vectors, dim)).astype(np.float32) * spread
+    vectors = centers[labels] + 0.8 * noise
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def make_queries(
+    corpus: np.ndarray, num_queries: int, noise: float, seed: int
+) -> np.ndarray:
+    rng = np.random.default_rng(seed + 1)
+    rows = rng.choice(len(corpus), size=num_queries, replace=False)
+    queries = np.asarray(corpus[rows], dtype=np.float32)
+    queries += (
+        noise
+        * rng.standard_normal(queries.shape).astype(np.float32)
+        / np.sqrt(queries.shape[1])
+    )
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    scores = queries @ np.asarray(vectors, dtype=np.float32).T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def recall(found: np.ndarray, expected: np.ndarray) -> float:
+    hits = sum(len(set(f) & set(e)) for f, e in zip(found, expected))
+    return hits / expected.size
+
+
+def benchmark(
+    corpus: np.ndarray, queries: np.ndarray, k: int, oversamples: list[int]
+) -> dict[str, dict[str, float]]:
+    corpus = np.asarray(corpus, dtype=np.float32)
+    expected = exact_top_k(corpus, queries, k)
+    results: dict[str, dict[str, float]] = {}
+
+    def record(name: str, search, nbytes: int) -> None:
+        start = time.perf_counter()
+        found = search()
+        elapsed = time.perf_counter() - start
+        results[name] = {
+            f"recall@{k}": recall(found, expected),
+            "bytes_per_vector": nbytes / len(corpus),
+            "ram_mib": nbytes / 2**20,
+            "ms_per_query": 1000 * elapsed / len(queries),
+        }
+
+    record("float32", lambda: exact_top_k(corpus, queries, k), corpus.nbytes)
+    half = to_float16(corpus)
+    record("float16", lambda: exact_top_k(half, queries, k), half.nbytes)
+
+    coarse = QuantizedIndex.build(corpus, rescore_dtype=None)
+    record("int8", lambda: coarse.search(queries, k)[0], coarse.nbytes)
+    with tempfile.TemporaryDirectory() as index_dir:
+        # As on a query node: the float16 vectors stay on disk, memory-mapped,
+        # and only the candidates are read.
+        QuantizedIndex.build(corpus, rescore_dtype="float16").save(index_dir)
+        rescored = QuantizedIndex.load(index_dir, map_vectors=True)
+        for oversample in oversamples:
+            record(
+                f"int8+rescore x{oversample}",
+                lambda: rescored.search(queries, k, oversample=oversample)[0],
+                rescored.nbytes,
+            )
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cache-dir", default=os.environ.get("EMBEDDING_CACHE_DIR"))
+    parser.add_argument("--model", default="text-embedding-3-small")
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        default=20_000,
+        help="Number of synthetic vectors, without --cache-dir",
+    )
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.5)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--oversample", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    if args.cache_dir:
+        store = EmbeddingStore.open(args.cache_dir, args.model)
+        corpus = np.asarray(store.all_vectors(), dtype=np.float32)
+    else:
+        corpus = synthetic_corpus(args.synthetic, args.dim, 200, args.seed)
+    queries = make_queries(corpus, args.queries, args.noise, args.seed)
+    results = benchmark(corpus, queries, args.k, args.oversample)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{len(corpus)} vectors of {corpus.shape[1]} dimensions")
+    for name, stats in results.items():
+        print(
+            f"{name:>20}: recall@{args.k} {stats[f'recall@{args.k}']:.3f}  "
+            f"{stats['bytes_per_vector']:7.0f} B/vector  "
+            f"{stats['ram_mib']:8.1f} MiB  {stats['ms_per_query']:6.2f} ms/query"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""Retrieval quality and latency over an offline snapshot of the corpus.
+
+Splits the documents of a snapshot (see `backend.snapshot`) as ingestion does,
+embeds the chunks through the embedding cache and runs the questions of an
+evaluation dataset against them, with each search strategy. A retrieved chunk is
+relevant if its source is one of the example's expected sources. Reports, for
+each strategy and each `k`:
+
+- recall@k: the fraction of the expected sources retrieved,
+- hit@k: whether any of them is retrieved, the `retrieval_recall` of the e2e
+  evaluation,
+- MRR: the mean reciprocal rank of the first relevant chunk,
+- nDCG@k: with binary relevance, counting each source once,
+
+and the search latency per query. Chunk embeddings come from the embedding
+cache, which ingestion already filled, and question embeddings are cached next
+to it, in `<cache dir>/queries`, so reruns make no API calls.
+
+    python -m backend.benchmarks.retrieval_bench --snapshot snapshots/latest \\
+        --dataset eval.jsonl --fetch --k 2 4 6 8 10
+
+The dataset is a JSONL file of `{"question": ..., "sources": [...]}` examples;
+`--fetch` downloads it from the LangSmith dataset of the e2e evaluation first.
+"""
+import argparse
+import json
+import math
+import os
+import time
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+from langchain.text_splitter import TextSplitter
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+
+from backend.benchmarks.quantization_bench import exact_top_k
+from backend.crawl import batched
+from backend.embedding_cache import CachedEmbeddings, EmbeddingStore, text_key
+from backend.ingest import (
+    EMBEDDING_MODEL_NAME,
+    fill_missing_metadata,
+    filter_short_docs,
+    get_text_splitter,
+)
+from backend.quantization import QuantizedIndex, to_float16
+from backend.snapshot import iter_snapshot
+
+DATASET_NAME = "chat-langchain-qa"
+
+Search = Callable[[np.ndarray, int], np.ndarray]
+
+
+def fetch_examples(dataset_name: str, path: str) -> None:
+    from langsmith import Client
+
+    with open(path, "w") as f:
+        for example in Client().list_examples(dataset_name=dataset_name):
+            record = {
+                "question": example.inputs["question"],
+                "sources": (example.outputs or {}).get("sources") or [],
+            }
+            f.write(json.dumps(record) + "\n")
+
+
+def load_examples(path: str) -> list[dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_chunks(
+    snapshot: str, chunk_tokens: int, sources: Optional[Iterable[str]] = None
+) -> list[Document]:
+    splitters: dict[str, TextSplitter] = {}
+    chunks: list[Document] = []
+    for source, doc in iter_snapshot(snapshot, sources=sources):
+        if source not in splitters:
+            splitters[source] = get_text_splitter(source, chunk_tokens)
+        chunks.extend(splitters[source].split_documents([doc]))
+    return list(fill_missing_metadata(filter_short_docs(chunks)))
+
+
+def embed_chunks(
+    chunks: list[Document], embedding: Embeddings, batch_size: int = 1000
+) -> np.ndarray:
+    return np.concatenate(
+        [
+            np.asarray(
+                embedding.embed_documents([chunk.page_content for chunk in batch]),
+                dtype=np.float32,
+            )
+            for batch in batched(chunks, batch_size)
+        ]
+    )
+
+
+def embed_queries(
+    questions: list[str], embedding: Embeddings, store: EmbeddingStore
+) -> np.ndarray:
+    """Embed `questions`, only sending those missing from `store` to the API."""
+    keys = [text_key(question) for question in questions]
+    cached = store.get_many(keys)
+    missing = {
+        key: question for key, question in zip(keys, questions) if key not in cached
+    }
+    if missing:
+        vectors = [embedding.embed_query(question) for question in missing.values()]
+        store.put_many(dict(zip(missing, vectors)))
+        cached.update(store.get_many(list(missing)))
+    return np.stack([np.asarray(cached[key], dtype=np.float32) for key in keys])
+
+
+def make_strategies(vectors: np.ndarray, oversamples: list[int]) -> dict[str, Search]:
+    """Search functions returning the rows of the `k` best chunks, best first."""
+    half = to_float16(vectors)
+    coarse = QuantizedIndex.build(vectors, rescore_dtype=None)
+    rescored = QuantizedIndex.build(vectors, rescore_dtype="float16")
+    strategies: dict[str, Search] = {
+        "float32": lambda query, k: exact_top_k(vectors, query[None], k)[0],
+        "float16": lambda query, k: exact_top_k(half, query[None], k)[0],
+        "int8": lambda query, k: coarse.search(query, k)[0][0],
+    }
+    for oversample in oversamples:
+        strategies[f"int8+rescore x{oversample}"] = (
+            lambda query, k, oversample=oversample: rescored.search(
+                query, k, oversample=oversample
+            )[0][0]
+        )
+    return strategies
+
+
+def score(ranked: list[str], expected: set[str], k: int) -> dict[str, float]:
+    """Recall, hit, reciprocal rank and nDCG of the top `k` of `ranked` sources."""
+    found: set[str] = set()
+    reciprocal_rank = 0.0
+    dcg = 0.0
+    for rank, source in enumerate(ranked[:k]):
+        if source not in expected:
+            continue
+        if not found:
+            reciprocal_rank = 1 / (rank + 1)
+        if source not in found:
+            found.add(source)
+            dcg += 1 / math.log2(rank + 2)
+    ideal = sum(1 / math.log2(rank + 2) for rank in range(min(len(expected), k)))
+    return {
+        f"recall@{k}": len(found) / len(expected),
+        f"hit@{k}": float(bool(found)),
+        f"mrr@{k}": reciprocal_rank,
+        f"ndcg@{k}": dcg / ideal,
+    }
+
+
+def benchmark(
+    chunks: list[Document],
+    vectors: np.ndarray,
+    examples: list[dict],
+    queries: np.ndarray,
+    k_values: list[int],
+    oversamples: list[int],
+) -> dict[str, dict[str, float]]:
+    sources = [chunk.metadata["source"] for chunk in chunks]
+    expected = [set(example["sources"]) for example in examples]
+    max_k = min(max(k_values), len(chunks))
+    results: dict[str, dict[str, float]] = {}
+    for name, search in make_strategies(vectors, oversamples).items():
+        ranked: list[list[str]] = []
+        latencies = []
+        for query in queries:
+            start = time.perf_counter()
+            rows = search(query, max_k)
+            latencies.append(time.perf_counter() - start)
+            ranked.append([sources[row] for row in rows])
+        # Search once at the largest k: the top k of every smaller k is a prefix.
+        stats: dict[str, float] = {}
+        for k in k_values:
+            scores = [score(r, e, k) for r, e in zip(ranked, expected)]
+            for metric in scores[0]:
+                stats[metric] = float(np.mean([s[metric] for s in scores]))
+        p50, p95 = np.percentile(latencies, [50, 95])
+        stats["ms_per_query_p50"] = 1000 * p50
+        stats["ms_per_query_p95"] = 1000 * p95
+        results[name] = stats
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--snapshot", required=True)
+    parser.add_argument("--sources", nargs="+", help="Only these doc sources")
+    parser.add_argument("--dataset", required=True, help="JSONL file of examples")
+    parser.add_argument(
+        "--fetch",
+        action="store_true",
+        help=f"Download the LangSmith dataset '{DATASET_NAME}' to --dataset first",
+    )
+    parser.add_argument("--cache-dir", default=os.environ.get("EMBEDDING_CACHE_DIR"))
+    parser.add_argument("--model", default=EMBEDDING_MODEL_NAME)
+    parser.add_argument(
+        "--chunk-tokens",
+        type=int,
+        default=int(os.environ.get("INGEST_CHUNK_TOKENS") or 1000),
+    )
+    parser.add_argument("--k", type=int, nargs="+", default=[2, 4, 6, 8, 10])
+    parser.add_argument("--oversample", type=int, nargs="+", default=[2, 4])
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+    if not args.cache_dir:
+        parser.error("--cache-dir or EMBEDDING_CACHE_DIR is required")
+
+    if args.fetch:
+        fetch_examples(DATASET_NAME, args.dataset)
+    # Recall is undefined for examples without expected sources.
+    examples = [
+        example for example in load_examples(args.dataset) if example["sources"]
+    ]
+
+    underlying = OpenAIEmbeddings(model=args.model, chunk_size=200)
+    chunks = load_chunks(args.snapshot, args.chunk_tokens, args.sources)
+    vectors = embed_chunks(
+        chunks,
+        CachedEmbeddings(underlying, EmbeddingStore.open(args.cache_dir, args.model)),
+    )
+    queries = embed_queries(
+        [example["question"] for example in examples],
+        underlying,
+        EmbeddingStore.open(Path(args.cache_dir) / "queries", args.model),
+    )
+    results = benchmark(chunks, vectors, examples, queries, args.k, args.oversample)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{len(examples)} questions over {len(chunks)} chunks")
+    for name, stats in results.items():
+        print(
+            f"{name}: {stats['ms_per_query_p50']:.2f} ms/query p50, "
+            f"{stats['ms_per_query_p95']:.2f} ms p95"
+        )
+        for k in args.k:
+            print(
+                f"  k={k:<3} recall {stats[f'recall@{k}']:.3f}  "
+                f"hit {stats[f'hit@{k}']:.3f}  mrr {stats[f'mrr@{k}']:.3f}  "
+                f"ndcg {stats[f'ndcg@{k}']:.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
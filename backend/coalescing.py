@@ -0,0 +1,197 @@
+"""Coalescing of identical first-turn requests running at the same time.
+
+A chat link with a prefilled question, or a trending question, makes many users
+send the same first message at once. Such requests share one retrieval and one
+synthesis: the first request of a `(normalized query, model_name, k)` key leads
+the flight and does the work, while the requests arriving before it finishes
+follow it. Followers wait for the leader's documents, then replay the leader's
+answer tokens through their own chat model run as they are generated, so their
+clients stream them as usual.
+
+Follow-ups are never coalesced, as their answer depends on the chat history.
+Followers hold a worker thread until the leader finishes and share its errors,
+so coalescing is off unless the `coalesce` configurable or COALESCE_REQUESTS is
+true. Turn it on for deployments that see bursts of identical questions.
+"""
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Hashable, Iterator, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.language_models.chat_models import generate_from_stream
+from langchain_core.messages import AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableConfig
+
+DEFAULT_K = 6
+
+
+def coalescing_enabled(config: RunnableConfig) -> bool:
+    enabled = config.get("configurable", {}).get("coalesce")
+    if enabled is None:
+        enabled = os.environ.get("COALESCE_REQUESTS", "false").lower() == "true"
+    return bool(enabled)
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.casefold().split())
+
+
+def coalescing_key(
+    query: str, model_name: str, k: Optional[int]
+) -> tuple[str, str, int]:
+    return normalize_query(query), model_name, k or DEFAULT_K
+
+
+class Flight:
+    """The result of a leader's call, and the chunks it streamed so far."""
+
+    def __init__(self) -> None:
+        self.followers = 0
+        self._condition = threading.Condition()
+        self._chunks: list[Any] = []
+        self._done = False
+        self._result: Any = None
+        self._error: Optional[BaseException] = None
+
+    def publish(self, chunk: Any) -> None:
+        with self._condition:
+            self._chunks.append(chunk)
+            self._condition.notify_all()
+
+    def finish(self, result: Any = None, error: Optional[BaseException] = None) -> None:
+        with self._condition:
+            if self._done:
+                return
+            self._result, self._error, self._done = result, error, True
+            self._condition.notify_all()
+
+    def stream(self) -> Iterator[Any]:
+        """Every chunk published by the leader, blocking until it finishes."""
+        i = 0
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: len(self._chunks) > i or self._done)
+                chunks = self._chunks[i:]
+                done = self._done
+            yield from chunks
+            i += len(chunks)
+            if done and not chunks:
+                break
+        if self._error is not None:
+            raise self._error
+
+    def wait(self) -> Any:
+        """The leader's result, or its exception raised."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._done)
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class SingleFlight:
+    """Hands out one in-flight `Flight` per key."""
+
+    def __init__(self) -> None:
+        self._flights: dict[Hashable, Flight] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def join(self, key: Hashable) -> Iterator[tuple[Flight, bool]]:
+        """Yield the key's flight and whether the caller leads it.
+
+        The leader must `finish` the flight with its result, an exception
+        escaping the block finishes it with that error.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+            else:
+                flight.followers += 1
+        if not leader:
+            yield flight, False
+            return
+        try:
+            yield flight, True
+        except BaseException as e:
+            flight.finish(error=e)
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.finish()
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> tuple[Any, bool]:
+        """Call `func` unless the key is in flight, return its result and
+        whether it was shared with a leader."""
+        with self.join(key) as (flight, leader):
+            if not leader:
+                return flight.wait(), True
+            result = func()
+            flight.finish(result)
+            return result, False
+
+
+class FlightPublisher(BaseCallbackHandler):
+    """Publishes the tokens of the chat model runs it is attached to."""
+
+    def __init__(self, flight: Flight):
+        self.flight = flight
+
+    def on_llm_new_token(
+        self,
+        token: str,
+        *,
+        chunk: Optional[ChatGenerationChunk] = None,
+        **kwargs: Any,
+    ) -> None:
+        message = getattr(chunk, "message", None)
+        self.flight.publish(
+            message if message is not None else AIMessageChunk(content=token)
+        )
+
+
+class ReplayChatModel(BaseChatModel):
+    """Streams the answer of a flight's leader, as the leader generates it.
+
+    The flight's result must be a dict holding the leader's final `message`,
+    which is replayed at once if the leader streamed no tokens.
+    """
+
+    flight: Flight
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        streamed = False
+        for chunk in self.flight.stream():
+            streamed = True
+            yield ChatGenerationChunk(message=AIMessageChunk(content=chunk.content))
+        if not streamed:
+            message = self.flight.wait()["message"]
+            yield ChatGenerationChunk(message=AIMessageChunk(content=message.content))
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return generate_from_stream(self._stream(messages, stop, run_manager))
@@ -0,0 +1,262 @@
+"""Lazy crawling helpers for the web loaders used during ingestion.
+
+`SitemapLoader.lazy_load` fetches every page of the sitemap before yielding the
+first document and `RecursiveUrlLoader` gathers the whole site when `use_async`
+is set. The helpers below drive the same loaders but yield pages as soon as they
+have been fetched, so memory stays bounded by the number of pages in flight
+rather than by the size of the site.
+
+Fetching and extraction are separate steps: `iter_pages` yields the raw HTML of
+each page and `page_to_document` applies the loader's parsing functions to it,
+so extraction can run elsewhere (see `backend.extraction`).
+
+Both crawls optionally fetch through a `CachedFetcher`, which skips or
+revalidates pages that did not change since the last crawl. Its cache also keeps
+the document extracted from each page, see `get_cached_document`.
+"""
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Iterable, Iterator, Optional, TypeVar, Union
+
+import requests
+from bs4 import BeautifulSoup
+from langchain_community.document_loaders import RecursiveUrlLoader, SitemapLoader
+from langchain_core.documents import Document
+from langchain_core.utils.html import extract_sub_links
+from requests.structures import CaseInsensitiveDict
+
+from backend.http_cache import CachedFetcher, FetchResult
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+WebLoader = Union[SitemapLoader, RecursiveUrlLoader]
+
+DEFAULT_SITEMAP_BLOCK_SIZE = 50
+DEFAULT_CRAWL_MAX_WORKERS = 8
+
+
+def batched(iterable: Iterable[T], size: int) -> Iterator[list[T]]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+@dataclass
+class RawPage:
+    """The raw HTML of a crawled page, before any extraction."""
+
+    url: str
+    html: str
+    # The page's sitemap entry (loc, lastmod, ...) for sitemap crawls.
+    meta: dict = field(default_factory=dict)
+    # Response headers, read by `RecursiveUrlLoader`'s metadata extractor, which
+    # expects them case-insensitive like `requests.Response.headers`.
+    headers: CaseInsensitiveDict[str] = field(default_factory=CaseInsensitiveDict)
+    # Only known when fetched through a `CachedFetcher`.
+    sha256: Optional[str] = None
+    changed: bool = True
+
+
+def _raw_page(url: str, result: FetchResult, meta: Optional[dict] = None) -> RawPage:
+    return RawPage(
+        url=url,
+        html=result.text,
+        meta=meta or {},
+        headers=CaseInsensitiveDict(result.headers),
+        sha256=result.sha256,
+        changed=result.changed,
+    )
+
+
+def _fetch_sitemap_page(
+    loader: SitemapLoader, fetcher: CachedFetcher, el: dict
+) -> Optional[RawPage]:
+    url = el["loc"].strip()
+    try:
+        result = fetcher.fetch(
+            url,
+            lastmod=el.get("lastmod"),
+            # As `SitemapLoader.fetch_all` would send it.
+            headers=dict(loader.session.headers),
+            timeout=loader.requests_kwargs.get("timeout"),
+            encoding=loader.encoding,
+            autoset_encoding=loader.autoset_encoding,
+        )
+        if loader.raise_for_status and not 200 <= result.status_code < 400:
+            raise ValueError(f"Received HTTP status {result.status_code}")
+    except Exception as e:
+        if not loader.continue_on_failure:
+            raise
+        logger.warning(f"Error fetching {url}, skipping due to {e}")
+        return None
+    return _raw_page(url, result, el)
+
+
+def iter_sitemap_pages(
+    loader: SitemapLoader,
+    block_size: int = DEFAULT_SITEMAP_BLOCK_SIZE,
+    fetcher: Optional[CachedFetcher] = None,
+) -> Iterator[RawPage]:
+    """Yield the pages of a sitemap, fetching `block_size` pages at a time."""
+    soup = loader._scrape(loader.web_path, parser="xml")
+    els = [el for el in loader.parse_sitemap(soup) if "loc" in el]
+    if fetcher is None:
+        for block in batched(els, block_size):
+            urls = [el["loc"].strip() for el in block]
+            htmls = asyncio.run(loader.fetch_all(urls))
+            for url, el, html in zip(urls, block, htmls):
+                yield RawPage(url=url, html=html, meta=el)
+        return
+
+    with ThreadPoolExecutor(
+        max_workers=loader.requests_per_second, thread_name_prefix="sitemap"
+    ) as executor:
+        for block in batched(els, block_size):
+            pages = executor.map(
+                lambda el: _fetch_sitemap_page(loader, fetcher, el), block
+            )
+            yield from (page for page in pages if page is not None)
+
+
+def _fetch_page(
+    loader: RecursiveUrlLoader,
+    url: str,
+    depth: int,
+    fetcher: Optional[CachedFetcher] = None,
+) -> tuple[RawPage, list[str]]:
+    if fetcher is None:
+        response = requests.get(url, timeout=loader.timeout, headers=loader.headers)
+        if loader.encoding is not None:
+            response.encoding = loader.encoding
+        elif loader.autoset_encoding:
+            response.encoding = response.apparent_encoding
+        status_code = response.status_code
+        page = RawPage(
+            url=url, html=response.text, headers=CaseInsensitiveDict(response.headers)
+        )
+    else:
+        result = fetcher.fetch(
+            url,
+            headers=loader.headers,
+            timeout=loader.timeout,
+            encoding=loader.encoding,
+            autoset_encoding=loader.autoset_encoding,
+        )
+        status_code = result.status_code
+        page = _raw_page(url, result)
+    if loader.check_response_status and 400 <= status_code <= 599:
+        raise ValueError(f"Received HTTP status {status_code}")
+
+    sub_links: list[str] = []
+    if depth < loader.max_depth - 1:
+        sub_links = extract_sub_links(
+            page.html,
+            url,
+            base_url=loader.base_url,
+            pattern=loader.link_regex,
+            prevent_outside=loader.prevent_outside,
+            exclude_prefixes=loader.exclude_dirs,
+            continue_on_failure=loader.continue_on_failure,
+        )
+    return page, sub_links
+
+
+def crawl_pages(
+    loader: RecursiveUrlLoader,
+    max_workers: int = DEFAULT_CRAWL_MAX_WORKERS,
+    fetcher: Optional[CachedFetcher] = None,
+) -> Iterator[RawPage]:
+    """Crawl the loader's site breadth-first with up to `max_workers` fetches in flight.
+
+    Follows the same depth, link and exclusion rules as `RecursiveUrlLoader`. A
+    failure on the root page is raised, failures on child pages are logged and
+    skipped, as the loader's async crawl does.
+    """
+    visited = {loader.url}
+    frontier: deque[tuple[str, int]] = deque([(loader.url, 0)])
+    in_flight: dict[Future, tuple[str, int]] = {}
+
+    with ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="crawl"
+    ) as executor:
+        try:
+            while frontier or in_flight:
+                while frontier and len(in_flight) < max_workers:
+                    url, depth = frontier.popleft()
+                    future = executor.submit(_fetch_page, loader, url, depth, fetcher)
+                    in_flight[future] = (url, depth)
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url, depth = in_flight.pop(future)
+                    try:
+                        page, sub_links = future.result()
+                    except Exception as e:
+                        if depth == 0 and not loader.continue_on_failure:
+                            raise
+                        logger.warning(
+                            f"Unable to load {url}. Received error {e} of type "
+                            f"{e.__class__.__name__}"
+                        )
+                        continue
+
+                    for link in sub_links:
+                        if link not in visited:
+                            visited.add(link)
+                            frontier.append((link, depth + 1))
+                    yield page
+        finally:
+            for future in in_flight:
+                future.cancel()
+
+
+def iter_pages(
+    loader: WebLoader, fetcher: Optional[CachedFetcher] = None
+) -> Iterator[RawPage]:
+    if isinstance(loader, SitemapLoader):
+        return iter_sitemap_pages(loader, fetcher=fetcher)
+    return crawl_pages(loader, fetcher=fetcher)
+
+
+def page_to_document(loader: WebLoader, page: RawPage) -> Optional[Document]:
+    """Extract a document from a page the way the loader itself would."""
+    if isinstance(loader, SitemapLoader):
+        parser = "xml" if page.url.endswith(".xml") else loader.default_parser
+        soup = BeautifulSoup(page.html, parser, **loader.bs_kwargs)
+        return Document(
+            page_content=loader.parsing_function(soup),
+            metadata=loader.meta_function(page.meta, soup),
+        )
+
+    content = loader.extractor(page.html)
+    if not content:
+        return None
+    return Document(
+        page_content=content,
+        metadata=loader.metadata_extractor(page.html, page.url, page),
+    )
+
+
+def get_cached_document(
+    fetcher: Optional[CachedFetcher], parse_key: str, page: RawPage
+) -> Optional[Document]:
+    """Return the document extracted last time if the page's bytes are unchanged."""
+    if fetcher is None or page.changed or page.sha256 is None:
+        return None
+    return fetcher.cache.get_parsed(page.url, parse_key, page.sha256)
+
+
+def cache_document(
+    fetcher: Optional[CachedFetcher],
+    parse_key: str,
+    page: RawPage,
+    document: Optional[Document],
+) -> None:
+    if fetcher is not None and page.sha256 is not None and document is not None:
+        fetcher.cache.put_parsed(page.url, parse_key, page.sha256, document)
@@ -0,0 +1,334 @@
+"""Near-duplicate detection of chunks with MinHash and LSH.
+
+The doc sources overlap: versioned pages, pages mirrored between the docs and
+the API reference, and boilerplate blocks repeated on every page. Each chunk is
+reduced to a MinHash signature of its word shingles. Chunks whose signatures
+share a band are candidates, and a candidate whose estimated Jaccard similarity
+with another chunk reaches the threshold is a near-duplicate.
+
+Of near-duplicates, the copy kept is the one with the smallest rank: the URL of
+its page, then its position in the page. Sources stream in concurrently, so the
+kept copy must not depend on the order chunks arrive in, or the index would
+churn between runs. The filter works on a stream, so a chunk is dropped when a
+near-duplicate of smaller rank was kept before it, in this run or the previous
+one. A copy seen before the smaller one, in a run without a previous one, is
+kept as well and dropped from the next run on. A near-duplicate of a chunk the
+previous run had but this one does not is dropped for one run.
+
+Hashing is vectorized with numpy: each shingle is hashed once and all the
+permutations are applied to the whole shingle array at once.
+
+Signatures and buckets are kept in memory, or with a `path` in a SQLite database,
+so that memory does not grow with the corpus and the previous run is remembered.
+A resumed ingestion run `forget`s the chunks of the pages that were not indexed
+before the crash, which are then fed to the filter again.
+"""
+import logging
+import re
+import sqlite3
+import threading
+import zlib
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional, Union
+from urllib.parse import urlparse
+
+import numpy as np
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+_WORD_REGEX = re.compile(r"\w+")
+
+# Multiplier combining the hashes of the words of a shingle.
+_SHINGLE_BASE = np.uint64(0x100000001B3)
+
+# The page URL of a chunk and its position in the page.
+Rank = tuple[str, int]
+
+# Entries are written in transactions of this many chunks. A crash loses the
+# last one, so a few near-duplicates of those chunks may get through on resume.
+_COMMIT_EVERY = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS generations (id INTEGER PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS signatures (
+    id INTEGER PRIMARY KEY,
+    generation INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    signature BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS signatures_key ON signatures (generation, key);
+CREATE TABLE IF NOT EXISTS buckets (
+    bucket BLOB NOT NULL,
+    id INTEGER NOT NULL,
+    PRIMARY KEY (bucket, id)
+) WITHOUT ROWID;
+"""
+
+
+def _source_host(doc: Document) -> str:
+    return urlparse(doc.metadata.get("source", "")).netloc or "unknown"
+
+
+class _MemoryIndex:
+    """Ranked signatures by LSH bucket, in memory."""
+
+    def __init__(self) -> None:
+        self.generation = 1
+        self._buckets: dict[bytes, list[int]] = {}
+        self._entries: list[Optional[tuple[int, Rank, np.ndarray]]] = []
+
+    def candidates(self, buckets: list[bytes]) -> Iterator[tuple[Rank, np.ndarray]]:
+        ids = {i for bucket in buckets for i in self._buckets.get(bucket, ())}
+        for i in ids:
+            entry = self._entries[i]
+            if entry is not None:
+                yield entry[1], entry[2]
+
+    def insert(self, buckets: list[bytes], signature: np.ndarray, rank: Rank) -> None:
+        i = len(self._entries)
+        self._entries.append((self.generation, rank, signature))
+        for bucket in buckets:
+            self._buckets.setdefault(bucket, []).append(i)
+
+    def forget(self, keys: set[str]) -> None:
+        for i, entry in enumerate(self._entries):
+            if (
+                entry is not None
+                and entry[0] == self.generation
+                and entry[1][0] in keys
+            ):
+                self._entries[i] = None
+
+    def start_generation(self) -> None:
+        for i, entry in enumerate(self._entries):
+            if entry is not None and entry[0] < self.generation:
+                self._entries[i] = None
+        self.generation += 1
+
+    def close(self) -> None:
+        pass
+
+
+class _SQLiteIndex:
+    """Ranked signatures by LSH bucket, in a SQLite database."""
+
+    def __init__(self, path: Union[str, Path]):
+        if path:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # The filter is fed from a background thread of the ingestion pipeline.
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._uncommitted = 0
+        (generation,) = self._conn.execute("SELECT MAX(id) FROM generations").fetchone()
+        if generation is None:
+            self.start_generation()
+        else:
+            self.generation = generation
+
+    def candidates(self, buckets: list[bytes]) -> Iterator[tuple[Rank, np.ndarray]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, position, signature FROM signatures WHERE id IN "
+                "(SELECT id FROM buckets WHERE bucket IN "
+                f"({', '.join('?' * len(buckets))}))",
+                buckets,
+            ).fetchall()
+        for key, position, blob in rows:
+            yield (key, position), np.frombuffer(blob, dtype=np.uint32)
+
+    def insert(self, buckets: list[bytes], signature: np.ndarray, rank: Rank) -> None:
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO signatures (generation, key, position, signature) "
+                "VALUES (?, ?, ?, ?)",
+                (self.generation, *rank, signature.tobytes()),
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO buckets VALUES (?, ?)",
+                ((bucket, cursor.lastrowid) for bucket in buckets),
+            )
+            self._uncommitted += 1
+            if self._uncommitted >= _COMMIT_EVERY:
+                self._conn.commit()
+                self._uncommitted = 0
+
+    def _delete(self, where: str, params: tuple) -> None:
+        self._conn.execute(
+            f"DELETE FROM buckets WHERE id IN (SELECT id FROM signatures WHERE {where})",
+            params,
+        )
+        self._conn.execute(f"DELETE FROM signatures WHERE {where}", params)
+
+    def forget(self, keys: set[str]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("CREATE TEMP TABLE forgotten (key TEXT PRIMARY KEY)")
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO forgotten VALUES (?)", ((k,) for k in keys)
+            )
+            self._delete(
+                "generation = ? AND key IN (SELECT key FROM forgotten)",
+                (self.generation,),
+            )
+            self._conn.execute("DROP TABLE forgotten")
+
+    def start_generation(self) -> None:
+        with self._lock, self._conn:
+            cursor = self._conn.execute("INSERT INTO generations DEFAULT VALUES")
+            self.generation = cursor.lastrowid
+            # Only the previous generation is consulted.
+            self._delete("generation < ?", (self.generation - 1,))
+            self._conn.execute(
+                "DELETE FROM generations WHERE id < ?", (self.generation - 1,)
+            )
+        self._uncommitted = 0
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+
+class NearDuplicateFilter:
+    """Remembers the chunks it has seen and flags near-duplicates of them.
+
+    With `num_perm` hashes split into `bands` bands, two chunks become
+    candidates with a probability that rises steeply around a similarity of
+    `(1 / bands) ** (bands / num_perm)`; candidates are then checked against
+    `threshold` using their full signatures.
+
+    Each call to `start_generation` starts a run, keeping the chunks of the
+    previous run as references. With a `path`, the signatures are stored in a
+    SQLite database there and kept across instances, an empty path being a
+    temporary database deleted on `close`. Without one, they are kept in memory.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.8,
+        num_perm: int = 128,
+        bands: int = 16,
+        shingle_size: int = 5,
+        seed: int = 0,
+        path: Optional[Union[str, Path]] = None,
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        # Odd multipliers for multiply-shift hashing of the shingle hashes.
+        self._a = rng.integers(1, 2**63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64)
+        self._word_hashes: dict[str, int] = {}
+        self._index: Union[_MemoryIndex, _SQLiteIndex] = (
+            _MemoryIndex() if path is None else _SQLiteIndex(path)
+        )
+        self._positions: Counter[str] = Counter()
+
+    def _hash_words(self, text: str) -> np.ndarray:
+        words = _WORD_REGEX.findall(text.lower())
+        hashes = np.empty(len(words), dtype=np.uint64)
+        for i, word in enumerate(words):
+            h = self._word_hashes.get(word)
+            if h is None:
+                h = self._word_hashes[word] = zlib.crc32(word.encode("utf-8"))
+            hashes[i] = h
+        return hashes
+
+    def _shingle_hashes(self, text: str) -> np.ndarray:
+        words = self._hash_words(text)
+        k = min(self.shingle_size, len(words))
+        if k == 0:
+            return words
+        n = len(words) - k + 1
+        shingles = np.zeros(n, dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            for j in range(k):
+                shingles = shingles * _SHINGLE_BASE + words[j : j + n]
+        return np.unique(shingles)
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """The MinHash signature of `text`, or None if it has no words."""
+        shingles = self._shingle_hashes(text)
+        if not len(shingles):
+            return None
+        with np.errstate(over="ignore"):
+            hashed = (shingles[:, None] * self._a + self._b) >> np.uint64(32)
+        return hashed.min(axis=0).astype(np.uint32)
+
+    def add(self, text: str, key: Optional[str] = None) -> bool:
+        """Record `text` unless it is a near-duplicate of a recorded chunk of
+        smaller rank. Returns whether it was a near-duplicate.
+
+        `key` is the page `text` is a chunk of, whose chunks must be added in
+        order. Texts without a key rank in the order they are added.
+        """
+        key = key or ""
+        rank = (key, self._positions[key])
+        self._positions[key] += 1
+        signature = self.signature(text)
+        if signature is None:
+            return False
+        buckets = [
+            bytes([band])
+            + signature[band * self.rows : (band + 1) * self.rows].tobytes()
+            for band in range(self.bands)
+        ]
+        for candidate_rank, candidate in self._index.candidates(buckets):
+            if candidate_rank < rank:
+                similarity = np.count_nonzero(candidate == signature)
+                if similarity / self.num_perm >= self.threshold:
+                    return True
+
+        self._index.insert(buckets, signature, rank)
+        return False
+
+    def forget(self, keys: Iterable[str]) -> None:
+        """Forget the chunks of `keys` added in this run."""
+        keys = set(keys)
+        self._index.forget(keys)
+        for key in keys:
+            self._positions.pop(key, None)
+
+    def start_generation(self) -> None:
+        """Start a new run, forgetting all but the chunks of the last one."""
+        self._index.start_generation()
+        self._positions.clear()
+
+    def close(self) -> None:
+        self._index.close()
+
+
+def drop_near_duplicates(
+    docs: Iterable[Document],
+    dedup: NearDuplicateFilter,
+    group_by: Callable[[Document], str] = _source_host,
+) -> Iterator[Document]:
+    """Drop docs that are near-duplicates of docs of smaller rank.
+
+    Once the stream is exhausted, logs the duplicate rate of every group of
+    docs (by default the host they were crawled from).
+    """
+    seen: Counter[str] = Counter()
+    dropped: Counter[str] = Counter()
+    for doc in docs:
+        group = group_by(doc)
+        seen[group] += 1
+        if dedup.add(doc.page_content, key=doc.metadata.get("source")):
+            dropped[group] += 1
+            continue
+        yield doc
+
+    for group in sorted(seen):
+        logger.info(
+            f"Dropped {dropped[group]}/{seen[group]} chunks from {group} as "
+            f"near-duplicates ({dropped[group] / seen[group]:.1%})"
+        )
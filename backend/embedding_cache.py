@@ -0,0 +1,366 @@
+"""Persistent, content-addressed cache of document embeddings.
+
+Embeddings are keyed by `(model name, sha256(text))`. Each model gets its own
+directory holding the vectors as one contiguous float32, float16 or int8 array,
+read through a memory map, and a SQLite index from text hash to row::
+
+    <cache dir>/<model name>/index.sqlite
+    <cache dir>/<model name>/vectors.<version>.bin
+    <cache dir>/<model name>/quantizer.npz      int8 stores only
+
+int8 stores take a quarter of the space of float32 ones, see
+`backend.quantization.Int8Quantizer`. Their quantizer is calibrated on the first
+batch of vectors written, so that batch should be a representative sample, as
+the hundreds of chunks an ingestion batch holds are.
+
+Every ingestion run starts a new generation and stamps the entries of all the
+chunks it sees, so `gc` can drop entries that no recent run referenced:
+
+    python -m backend.embedding_cache gc --cache-dir .cache/embeddings \\
+        --model text-embedding-3-small --keep-generations 2
+"""
+import argparse
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from backend.quantization import Int8Quantizer
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS embeddings (
+    key TEXT PRIMARY KEY,
+    row INTEGER NOT NULL,
+    generation INTEGER NOT NULL
+);
+"""
+
+# SQLite limits the number of bound parameters per statement.
+_SQL_BATCH_SIZE = 500
+
+DTYPES = ("float32", "float16", "int8")
+# Below this many vectors, an int8 quantizer is calibrated on a single range
+# shared by every dimension, as per-dimension percentiles would be unreliable.
+MIN_CALIBRATION_SIZE = 64
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """Embeddings of a single model, stored as rows of a memory-mapped array."""
+
+    def __init__(self, path: str | Path, model: str, dtype: str = "float32"):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported dtype '{dtype}'")
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.model = model
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(
+            self.path / "index.sqlite", check_same_thread=False
+        )
+        self._conn.executescript(_SCHEMA)
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO meta VALUES ('model', ?), ('dtype', ?), "
+                "('generation', '0'), ('version', '0')",
+                (model, dtype),
+            )
+        stored_model = self._get_meta("model")
+        if stored_model != model:
+            raise ValueError(
+                f"Embedding store at {self.path} belongs to model '{stored_model}'"
+            )
+        self.dtype = np.dtype(self._get_meta("dtype"))
+        dim = self._get_meta("dim")
+        self.dim: Optional[int] = int(dim) if dim is not None else None
+        self._vectors: Optional[np.memmap] = None
+        self._quantizer: Optional[Int8Quantizer] = None
+        if self._quantizer_path.exists():
+            self._quantizer = Int8Quantizer.load(self._quantizer_path)
+        self._truncate_partial_row()
+
+    @classmethod
+    def open(
+        cls, cache_dir: str | Path, model: str, dtype: str = "float32"
+    ) -> "EmbeddingStore":
+        return cls(Path(cache_dir) / model.replace("/", "_"), model, dtype=dtype)
+
+    def close(self) -> None:
+        with self._lock:
+            self._vectors = None
+            self._conn.close()
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def _set_meta(self, key: str, value: str) -> None:
+        self._conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    @property
+    def generation(self) -> int:
+        with self._lock:
+            return int(self._get_meta("generation") or 0)
+
+    @property
+    def _vectors_path(self) -> Path:
+        return self.path / f"vectors.{self._get_meta('version')}.bin"
+
+    @property
+    def _quantizer_path(self) -> Path:
+        return self.path / "quantizer.npz"
+
+    def _calibrate(self, array: np.ndarray) -> Int8Quantizer:
+        if len(array) >= MIN_CALIBRATION_SIZE:
+            quantizer = Int8Quantizer.fit(array)
+        else:
+            bound = float(np.abs(array).max()) or 1.0
+            quantizer = Int8Quantizer(
+                offset=np.full(array.shape[1], -bound),
+                scale=np.full(array.shape[1], 2 * bound / 255),
+            )
+        quantizer.save(self._quantizer_path)
+        return quantizer
+
+    def _encode(self, array: np.ndarray) -> np.ndarray:
+        if self.dtype != np.int8:
+            return array.astype(self.dtype)
+        if self._quantizer is None:
+            self._quantizer = self._calibrate(array)
+        return self._quantizer.encode(array)
+
+    def _decode(self, rows: np.ndarray) -> np.ndarray:
+        if self.dtype != np.int8:
+            return np.asarray(rows, dtype=np.float32)
+        assert self._quantizer is not None
+        return self._quantizer.decode(np.asarray(rows))
+
+    @property
+    def _row_nbytes(self) -> int:
+        assert self.dim is not None
+        return self.dim * self.dtype.itemsize
+
+    def _num_rows(self) -> int:
+        if self.dim is None or not self._vectors_path.exists():
+            return 0
+        return self._vectors_path.stat().st_size // self._row_nbytes
+
+    def _truncate_partial_row(self) -> None:
+        # A crash in the middle of an append can leave a partial row behind.
+        if self.dim is not None and self._vectors_path.exists():
+            size = self._vectors_path.stat().st_size
+            if size % self._row_nbytes:
+                os.truncate(self._vectors_path, size - size % self._row_nbytes)
+
+    def _mapped_vectors(self, min_rows: int) -> np.memmap:
+        if self._vectors is None or len(self._vectors) < min_rows:
+            self._vectors = np.memmap(
+                self._vectors_path,
+                dtype=self.dtype,
+                mode="r",
+                shape=(self._num_rows(), self.dim),
+            )
+        return self._vectors
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, keys: Sequence[str]) -> dict[str, np.ndarray]:
+        """Return the cached vectors (as float32) of the given keys, if any."""
+        with self._lock:
+            rows: dict[str, int] = {}
+            for start in range(0, len(keys), _SQL_BATCH_SIZE):
+                batch = keys[start : start + _SQL_BATCH_SIZE]
+                rows.update(
+                    self._conn.execute(
+                        "SELECT key, row FROM embeddings WHERE key IN "
+                        f"({','.join('?' * len(batch))})",
+                        batch,
+                    ).fetchall()
+                )
+            if not rows:
+                return {}
+            vectors = self._mapped_vectors(max(rows.values()) + 1)
+            decoded = self._decode(vectors[list(rows.values())])
+            return dict(zip(rows, decoded))
+
+    def all_vectors(self) -> np.ndarray:
+        """Every stored vector, in the order they were added.
+
+        float vectors are memory-mapped, int8 ones are decoded to float32.
+        """
+        with self._lock:
+            if not (num_rows := self._num_rows()):
+                dtype = np.float32 if self.dtype == np.int8 else self.dtype
+                return np.empty((0, self.dim or 0), dtype=dtype)
+            vectors = self._mapped_vectors(num_rows)
+            return self._decode(vectors) if self.dtype == np.int8 else vectors
+
+    def put_many(self, items: dict[str, Sequence[float]]) -> None:
+        """Append new vectors to the store, stamped with the current generation."""
+        if not items:
+            return
+        with self._lock:
+            new_keys = set(items) - set(self.get_many(list(items)))
+            if not new_keys:
+                return
+            keys = [key for key in items if key in new_keys]
+            array = np.asarray([items[key] for key in keys], dtype=np.float32)
+            if self.dim is None:
+                self.dim = array.shape[1]
+                with self._conn:
+                    self._set_meta("dim", str(self.dim))
+            elif array.shape[1] != self.dim:
+                raise ValueError(
+                    f"Expected embeddings of dimension {self.dim}, got {array.shape[1]}"
+                )
+
+            first_row = self._num_rows()
+            with open(self._vectors_path, "ab") as f:
+                f.write(self._encode(array).tobytes())
+            generation = int(self._get_meta("generation") or 0)
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO embeddings VALUES (?, ?, ?)",
+                    ((key, first_row + i, generation) for i, key in enumerate(keys)),
+                )
+
+    def start_generation(self) -> int:
+        with self._lock, self._conn:
+            generation = int(self._get_meta("generation") or 0) + 1
+            self._set_meta("generation", str(generation))
+        return generation
+
+    def touch(self, keys: Iterable[str]) -> None:
+        """Mark the given keys as referenced by the current generation."""
+        keys = list(keys)
+        with self._lock, self._conn:
+            generation = int(self._get_meta("generation") or 0)
+            for start in range(0, len(keys), _SQL_BATCH_SIZE):
+                batch = keys[start : start + _SQL_BATCH_SIZE]
+                self._conn.execute(
+                    "UPDATE embeddings SET generation = ? WHERE key IN "
+                    f"({','.join('?' * len(batch))})",
+                    [generation, *batch],
+                )
+
+    def gc(self, keep_generations: int = 1) -> int:
+        """Drop entries not referenced in the last `keep_generations` generations.
+
+        The surviving vectors are compacted into a new file, which replaces the
+        old one in the same transaction that rewrites the index.
+        """
+        with self._lock:
+            min_generation = (
+                int(self._get_meta("generation") or 0) - keep_generations + 1
+            )
+            live = self._conn.execute(
+                "SELECT key, row FROM embeddings WHERE generation >= ? ORDER BY row",
+                (min_generation,),
+            ).fetchall()
+            num_dropped = len(self) - len(live)
+            if not num_dropped:
+                return 0
+
+            old_path = self._vectors_path
+            version = int(self._get_meta("version") or 0) + 1
+            new_path = self.path / f"vectors.{version}.bin"
+            if live:
+                vectors = self._mapped_vectors(live[-1][1] + 1)
+                with open(new_path, "wb") as f:
+                    for start in range(0, len(live), _SQL_BATCH_SIZE):
+                        rows = [row for _, row in live[start : start + _SQL_BATCH_SIZE]]
+                        f.write(np.ascontiguousarray(vectors[rows]).tobytes())
+            else:
+                new_path.touch()
+
+            with self._conn:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE generation < ?", (min_generation,)
+                )
+                self._conn.executemany(
+                    "UPDATE embeddings SET row = ? WHERE key = ?",
+                    ((new_row, key) for new_row, (key, _) in enumerate(live)),
+                )
+                self._set_meta("version", str(version))
+            self._vectors = None
+            old_path.unlink(missing_ok=True)
+            self._conn.execute("VACUUM")
+        return num_dropped
+
+
+class CachedEmbeddings(Embeddings):
+    """Read-through cache in front of another embeddings model.
+
+    Only texts missing from the store are sent to the underlying model.
+    Queries are not cached and go straight to the underlying model.
+    """
+
+    def __init__(self, underlying: Embeddings, store: EmbeddingStore):
+        self.underlying = underlying
+        self.store = store
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        keys = [text_key(text) for text in texts]
+        cached = self.store.get_many(keys)
+        missing = {key: text for key, text in zip(keys, texts) if key not in cached}
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            new = dict(zip(missing, vectors))
+            self.store.put_many(new)
+            cached.update(self.store.get_many(list(new)))
+        logger.debug(f"Embedding cache: {len(texts) - len(missing)}/{len(texts)} hits")
+        return [cached[key].tolist() for key in keys]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.underlying.embed_query(text)
+
+    def touch(self, texts: Iterable[str]) -> None:
+        """Mark the embeddings of `texts` as still referenced by the index."""
+        self.store.touch(text_key(text) for text in texts)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    gc_parser = subparsers.add_parser(
+        "gc", help="Drop entries not referenced by recent ingestion runs"
+    )
+    gc_parser.add_argument("--cache-dir", default=os.environ.get("EMBEDDING_CACHE_DIR"))
+    gc_parser.add_argument("--model", required=True)
+    gc_parser.add_argument(
+        "--keep-generations",
+        type=int,
+        default=2,
+        help="Number of most recent ingestion runs whose entries are kept",
+    )
+    args = parser.parse_args()
+    if not args.cache_dir:
+        parser.error("--cache-dir or EMBEDDING_CACHE_DIR is required")
+
+    logging.basicConfig(level=logging.INFO)
+    store = EmbeddingStore.open(args.cache_dir, args.model)
+    num_dropped = store.gc(keep_generations=args.keep_generations)
+    logger.info(f"Dropped {num_dropped} embeddings, {len(store)} left")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+"""Token-aware, concurrent embedding of documents for ingestion.
+
+`OpenAIEmbeddings(chunk_size=200)` sends batches of 200 texts one after the
+other, whatever their size. `ScheduledEmbeddings` instead packs texts into
+requests by token count, up to the provider's per-request limits, and keeps
+several requests in flight. The number of requests in flight adapts to rate
+limiting: it grows by one after a run of successful requests and is halved on
+every 429, whose request is retried after an exponential backoff (or the
+server's `Retry-After`).
+
+Texts over the model's context length are split into pieces that fit, and
+their embedding is the average of the pieces' embeddings weighted by their
+token counts, as `OpenAIEmbeddings` does.
+"""
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from itertools import groupby
+from typing import Any, Callable, Optional
+
+import numpy as np
+import openai
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+# Limits of the OpenAI embeddings endpoint.
+MAX_TOKENS_PER_REQUEST = 300_000
+MAX_INPUTS_PER_REQUEST = 2048
+MAX_TOKENS_PER_INPUT = 8191
+
+TokenCounter = Callable[[list[str]], list[int]]
+# Splits a text into pieces of at most the given number of tokens.
+TextSplitter = Callable[[str, int], list[str]]
+
+
+def _tiktoken_encoding(model: str) -> Any:
+    import tiktoken
+
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def tiktoken_counter(model: str) -> TokenCounter:
+    encoding = _tiktoken_encoding(model)
+
+    def count_tokens(texts: list[str]) -> list[int]:
+        return [len(tokens) for tokens in encoding.encode_ordinary_batch(texts)]
+
+    return count_tokens
+
+
+def tiktoken_splitter(model: str) -> TextSplitter:
+    encoding = _tiktoken_encoding(model)
+
+    def split_text(text: str, max_tokens: int) -> list[str]:
+        tokens = encoding.encode_ordinary(text)
+        return [
+            encoding.decode(tokens[i : i + max_tokens])
+            for i in range(0, len(tokens), max_tokens)
+        ]
+
+    return split_text
+
+
+def pack_batches(
+    token_counts: list[int], max_tokens: int, max_inputs: int
+) -> list[list[int]]:
+    """Group text indices, in order, into batches within both limits."""
+    batches: list[list[int]] = []
+    batch: list[int] = []
+    batch_tokens = 0
+    for i, num_tokens in enumerate(token_counts):
+        if batch and (
+            batch_tokens + num_tokens > max_tokens or len(batch) >= max_inputs
+        ):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(i)
+        batch_tokens += num_tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class AdaptiveLimiter:
+    """Concurrency limit with additive increase and multiplicative decrease."""
+
+    def __init__(self, initial: int, maximum: int, increase_after: int = 4):
+        self.limit = max(1, min(initial, maximum))
+        self.maximum = maximum
+        self.increase_after = increase_after
+        self._in_flight = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._cond:
+            self._cond.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+
+    def release(self, rate_limited: bool = False) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            if rate_limited:
+                self.limit = max(1, self.limit // 2)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.increase_after * self.limit:
+                    self.limit = min(self.maximum, self.limit + 1)
+                    self._successes = 0
+            self._cond.notify_all()
+
+
+@dataclass
+class EmbeddingStats:
+    requests: int = 0
+    retries: int = 0
+    rate_limited: int = 0
+    texts: int = 0
+    tokens: int = 0
+    # Wall time during which at least one `embed_documents` call was running,
+    # so concurrent calls are not counted twice.
+    seconds: float = 0.0
+    _lock: threading.Lock = field(
+        default_factory=threading.Lock, repr=False, compare=False
+    )
+    _active: int = field(default=0, repr=False, compare=False)
+    _busy_since: float = field(default=0.0, repr=False, compare=False)
+
+    def begin(self) -> None:
+        with self._lock:
+            if not self._active:
+                self._busy_since = time.perf_counter()
+            self._active += 1
+
+    def end(self) -> None:
+        with self._lock:
+            self._active -= 1
+            if not self._active:
+                self.seconds += time.perf_counter() - self._busy_since
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.tokens / self.seconds if self.seconds else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "texts": self.texts,
+            "tokens": self.tokens,
+            "seconds": round(self.seconds, 3),
+            "tokens_per_second": round(self.tokens_per_second, 1),
+        }
+
+
+class ScheduledEmbeddings(Embeddings):
+    """OpenAI embeddings with token-based batching and adaptive concurrency.
+
+    Retries are handled here rather than by the client (`max_retries=0`), so
+    that rate limiting also lowers the concurrency. Requests failing with a
+    429, a 5xx or a connection error are retried up to `max_retries` times.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        *,
+        client: Optional[openai.OpenAI] = None,
+        max_tokens_per_request: int = MAX_TOKENS_PER_REQUEST,
+        max_inputs_per_request: int = MAX_INPUTS_PER_REQUEST,
+        max_tokens_per_input: int = MAX_TOKENS_PER_INPUT,
+        max_concurrency: int = 8,
+        initial_concurrency: int = 2,
+        max_retries: int = 8,
+        initial_backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        count_tokens: Optional[TokenCounter] = None,
+        split_text: Optional[TextSplitter] = None,
+    ):
+        self.model = model
+        self.client = client or openai.OpenAI(max_retries=0)
+        self.max_tokens_per_request = max_tokens_per_request
+        self.max_inputs_per_request = max_inputs_per_request
+        self.max_tokens_per_input = max_tokens_per_input
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.limiter = AdaptiveLimiter(initial_concurrency, max_concurrency)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="embed"
+        )
+        self._count_tokens = count_tokens
+        self._split_text = split_text
+        self.stats = EmbeddingStats()
+
+    def count_tokens(self, texts: list[str]) -> list[int]:
+        if self._count_tokens is None:
+            self._count_tokens = tiktoken_counter(self.model)
+        return self._count_tokens(texts)
+
+    def split_text(self, text: str) -> list[str]:
+        if self._split_text is None:
+            self._split_text = tiktoken_splitter(self.model)
+        return self._split_text(text, self.max_tokens_per_input)
+
+    def _fit_context(
+        self, texts: list[str], token_counts: list[int]
+    ) -> tuple[list[str], list[int], list[int]]:
+        """Split the texts over the context length, return the pieces, their
+        token counts and the index of the text each comes from."""
+        pieces: list[str] = []
+        piece_counts: list[int] = []
+        owners: list[int] = []
+        for i, (text, num_tokens) in enumerate(zip(texts, token_counts)):
+            if num_tokens <= self.max_tokens_per_input:
+                parts, counts = [text], [num_tokens]
+            else:
+                parts = self.split_text(text)
+                counts = self.count_tokens(parts)
+            pieces.extend(parts)
+            piece_counts.extend(counts)
+            owners.extend([i] * len(parts))
+        return pieces, piece_counts, owners
+
+    def _backoff(self, attempt: int, error: openai.APIError) -> float:
+        delay = min(self.max_backoff, self.initial_backoff * 2**attempt)
+        response = getattr(error, "response", None)
+        if response is not None:
+            try:
+                retry_after = float(response.headers["Retry-After"])
+            except (KeyError, ValueError):
+                pass
+            else:
+                # Capped, so that a bogus value does not stall every worker.
+                if retry_after >= 0:
+                    delay = min(self.max_backoff, retry_after)
+        # Jittered, so that the rate-limited workers do not retry in lockstep.
+        return delay * random.uniform(0.5, 1.0)
+
+    def _embed_batch(self, texts: list[str], num_tokens: int) -> list[list[float]]:
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            rate_limited = False
+            try:
+                response = self.client.embeddings.create(model=self.model, input=texts)
+            except openai.RateLimitError as e:
+                rate_limited, error = True, e
+            except openai.InternalServerError as e:
+                error = e
+            except (openai.APIConnectionError, openai.APITimeoutError) as e:
+                error = e
+            else:
+                with self.stats._lock:
+                    self.stats.requests += 1
+                    self.stats.texts += len(texts)
+                    self.stats.tokens += num_tokens
+                return [
+                    item.embedding
+                    for item in sorted(response.data, key=lambda item: item.index)
+                ]
+            finally:
+                self.limiter.release(rate_limited=rate_limited)
+
+            if attempt == self.max_retries:
+                raise error
+            delay = self._backoff(attempt, error)
+            with self.stats._lock:
+                self.stats.retries += 1
+                self.stats.rate_limited += rate_limited
+            logger.warning(
+                f"Embedding request failed ({error.__class__.__name__}), retrying "
+                f"in {delay:.1f}s with concurrency {self.limiter.limit}"
+            )
+            time.sleep(delay)
+        raise AssertionError("unreachable")
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        self.stats.begin()
+        try:
+            return self._embed_documents(texts)
+        finally:
+            self.stats.end()
+
+    def _embed_documents(self, texts: list[str]) -> list[list[float]]:
+        start = time.perf_counter()
+        pieces, token_counts, owners = self._fit_context(
+            texts, self.count_tokens(texts)
+        )
+        batches = pack_batches(
+            token_counts, self.max_tokens_per_request, self.max_inputs_per_request
+        )
+        futures = [
+            self.executor.submit(
+                self._embed_batch,
+                [pieces[i] for i in batch],
+                sum(token_counts[i] for i in batch),
+            )
+            for batch in batches
+        ]
+        vectors = [vector for future in futures for vector in future.result()]
+        elapsed = time.perf_counter() - start
+        logger.debug(
+            f"Embedded {len(texts)} texts ({sum(token_counts)} tokens) in "
+            f"{len(batches)} requests, {sum(token_counts) / elapsed:.0f} tokens/s"
+        )
+        if len(pieces) == len(texts):
+            return vectors
+
+        embeddings: list[list[float]] = []
+        # Pieces are in the order of their texts.
+        for _, group in groupby(range(len(pieces)), key=owners.__getitem__):
+            parts = list(group)
+            if len(parts) == 1:
+                embeddings.append(vectors[parts[0]])
+                continue
+            average = np.average(
+                [vectors[j] for j in parts],
+                axis=0,
+                weights=[token_counts[j] for j in parts],
+            )
+            embeddings.append((average / np.linalg.norm(average)).tolist())
+        return embeddings
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
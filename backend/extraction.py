@@ -0,0 +1,259 @@
+"""Parallel extraction and splitting of crawled pages.
+
+Parsing HTML with BeautifulSoup and splitting the result are CPU-bound and hold
+the GIL, so they run in a process pool. Raw pages are shipped to the workers in
+chunks and each worker sends back compact `(text, metadata)` records rather than
+`Document` objects. Results are yielded in the order the pages were submitted,
+so the output does not depend on which worker finishes first.
+
+Loaders often hold lambdas and other unpicklable state, so the workers do not
+receive them: each worker builds its own loaders once, from module-level
+factories keyed by source name.
+"""
+import logging
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, NamedTuple, Optional, Union
+
+from langchain.text_splitter import TextSplitter
+from langchain_core.documents import Document
+
+from backend.crawl import RawPage, WebLoader, batched, cache_document, page_to_document
+from backend.http_cache import CachedFetcher
+from backend.telemetry import IngestionTelemetry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 16
+
+LoaderFactory = Callable[[], WebLoader]
+
+# One splitter for every source, or one per source name.
+TextSplitters = Union[TextSplitter, dict[str, TextSplitter]]
+
+# (text, metadata) of one chunk.
+Record = tuple[str, dict]
+
+# Called in the calling process with each task, its chunks and, if known, the
+# document they were split from, in order.
+ExtractedCallback = Callable[["ExtractionTask", list[Record], Optional[Document]], None]
+
+
+class ExtractionTask(NamedTuple):
+    """A crawled page to extract, or what was already extracted from it.
+
+    A task with neither a page, a document nor records marks the end of its
+    source: it comes after all the source's other tasks.
+    """
+
+    source: str
+    page: Optional[RawPage] = None
+    # Set when the document was found in the parse cache; the page is not
+    # needed then and is left out so that it is not shipped to a worker.
+    document: Optional[Document] = None
+    # Set when the page's chunks are already known, e.g. from a journal.
+    records: Optional[list[Record]] = None
+    # The page's URL, when there is no page.
+    url: Optional[str] = None
+
+    @property
+    def page_url(self) -> Optional[str]:
+        return self.page.url if self.page is not None else self.url
+
+    @property
+    def is_end_of_source(self) -> bool:
+        return self.page is None and self.document is None and self.records is None
+
+
+class ExtractionResult(NamedTuple):
+    records: list[Record]
+    # The newly extracted document, returned only when it is to be cached.
+    document: Optional[Document] = None
+    error: Optional[str] = None
+    # Time the worker spent extracting the page and splitting the document.
+    extract_seconds: float = 0.0
+    split_seconds: float = 0.0
+
+
+# Per-process state, set up by `_init_worker`.
+_loaders: dict[str, WebLoader] = {}
+_text_splitter: Optional[TextSplitters] = None
+
+
+def _init_worker(
+    loader_factories: dict[str, LoaderFactory], text_splitter: TextSplitters
+) -> None:
+    global _text_splitter
+    _loaders.clear()
+    _loaders.update({name: factory() for name, factory in loader_factories.items()})
+    _text_splitter = text_splitter
+
+
+def _extract_chunk(
+    tasks: list[ExtractionTask], return_documents: bool
+) -> list[ExtractionResult]:
+    """Extract and split a chunk of tasks, one result per task.
+
+    A page that fails to extract does not fail the rest of the chunk, its error
+    is reported in its result instead.
+    """
+    assert _text_splitter is not None, "worker was not initialized"
+    results: list[ExtractionResult] = []
+    for task in tasks:
+        if task.records is not None or task.is_end_of_source:
+            results.append(ExtractionResult(task.records or []))
+            continue
+        try:
+            start = time.perf_counter()
+            doc, extracted = task.document, None
+            if doc is None:
+                assert task.page is not None
+                doc = extracted = page_to_document(_loaders[task.source], task.page)
+            split_start = time.perf_counter()
+            splitter = (
+                _text_splitter[task.source]
+                if isinstance(_text_splitter, dict)
+                else _text_splitter
+            )
+            chunks = splitter.split_documents([doc]) if doc is not None else []
+        except Exception as e:
+            results.append(ExtractionResult([], error=f"{e.__class__.__name__}: {e}"))
+            continue
+        results.append(
+            ExtractionResult(
+                [(chunk.page_content, chunk.metadata) for chunk in chunks],
+                document=extracted if return_documents else None,
+                extract_seconds=split_start - start,
+                split_seconds=time.perf_counter() - split_start,
+            )
+        )
+    return results
+
+
+def _to_documents(
+    tasks: list[ExtractionTask],
+    results: list[ExtractionResult],
+    fetcher: Optional[CachedFetcher],
+    errors: Optional[dict[str, BaseException]],
+    on_extracted: Optional[ExtractedCallback],
+    telemetry: Optional[IngestionTelemetry],
+    source_key: Optional[str],
+) -> Iterator[Document]:
+    for task, result in zip(tasks, results):
+        if result.error is not None:
+            logger.warning(
+                f"Failed to extract {task.page_url} from {task.source}: {result.error}"
+            )
+            if errors is not None:
+                errors.setdefault(task.source, RuntimeError(result.error))
+            continue
+        if result.document is not None and task.page is not None:
+            cache_document(fetcher, task.source, task.page, result.document)
+        if telemetry is not None and task.records is None and not task.is_end_of_source:
+            if task.page is not None:
+                telemetry.add(
+                    "extract",
+                    items=1,
+                    bytes=len(task.page.html),
+                    seconds=result.extract_seconds,
+                )
+            telemetry.add(
+                "split",
+                items=len(result.records),
+                bytes=sum(len(text) for text, _ in result.records),
+                seconds=result.split_seconds,
+            )
+        if on_extracted is not None:
+            on_extracted(task, result.records, result.document or task.document)
+        for text, metadata in result.records:
+            if source_key is not None:
+                metadata = {**metadata, source_key: task.source}
+            yield Document(page_content=text, metadata=metadata)
+
+
+def extract_and_split(
+    tasks: Iterable[ExtractionTask],
+    loader_factories: dict[str, LoaderFactory],
+    text_splitter: TextSplitters,
+    workers: int,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    max_in_flight: Optional[int] = None,
+    fetcher: Optional[CachedFetcher] = None,
+    errors: Optional[dict[str, BaseException]] = None,
+    on_extracted: Optional[ExtractedCallback] = None,
+    return_documents: bool = False,
+    telemetry: Optional[IngestionTelemetry] = None,
+    source_key: Optional[str] = None,
+) -> Iterator[Document]:
+    """Extract and split pages in `workers` processes, yielding the chunks in order.
+
+    Tasks are sent in chunks of `chunk_size` pages with at most `max_in_flight`
+    chunks (twice the number of workers by default) submitted at a time, which
+    bounds the memory held by pending work. Documents extracted from changed
+    pages are stored in the `fetcher`'s parse cache under the source name. Pages
+    that fail to extract are skipped and their source is recorded in `errors`.
+    `on_extracted` is called with every other task and its chunks, before they
+    are yielded. Documents extracted in the workers are only sent back for it
+    with `return_documents`. With a `telemetry`, the time the workers spend
+    extracting and splitting is recorded in its "extract" and "split" stages.
+    With a `source_key`, every chunk has its source name in that metadata key.
+    `text_splitter` is either used for every source or a splitter per source.
+    With `workers <= 1` everything runs in the calling process.
+    """
+    return_documents = return_documents or fetcher is not None
+    if workers <= 1:
+        _init_worker(loader_factories, text_splitter)
+        for chunk in batched(tasks, chunk_size):
+            yield from _to_documents(
+                chunk,
+                _extract_chunk(chunk, return_documents),
+                fetcher,
+                errors,
+                on_extracted,
+                telemetry,
+                source_key,
+            )
+        return
+
+    max_in_flight = max_in_flight or 2 * workers
+    # Pages come from crawler threads, and forking a multi-threaded process is
+    # unsafe, so workers are spawned.
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(loader_factories, text_splitter),
+    ) as executor:
+        pending: deque[tuple[list[ExtractionTask], Future]] = deque()
+        try:
+            for chunk in batched(tasks, chunk_size):
+                if len(pending) >= max_in_flight:
+                    done, future = pending.popleft()
+                    yield from _to_documents(
+                        done,
+                        future.result(),
+                        fetcher,
+                        errors,
+                        on_extracted,
+                        telemetry,
+                        source_key,
+                    )
+                pending.append(
+                    (chunk, executor.submit(_extract_chunk, chunk, return_documents))
+                )
+            while pending:
+                done, future = pending.popleft()
+                yield from _to_documents(
+                    done,
+                    future.result(),
+                    fetcher,
+                    errors,
+                    on_extracted,
+                    telemetry,
+                    source_key,
+                )
+        finally:
+            for _, future in pending:
+                future.cancel()
@@ -1,6 +1,7 @@
 import os
+import time
 from collections import defaultdict
-from typing import Annotated, Literal, Optional, Sequence, TypedDict
+from typing import Annotated, Any, Literal, Optional, Sequence, TypedDict
 
 import weaviate
 from langchain_anthropic import ChatAnthropic
@@ -21,6 +22,7 @@ from langchain_core.prompts import (
 )
 from langchain_core.retrievers import BaseRetriever
 from langchain_core.runnables import ConfigurableField, RunnableConfig, ensure_config
+from langchain_core.runnables.config import merge_configs
 from langchain_fireworks import ChatFireworks
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_groq import ChatGroq
@@ -29,8 +31,23 @@ from langchain_weaviate import WeaviateVectorStore
 from langgraph.graph import END, StateGraph, add_messages
 from langsmith import Client as LangsmithClient
 
-from backend.constants import WEAVIATE_DOCS_INDEX_NAME
-from backend.ingest import get_embeddings_model
+from backend.coalescing import (
+    FlightPublisher,
+    ReplayChatModel,
+    SingleFlight,
+    coalescing_enabled,
+    coalescing_key,
+)
+from backend.index_alias import resolve_index_name
+from backend.ingest import EMBEDDING_MODEL_NAME, get_embeddings_model
+from backend.profiling import profiled
+from backend.query_log import get_query_logger, query_record
+from backend.usage import (
+    coalesced_usage,
+    embedding_usage,
+    message_usage,
+    total_usage,
+)
 
 RESPONSE_TEMPLATE = """\
 You are an expert programmer and problem-solver, tasked with answering any question \
@@ -136,9 +153,17 @@ class AgentState(TypedDict):
     # for convenience in evaluations
     answer: str
     feedback_urls: dict[str, list[str]]
+    # seconds spent retrieving and synthesizing the last answer
+    latencies: dict[str, float]
+    # tokens and estimated cost of each model call for the last answer, and
+    # their total, see backend.usage
+    usage: dict[str, dict[str, Any]]
 
 
-gpt_4o_mini = ChatOpenAI(model="gpt-4o-mini-2024-07-18", temperature=0, streaming=True)
+# stream_usage makes OpenAI report token usage when streaming
+gpt_4o_mini = ChatOpenAI(
+    model="gpt-4o-mini-2024-07-18", temperature=0, streaming=True, stream_usage=True
+)
 
 claude_3_haiku = ChatAnthropic(
     model="claude-3-haiku-20240307",
@@ -171,12 +196,26 @@ groq_llama3 = ChatGroq(
 )
 
 # Not exposed in the UI
-gpt_4o = ChatOpenAI(model="gpt-4o-2024-08-06", temperature=0.3, streaming=True)
+gpt_4o = ChatOpenAI(
+    model="gpt-4o-2024-08-06", temperature=0.3, streaming=True, stream_usage=True
+)
 claude_35_sonnet = ChatAnthropic(
     model="claude-3-5-sonnet-20240620",
     temperature=0.7,
 )
 
+# Provider model ids, to price the calls of providers not reporting them
+MODEL_IDS = {
+    OPENAI_MODEL_KEY: gpt_4o_mini.model_name,
+    ANTHROPIC_MODEL_KEY: claude_3_haiku.model,
+    FIREWORKS_MIXTRAL_MODEL_KEY: fireworks_mixtral.model_name,
+    GOOGLE_MODEL_KEY: gemini_pro.model,
+    COHERE_MODEL_KEY: cohere_command.model,
+    GROQ_LLAMA_3_MODEL_KEY: groq_llama3.model_name,
+    GPT_4O_MODEL_KEY: gpt_4o.model_name,
+    CLAUDE_35_SONNET_MODEL_KEY: claude_35_sonnet.model,
+}
+
 llm = gpt_4o_mini.configurable_alternatives(
     # This gives this field an id
     # When configuring the end runnable, we can then use this id to configure this field
@@ -203,6 +242,12 @@ llm = gpt_4o_mini.configurable_alternatives(
 )
 
 
+# identical first turns in flight share their search and answer, see
+# backend.coalescing
+retrieval_flights = SingleFlight()
+synthesis_flights = SingleFlight()
+
+
 def get_retriever(k: Optional[int] = None) -> BaseRetriever:
     weaviate_client = weaviate.connect_to_wcs(
         cluster_url=os.environ["WEAVIATE_URL"],
@@ -213,7 +258,8 @@ def get_retriever(k: Optional[int] = None) -> BaseRetriever:
     )
     weaviate_client = WeaviateVectorStore(
         client=weaviate_client,
-        index_name=WEAVIATE_DOCS_INDEX_NAME,
+        # Follows blue-green rebuilds, checking for a new build every 30s.
+        index_name=resolve_index_name(weaviate_client),
         text_key="text",
         embedding=get_embeddings_model(),
         attributes=["source", "title"],
@@ -233,34 +279,68 @@ def format_docs(docs: Sequence[Document]) -> str:
 def retrieve_documents(
     state: AgentState, *, config: Optional[RunnableConfig] = None
 ) -> AgentState:
+    start = time.perf_counter()
     config = ensure_config(config)
-    retriever = get_retriever(k=config["configurable"].get("k"))
+    k = config["configurable"].get("k")
     messages = convert_to_messages(state["messages"])
     query = messages[-1].content
-    relevant_documents = retriever.invoke(query)
-    return {"query": query, "documents": relevant_documents}
+    if coalescing_enabled(config):
+        # only first turns are routed here, so identical queries can share a search
+        model_name = config["configurable"].get("model_name", OPENAI_MODEL_KEY)
+        relevant_documents, shared = retrieval_flights.do(
+            coalescing_key(query, model_name, k),
+            lambda: get_retriever(k=k).invoke(query),
+        )
+    else:
+        relevant_documents, shared = get_retriever(k=k).invoke(query), False
+    embedding = embedding_usage(query, EMBEDDING_MODEL_NAME)
+    return {
+        "query": query,
+        "documents": relevant_documents,
+        "latencies": {"retrieval": time.perf_counter() - start},
+        "usage": {"embedding": coalesced_usage(embedding) if shared else embedding},
+    }
 
 
-def retrieve_documents_with_chat_history(state: AgentState) -> AgentState:
+def retrieve_documents_with_chat_history(
+    state: AgentState, *, config: Optional[RunnableConfig] = None
+) -> AgentState:
+    start = time.perf_counter()
+    config = ensure_config(config)
     retriever = get_retriever()
     model = llm.with_config(tags=["nostream"])
 
     CONDENSE_QUESTION_PROMPT = PromptTemplate.from_template(REPHRASE_TEMPLATE)
-    condense_question_chain = (
-        CONDENSE_QUESTION_PROMPT | model | StrOutputParser()
-    ).with_config(
+    # The model's message is kept for its usage metadata, before parsing it.
+    condense_question_chain = (CONDENSE_QUESTION_PROMPT | model).with_config(
         run_name="CondenseQuestion",
     )
 
     messages = convert_to_messages(state["messages"])
     query = messages[-1].content
-    retriever_with_condensed_question = condense_question_chain | retriever
     # NOTE: we're ignoring the last message here, as it's going to contain the most recent
     # query and we don't want that to be included in the chat history
-    relevant_documents = retriever_with_condensed_question.invoke(
-        {"question": query, "chat_history": get_chat_history(messages[:-1])}
-    )
-    return {"query": query, "documents": relevant_documents}
+    condense_inputs = {
+        "question": query,
+        "chat_history": get_chat_history(messages[:-1]),
+    }
+    condensed_message = condense_question_chain.invoke(condense_inputs)
+    condensed_question = StrOutputParser().invoke(condensed_message)
+    relevant_documents = retriever.invoke(condensed_question)
+    model_name = config["configurable"].get("model_name", OPENAI_MODEL_KEY)
+    return {
+        "query": query,
+        "documents": relevant_documents,
+        "latencies": {"retrieval": time.perf_counter() - start},
+        "usage": {
+            "condense": message_usage(
+                condensed_message,
+                MODEL_IDS.get(model_name, model_name),
+                lambda: CONDENSE_QUESTION_PROMPT.format(**condense_inputs),
+            ),
+            "embedding": embedding_usage(condensed_question, EMBEDDING_MODEL_NAME),
+        },
+    }
 
 
 def route_to_retriever(
@@ -306,6 +386,7 @@ def synthesize_response(
     model: LanguageModelLike,
     prompt_template: str,
 ) -> AgentState:
+    start = time.perf_counter()
     prompt = ChatPromptTemplate.from_messages(
         [
             ("system", prompt_template),
@@ -314,23 +395,74 @@ def synthesize_response(
         ]
     )
     response_synthesizer = prompt | model
-    synthesized_response = response_synthesizer.invoke(
-        {
-            "question": state["query"],
-            "context": format_docs(state["documents"]),
-            # NOTE: we're ignoring the last message here, as it's going to contain the most recent
-            # query and we don't want that to be included in the chat history
-            "chat_history": get_chat_history(
-                convert_to_messages(state["messages"][:-1])
-            ),
-        }
-    )
+    synthesis_inputs = {
+        "question": state["query"],
+        "context": format_docs(state["documents"]),
+        # NOTE: we're ignoring the last message here, as it's going to contain the most recent
+        # query and we don't want that to be included in the chat history
+        "chat_history": get_chat_history(convert_to_messages(state["messages"][:-1])),
+    }
+    model_name = config.get("configurable", {}).get("model_name", OPENAI_MODEL_KEY)
+
+    def synthesize(
+        config: Optional[RunnableConfig] = None,
+    ) -> tuple[AIMessage, dict[str, Any]]:
+        message = response_synthesizer.invoke(synthesis_inputs, config)
+        step_usage = message_usage(
+            message,
+            MODEL_IDS.get(model_name, model_name),
+            lambda: prompt.format(**synthesis_inputs),
+        )
+        return message, step_usage
+
+    if len(state["messages"]) == 1 and coalescing_enabled(config):
+        key = coalescing_key(
+            state["query"], model_name, config.get("configurable", {}).get("k")
+        )
+        with synthesis_flights.join(key) as (flight, leader):
+            if leader:
+                # adds the publisher to the node's callbacks, which are
+                # only inherited when no config is passed
+                synthesized_response, synthesis_usage = synthesize(
+                    merge_configs(
+                        ensure_config(), {"callbacks": [FlightPublisher(flight)]}
+                    )
+                )
+                flight.finish(
+                    {"message": synthesized_response, "usage": synthesis_usage}
+                )
+            else:
+                # streams the leader's tokens through this run's callbacks
+                synthesized_response = (prompt | ReplayChatModel(flight=flight)).invoke(
+                    synthesis_inputs
+                )
+                synthesis_usage = coalesced_usage(flight.wait()["usage"])
+    else:
+        synthesized_response, synthesis_usage = synthesize()
+    latencies = {
+        **state.get("latencies", {}),
+        "synthesis": time.perf_counter() - start,
+    }
+    usage = {**state.get("usage", {}), "synthesis": synthesis_usage}
+    usage["total"] = total_usage(usage)
+    if (query_logger := get_query_logger()) is not None:
+        query_logger.log(
+            query_record(
+                convert_to_messages(state["messages"]),
+                state["documents"],
+                config.get("configurable", {}),
+                latencies,
+                usage,
+            )
+        )
     # finally, add feedback URLs so that users can leave feedback
     feedback_urls = get_feedback_urls(config)
     return {
         "messages": [synthesized_response],
         "answer": synthesized_response.content,
         "feedback_urls": feedback_urls,
+        "latencies": latencies,
+        "usage": usage,
     }
 
 
@@ -358,6 +490,10 @@ def route_to_response_synthesizer(
 class Configuration(TypedDict):
     model_name: str
     k: int
+    # fraction of runs to profile, see backend.profiling
+    profile_rate: float
+    # share identical first turns in flight, see backend.coalescing
+    coalesce: bool
 
 
 class InputSchema(TypedDict):
@@ -367,10 +503,19 @@ class InputSchema(TypedDict):
 workflow = StateGraph(AgentState, Configuration, input=InputSchema)
 
 # define nodes
-workflow.add_node("retriever", retrieve_documents)
-workflow.add_node("retriever_with_chat_history", retrieve_documents_with_chat_history)
-workflow.add_node("response_synthesizer", synthesize_response_default)
-workflow.add_node("response_synthesizer_cohere", synthesize_response_cohere)
+workflow.add_node("retriever", profiled("retriever", retrieve_documents))
+workflow.add_node(
+    "retriever_with_chat_history",
+    profiled("retriever_with_chat_history", retrieve_documents_with_chat_history),
+)
+workflow.add_node(
+    "response_synthesizer",
+    profiled("response_synthesizer", synthesize_response_default),
+)
+workflow.add_node(
+    "response_synthesizer_cohere",
+    profiled("response_synthesizer_cohere", synthesize_response_cohere),
+)
 
 # set entry point to retrievers
 workflow.set_conditional_entry_point(route_to_retriever)
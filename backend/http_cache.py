@@ -0,0 +1,267 @@
+"""On-disk HTTP cache for crawling the documentation sites.
+
+Pages are stored in SQLite together with their `ETag`/`Last-Modified` validators
+and the sitemap `<lastmod>` they were fetched for. `CachedFetcher` uses them to
+skip pages whose `<lastmod>` did not change and to send conditional requests for
+the rest. The cache also keeps the document extracted from each page, keyed by
+the hash of the raw bytes, so unchanged pages are not parsed again.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Literal, Optional
+
+import requests
+from langchain_core.documents import Document
+from requests.adapters import HTTPAdapter
+
+FetchStatus = Literal["fetched", "not_modified", "skipped"]
+
+# Seconds to wait for a server, unless the caller passes its own timeout.
+DEFAULT_TIMEOUT = 30.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    body BLOB NOT NULL,
+    sha256 TEXT NOT NULL,
+    content_type TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    lastmod TEXT,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS parsed (
+    url TEXT NOT NULL,
+    parse_key TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    document TEXT NOT NULL,
+    PRIMARY KEY (url, parse_key)
+);
+"""
+
+
+@dataclass
+class CachedPage:
+    url: str
+    text: str
+    sha256: str
+    content_type: str = ""
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    lastmod: Optional[str] = None
+    fetched_at: float = 0.0
+
+
+@dataclass
+class FetchResult:
+    url: str
+    text: str
+    sha256: str
+    status_code: int
+    status: FetchStatus
+    headers: dict[str, str]
+
+    @property
+    def changed(self) -> bool:
+        """Whether the raw bytes differ from the previously cached page."""
+        return self.status == "fetched"
+
+
+class HTTPCache:
+    """SQLite-backed store of raw pages and the documents extracted from them."""
+
+    def __init__(self, path: str | Path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def get(self, url: str) -> Optional[CachedPage]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, sha256, content_type, etag, last_modified, lastmod, "
+                "fetched_at FROM pages WHERE url = ?",
+                (url,),
+            ).fetchone()
+        if row is None:
+            return None
+        body, *fields = row
+        return CachedPage(url, zlib.decompress(body).decode("utf-8"), *fields)
+
+    def put(self, page: CachedPage) -> None:
+        body = zlib.compress(page.text.encode("utf-8"))
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    page.url,
+                    body,
+                    page.sha256,
+                    page.content_type,
+                    page.etag,
+                    page.last_modified,
+                    page.lastmod,
+                    page.fetched_at,
+                ),
+            )
+
+    def get_parsed(self, url: str, parse_key: str, sha256: str) -> Optional[Document]:
+        """Return the document extracted from `url` if its raw bytes are unchanged."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT document FROM parsed "
+                "WHERE url = ? AND parse_key = ? AND sha256 = ?",
+                (url, parse_key, sha256),
+            ).fetchone()
+        if row is None:
+            return None
+        return Document(**json.loads(row[0]))
+
+    def put_parsed(
+        self, url: str, parse_key: str, sha256: str, document: Document
+    ) -> None:
+        serialized = json.dumps(
+            {"page_content": document.page_content, "metadata": document.metadata}
+        )
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO parsed VALUES (?, ?, ?, ?)",
+                (url, parse_key, sha256, serialized),
+            )
+
+
+class CachedFetcher:
+    """Fetch pages through an `HTTPCache` using conditional requests.
+
+    `stats` counts how each URL was served: "fetched" (new or changed content),
+    "not_modified" (revalidated, or re-downloaded with identical bytes) and
+    "skipped" (no request sent because the sitemap `<lastmod>` is unchanged).
+    """
+
+    def __init__(
+        self,
+        cache: HTTPCache,
+        *,
+        timeout: float = DEFAULT_TIMEOUT,
+        headers: Optional[dict[str, str]] = None,
+        pool_size: int = 32,
+    ):
+        self.cache = cache
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if headers:
+            self.session.headers.update(headers)
+        self.stats: Counter[FetchStatus] = Counter()
+        self._stats_lock = threading.Lock()
+
+    def _record(self, result: FetchResult) -> FetchResult:
+        with self._stats_lock:
+            self.stats[result.status] += 1
+        return result
+
+    def fetch(
+        self,
+        url: str,
+        *,
+        lastmod: Optional[str] = None,
+        headers: Optional[dict[str, str]] = None,
+        timeout: Optional[float] = None,
+        encoding: Optional[str] = None,
+        autoset_encoding: bool = True,
+    ) -> FetchResult:
+        """Fetch `url`, revalidating or skipping it based on the cached copy.
+
+        `lastmod` is the URL's sitemap `<lastmod>`; when it matches the value the
+        page was cached for, the cached copy is returned without any request.
+        """
+        cached = self.cache.get(url)
+        if cached is not None and lastmod is not None and cached.lastmod == lastmod:
+            return self._record(
+                FetchResult(
+                    url=url,
+                    text=cached.text,
+                    sha256=cached.sha256,
+                    status_code=200,
+                    status="skipped",
+                    headers={"Content-Type": cached.content_type},
+                )
+            )
+
+        request_headers = dict(headers or {})
+        if cached is not None:
+            if cached.etag:
+                request_headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                request_headers["If-Modified-Since"] = cached.last_modified
+        response = self.session.get(
+            url, headers=request_headers, timeout=timeout or self.timeout
+        )
+
+        if response.status_code == 304 and cached is not None:
+            cached.etag = response.headers.get("ETag", cached.etag)
+            cached.last_modified = response.headers.get(
+                "Last-Modified", cached.last_modified
+            )
+            cached.lastmod = lastmod
+            cached.fetched_at = time.time()
+            self.cache.put(cached)
+            return self._record(
+                FetchResult(
+                    url=url,
+                    text=cached.text,
+                    sha256=cached.sha256,
+                    status_code=200,
+                    status="not_modified",
+                    headers={"Content-Type": cached.content_type},
+                )
+            )
+
+        if encoding is not None:
+            response.encoding = encoding
+        elif autoset_encoding:
+            response.encoding = response.apparent_encoding
+        sha256 = hashlib.sha256(response.content).hexdigest()
+        content_type = response.headers.get("Content-Type", "")
+        result = FetchResult(
+            url=url,
+            text=response.text,
+            sha256=sha256,
+            status_code=response.status_code,
+            status=(
+                "not_modified"
+                if cached is not None and cached.sha256 == sha256
+                else "fetched"
+            ),
+            headers={"Content-Type": content_type},
+        )
+        # Never cache error pages, so that they are retried on the next run.
+        if response.ok:
+            self.cache.put(
+                CachedPage(
+                    url=url,
+                    text=result.text,
+                    sha256=sha256,
+                    content_type=content_type,
+                    etag=response.headers.get("ETag"),
+                    last_modified=response.headers.get("Last-Modified"),
+                    lastmod=lastmod,
+                    fetched_at=time.time(),
+                )
+            )
+        return self._record(result)
@@ -0,0 +1,248 @@
+"""Blue-green index builds behind an alias.
+
+A blue-green build indexes the docs into a new collection, named after the
+alias with the build time, while the current collection keeps serving queries.
+Once the build is validated the alias is pointed at it, and the collections of
+older builds are dropped whole instead of deleting their vectors one by one.
+The previous build is kept so that `rollback` is a pointer flip too.
+
+The client does not support Weaviate's own aliases, so the pointers are objects
+of a small `IndexAlias` collection. An alias without a pointer resolves to the
+collection of the same name, where docs were indexed in place.
+"""
+import argparse
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Optional
+
+import weaviate
+from langchain_core.vectorstores import VectorStore
+from weaviate.classes.config import Configure, DataType, Property
+from weaviate.util import generate_uuid5
+
+from backend.constants import WEAVIATE_DOCS_INDEX_NAME
+from backend.record_manager import BulkSQLRecordManager, index_namespace
+
+logger = logging.getLogger(__name__)
+
+ALIAS_COLLECTION = "IndexAlias"
+DEFAULT_TTL = 30.0
+SMOKE_QUERY = "How do I use a retriever?"
+
+
+class BuildValidationError(Exception):
+    """A new build is not fit to be served."""
+
+
+class IndexAliases:
+    """Pointers from aliases to the collections they currently resolve to."""
+
+    def __init__(self, client: weaviate.WeaviateClient):
+        self.client = client
+
+    def _collection(self, create: bool = False) -> Any:
+        if not self.client.collections.exists(ALIAS_COLLECTION):
+            if not create:
+                return None
+            self.client.collections.create(
+                ALIAS_COLLECTION,
+                properties=[
+                    Property(name="alias", data_type=DataType.TEXT),
+                    Property(name="target", data_type=DataType.TEXT),
+                    Property(name="previous", data_type=DataType.TEXT),
+                    Property(name="updated_at", data_type=DataType.NUMBER),
+                ],
+                vectorizer_config=Configure.Vectorizer.none(),
+            )
+        return self.client.collections.get(ALIAS_COLLECTION)
+
+    def _pointer(self, alias: str) -> Optional[dict]:
+        collection = self._collection()
+        if collection is None:
+            return None
+        obj = collection.query.fetch_object_by_id(generate_uuid5(alias))
+        return obj.properties if obj is not None else None
+
+    def resolve(self, alias: str) -> Optional[str]:
+        """The collection `alias` points to, None if it has no pointer."""
+        pointer = self._pointer(alias)
+        return pointer["target"] if pointer is not None else None
+
+    def previous(self, alias: str) -> Optional[str]:
+        pointer = self._pointer(alias)
+        return (pointer.get("previous") or None) if pointer is not None else None
+
+    def swap(self, alias: str, target: str) -> Optional[str]:
+        """Point `alias` at `target`, returning the collection it pointed to."""
+        previous = self.resolve(alias) or (
+            alias if self.client.collections.exists(alias) else None
+        )
+        properties = {
+            "alias": alias,
+            "target": target,
+            "previous": previous or "",
+            "updated_at": time.time(),
+        }
+        collection = self._collection(create=True)
+        uuid = generate_uuid5(alias)
+        if collection.data.exists(uuid):
+            collection.data.replace(uuid=uuid, properties=properties)
+        else:
+            collection.data.insert(properties, uuid=uuid)
+        with _resolved_lock:
+            _resolved.pop(alias, None)
+        logger.info(f"Pointed {alias} at {target} instead of {previous}")
+        return previous
+
+    def remove(self, alias: str) -> None:
+        """Remove the pointer of `alias`, which then resolves to its own name."""
+        collection = self._collection()
+        if collection is not None:
+            collection.data.delete_by_id(generate_uuid5(alias))
+        with _resolved_lock:
+            _resolved.pop(alias, None)
+
+    def rollback(self, alias: str) -> str:
+        """Point `alias` back at the collection it pointed to before."""
+        previous = self.previous(alias)
+        if previous is None or not self.client.collections.exists(previous):
+            raise ValueError(f"{alias} has no previous build to roll back to")
+        self.swap(alias, previous)
+        return previous
+
+
+# Alias -> (monotonic time of the lookup, collection).
+_resolved: dict[str, tuple[float, str]] = {}
+_resolved_lock = threading.Lock()
+
+
+def resolve_index_name(
+    client: weaviate.WeaviateClient,
+    alias: str = WEAVIATE_DOCS_INDEX_NAME,
+    ttl: float = DEFAULT_TTL,
+) -> str:
+    """The collection `alias` resolves to, looked up at most every `ttl` seconds."""
+    now = time.monotonic()
+    with _resolved_lock:
+        cached = _resolved.get(alias)
+    if cached is not None and now - cached[0] < ttl:
+        return cached[1]
+    target = IndexAliases(client).resolve(alias) or alias
+    with _resolved_lock:
+        _resolved[alias] = (now, target)
+    return target
+
+
+def new_build_name(alias: str) -> str:
+    return f"{alias}_{time.strftime('%Y%m%dT%H%M%S', time.gmtime())}"
+
+
+def is_build_name(alias: str, name: str) -> bool:
+    """Whether `name` is a name `new_build_name` gives to builds of `alias`."""
+    return re.fullmatch(rf"{re.escape(alias)}_\d{{8}}T\d{{6}}", name) is not None
+
+
+def list_builds(client: weaviate.WeaviateClient, alias: str) -> list[str]:
+    """The collections built for `alias`, oldest first.
+
+    This includes the collection named after the alias itself, if any, but not
+    other collections whose name merely starts with the alias.
+    """
+    names = client.collections.list_all(simple=True)
+    builds = sorted(name for name in names if is_build_name(alias, name))
+    return ([alias] if alias in names else []) + builds
+
+
+def validate_build(
+    client: weaviate.WeaviateClient,
+    name: str,
+    vectorstore: VectorStore,
+    expected_count: int,
+    smoke_query: str = SMOKE_QUERY,
+) -> None:
+    """Check that a build holds `expected_count` objects and answers a query."""
+    collection = client.collections.get(name)
+    count = collection.aggregate.over_all(total_count=True).total_count
+    if not expected_count or count != expected_count:
+        raise BuildValidationError(
+            f"Expected {expected_count} objects in {name}, found {count}"
+        )
+    if not vectorstore.similarity_search(smoke_query, k=1):
+        raise BuildValidationError(
+            f"The smoke query {smoke_query!r} found nothing in {name}"
+        )
+
+
+def drop_build(
+    client: weaviate.WeaviateClient,
+    name: str,
+    record_manager_db_url: Optional[str] = None,
+) -> None:
+    """Drop the collection of a build, with its record manager namespaces."""
+    client.collections.delete(name)
+    if record_manager_db_url:
+        BulkSQLRecordManager(
+            index_namespace(name), db_url=record_manager_db_url
+        ).delete_namespace()
+    logger.info(f"Dropped the collection {name}")
+
+
+def drop_old_builds(
+    client: weaviate.WeaviateClient,
+    alias: str,
+    record_manager_db_url: Optional[str] = None,
+) -> list[str]:
+    """Drop the builds older than the current one, except the previous one.
+
+    Builds newer than the current one are left alone, as they may be running.
+    """
+    aliases = IndexAliases(client)
+    current = aliases.resolve(alias)
+    if current is None:
+        return []
+    keep = {current, aliases.previous(alias)}
+    builds = list_builds(client, alias)
+    older = builds[: builds.index(current)] if current in builds else []
+    dropped = [name for name in older if name not in keep]
+    for name in dropped:
+        drop_build(client, name, record_manager_db_url)
+    return dropped
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--alias", default=WEAVIATE_DOCS_INDEX_NAME)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("show", help="Show the builds and where the alias points")
+    subparsers.add_parser("rollback", help="Point the alias at the previous build")
+    subparsers.add_parser("drop-old", help="Drop builds older than the previous one")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    client = weaviate.connect_to_wcs(
+        cluster_url=os.environ["WEAVIATE_URL"],
+        auth_credentials=weaviate.classes.init.Auth.api_key(
+            os.environ["WEAVIATE_API_KEY"]
+        ),
+        skip_init_checks=True,
+    )
+    aliases = IndexAliases(client)
+    try:
+        if args.command == "show":
+            current = aliases.resolve(args.alias)
+            logger.info(f"{args.alias} -> {current or args.alias}")
+            for name in list_builds(client, args.alias):
+                logger.info(f"  {name}{' (current)' if name == current else ''}")
+        elif args.command == "rollback":
+            logger.info(f"Rolled back to {aliases.rollback(args.alias)}")
+        else:
+            drop_old_builds(client, args.alias, os.environ.get("RECORD_MANAGER_DB_URL"))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,97 @@
 """Load html from files, clean up, split, ingest into Weaviate."""
+import argparse
 import logging
 import os
+import queue
 import re
-from typing import Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+from typing import Any, Callable, Iterable, Iterator, Optional
 
 import weaviate
 from bs4 import BeautifulSoup, SoupStrainer
 from langchain.document_loaders import RecursiveUrlLoader, SitemapLoader
-from langchain.indexes import SQLRecordManager, index
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.indexes import index
+from langchain.text_splitter import RecursiveCharacterTextSplitter, TextSplitter
 from langchain.utils.html import PREFIXES_TO_IGNORE_REGEX, SUFFIXES_TO_IGNORE_REGEX
+from langchain_core.documents import Document
 from langchain_core.embeddings import Embeddings
+from langchain_core.indexing import RecordManager
+from langchain_core.vectorstores import VectorStore
 from langchain_openai import OpenAIEmbeddings
-from langchain_weaviate import WeaviateVectorStore
 
 from backend.constants import WEAVIATE_DOCS_INDEX_NAME
+from backend.crawl import batched, get_cached_document, iter_pages
+from backend.dedup import NearDuplicateFilter, drop_near_duplicates
+from backend.embedding_cache import CachedEmbeddings, EmbeddingStore
+from backend.embedding_scheduler import MAX_TOKENS_PER_REQUEST, ScheduledEmbeddings
+from backend.extraction import (
+    ExtractionTask,
+    LoaderFactory,
+    Record,
+    extract_and_split,
+)
+from backend.http_cache import CachedFetcher, HTTPCache
+from backend.index_alias import (
+    IndexAliases,
+    drop_old_builds,
+    new_build_name,
+    validate_build,
+)
+from backend.journal import IngestionJournal
 from backend.parser import langchain_docs_extractor
+from backend.record_manager import (
+    BulkSQLRecordManager,
+    index_namespace,
+    source_namespace,
+)
+from backend.snapshot import SnapshotWriter, iter_snapshot, read_manifest
+from backend.splitter import MarkdownSectionSplitter, TokenLength
+from backend.telemetry import (
+    IngestionTelemetry,
+    embedding_cost,
+    find_regressions,
+    read_history,
+    write_report,
+)
+from backend.weaviate_bulk import BulkWeaviateVectorStore, WriteStats
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+EMBEDDING_MODEL_NAME = "text-embedding-3-small"
+
+
+def _with_embedding_cache(embedding: Embeddings) -> Embeddings:
+    if cache_dir := os.environ.get("EMBEDDING_CACHE_DIR"):
+        store = EmbeddingStore.open(
+            cache_dir,
+            EMBEDDING_MODEL_NAME,
+            dtype=os.environ.get("EMBEDDING_CACHE_DTYPE") or "float32",
+        )
+        return CachedEmbeddings(embedding, store)
+    return embedding
+
+
 def get_embeddings_model() -> Embeddings:
-    return OpenAIEmbeddings(model="text-embedding-3-small", chunk_size=200)
+    return OpenAIEmbeddings(model=EMBEDDING_MODEL_NAME, chunk_size=200)
+
+
+def get_ingestion_embeddings_model() -> Embeddings:
+    """Embeddings for bulk ingestion, batched by tokens with concurrent requests."""
+    return _with_embedding_cache(
+        ScheduledEmbeddings(
+            EMBEDDING_MODEL_NAME,
+            max_concurrency=int(os.environ.get("EMBEDDING_MAX_CONCURRENCY") or 8),
+            max_tokens_per_request=int(
+                os.environ.get("EMBEDDING_MAX_TOKENS_PER_REQUEST")
+                or MAX_TOKENS_PER_REQUEST
+            ),
+        )
+    )
 
 
 def metadata_extractor(
@@ -46,7 +115,7 @@ def metadata_extractor(
     }
 
 
-def load_langchain_docs():
+def get_langchain_docs_loader() -> SitemapLoader:
     return SitemapLoader(
         "https://python.langchain.com/v0.2/sitemap.xml",
         filter_urls=["https://python.langchain.com/"],
@@ -58,10 +127,10 @@ def load_langchain_docs():
             ),
         },
         meta_function=metadata_extractor,
-    ).load()
+    )
 
 
-def load_langgraph_docs():
+def get_langgraph_docs_loader() -> SitemapLoader:
     return SitemapLoader(
         "https://langchain-ai.github.io/langgraph/sitemap.xml",
         parsing_function=simple_extractor,
@@ -70,16 +139,15 @@ def load_langgraph_docs():
         meta_function=lambda meta, soup: metadata_extractor(
             meta, soup, title_suffix=" | 🦜🕸️LangGraph"
         ),
-    ).load()
+    )
 
 
-def load_langsmith_docs():
+def get_langsmith_docs_loader() -> RecursiveUrlLoader:
     return RecursiveUrlLoader(
         url="https://docs.smith.langchain.com/",
         max_depth=8,
         extractor=simple_extractor,
         prevent_outside=True,
-        use_async=True,
         timeout=600,
         # Drop trailing / to avoid duplicate pages.
         link_regex=(
@@ -87,7 +155,7 @@ def load_langsmith_docs():
             r"(?:[\#'\"]|\/[\#'\"])"
         ),
         check_response_status=True,
-    ).load()
+    )
 
 
 def simple_extractor(html: str | BeautifulSoup) -> str:
@@ -102,13 +170,12 @@ def simple_extractor(html: str | BeautifulSoup) -> str:
     return re.sub(r"\n\n+", "\n\n", soup.text).strip()
 
 
-def load_api_docs():
+def get_api_docs_loader() -> RecursiveUrlLoader:
     return RecursiveUrlLoader(
         url="https://api.python.langchain.com/en/latest/",
         max_depth=8,
         extractor=simple_extractor,
         prevent_outside=True,
-        use_async=True,
         timeout=600,
         # Drop trailing / to avoid duplicate pages.
         link_regex=(
@@ -120,80 +187,845 @@ def load_api_docs():
             "https://api.python.langchain.com/en/latest/_sources",
             "https://api.python.langchain.com/en/latest/_modules",
         ),
-    ).load()
+    )
 
 
-def ingest_docs():
-    WEAVIATE_URL = os.environ["WEAVIATE_URL"]
-    WEAVIATE_API_KEY = os.environ["WEAVIATE_API_KEY"]
-    RECORD_MANAGER_DB_URL = os.environ["RECORD_MANAGER_DB_URL"]
+# Maps a short source name to the factory of the loader that crawls it. Every
+# loader is an independent, network-bound crawl, so they can safely run
+# concurrently. Factories are module-level so extraction workers can build their
+# own loaders.
+DOC_SOURCES: dict[str, LoaderFactory] = {
+    "langchain": get_langchain_docs_loader,
+    "api": get_api_docs_loader,
+    "langsmith": get_langsmith_docs_loader,
+    "langgraph": get_langgraph_docs_loader,
+}
 
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=4000, chunk_overlap=200)
-    embedding = get_embeddings_model()
+# Sources whose extractor emits Markdown. The others are extracted as plain
+# text, where a line starting with `# ` is as likely a code comment as a
+# heading, so they are not split on headings.
+MARKDOWN_SOURCES = {"langchain"}
 
-    client = weaviate.connect_to_wcs(
-        cluster_url=WEAVIATE_URL,
-        auth_credentials=weaviate.classes.init.Auth.api_key(WEAVIATE_API_KEY),
-        skip_init_checks=True,
-    )
-    vectorstore = WeaviateVectorStore(
-        client=client,
-        index_name=WEAVIATE_DOCS_INDEX_NAME,
-        text_key="text",
-        embedding=embedding,
-        attributes=["source", "title"],
+
+def get_text_splitter(
+    source: str,
+    chunk_tokens: int,
+    length_function: Optional[Callable[[str], int]] = None,
+) -> TextSplitter:
+    length_function = length_function or TokenLength()
+    if source in MARKDOWN_SOURCES:
+        return MarkdownSectionSplitter(
+            chunk_size=chunk_tokens, length_function=length_function
+        )
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_tokens,
+        chunk_overlap=chunk_tokens // 20,
+        length_function=length_function,
     )
 
-    record_manager = SQLRecordManager(
-        f"weaviate/{WEAVIATE_DOCS_INDEX_NAME}", db_url=RECORD_MANAGER_DB_URL
+
+def source_url_prefix(name: str) -> str:
+    """The prefix of the URLs of the pages crawled for the source `name`."""
+    loader = DOC_SOURCES[name]()
+    if isinstance(loader, RecursiveUrlLoader):
+        return loader.url
+    if loader.allow_url_patterns:
+        return loader.allow_url_patterns[0]
+    return loader.web_path.rsplit("/", 1)[0] + "/"
+
+
+def migrate_legacy_records(
+    index_name: str, db_url: str
+) -> Optional[BulkSQLRecordManager]:
+    """Move the records of the unpartitioned namespace to their source's.
+
+    Returns the record manager of the unpartitioned namespace, or None once it
+    is empty. The records left in it are of pages that belong to no source.
+    """
+    legacy = BulkSQLRecordManager(index_namespace(index_name), db_url=db_url)
+    if not legacy.count():
+        return None
+    for name in DOC_SOURCES:
+        num_moved = legacy.move_groups(
+            source_namespace(index_name, name), source_url_prefix(name)
+        )
+        logger.info(f"Moved {num_moved} records of {name} to its own namespace")
+    return legacy
+
+
+def iter_extraction_tasks(
+    name: str,
+    get_loader: LoaderFactory,
+    fetcher: Optional[CachedFetcher] = None,
+    journal: Optional[IngestionJournal] = None,
+) -> Iterator[ExtractionTask]:
+    """Crawl a source, pairing each page with what is known of it already.
+
+    That is its cached document, or with a `journal`, its journaled chunks.
+    Pages the journal has as indexed are skipped, and a source it has as
+    crawled is replayed from the journal without crawling it again.
+    """
+    if journal is not None and journal.is_source_crawled(name):
+        for url, records in journal.pending_pages(name):
+            yield ExtractionTask(name, records=records, url=url)
+        return
+
+    for page in iter_pages(get_loader(), fetcher=fetcher):
+        status = journal.page_status(page.url) if journal is not None else None
+        if status == "indexed":
+            continue
+        if status == "split":
+            assert journal is not None
+            records = journal.page_records(page.url)
+            yield ExtractionTask(name, records=records, url=page.url)
+        elif (doc := get_cached_document(fetcher, name, page)) is not None:
+            yield ExtractionTask(name, document=doc, url=page.url)
+        else:
+            yield ExtractionTask(name, page=page)
+    if journal is not None:
+        yield ExtractionTask(name)
+
+
+def iter_snapshot_tasks(
+    path: str, name: str, journal: Optional[IngestionJournal] = None
+) -> Iterator[ExtractionTask]:
+    """Read a source's documents from a snapshot instead of crawling it.
+
+    With a `journal`, pages are skipped or replayed as in `iter_extraction_tasks`.
+    """
+    if journal is not None and journal.is_source_crawled(name):
+        for url, records in journal.pending_pages(name):
+            yield ExtractionTask(name, records=records, url=url)
+        return
+
+    for _, doc in iter_snapshot(path, sources=[name]):
+        url = doc.metadata.get("source")
+        status = journal.page_status(url) if journal is not None and url else None
+        if status == "indexed":
+            continue
+        if status == "split":
+            assert journal is not None
+            yield ExtractionTask(name, records=journal.page_records(url), url=url)
+        else:
+            yield ExtractionTask(name, document=doc, url=url)
+    if journal is not None:
+        yield ExtractionTask(name)
+
+
+def journal_extracted(
+    journal: IngestionJournal,
+    task: ExtractionTask,
+    records: list[Record],
+    document: Optional[Document] = None,
+) -> None:
+    if task.is_end_of_source:
+        journal.mark_source_crawled(task.source)
+    elif task.records is None and task.page_url is not None:
+        journal.record_page(task.source, task.page_url, records)
+
+
+def export_extracted(
+    writer: SnapshotWriter,
+    task: ExtractionTask,
+    records: list[Record],
+    document: Optional[Document] = None,
+) -> None:
+    if document is not None:
+        writer.write(task.source, document)
+
+
+def _task_bytes(task: ExtractionTask) -> int:
+    return len(task.page.html) if task.page is not None else 0
+
+
+def _doc_bytes(doc: Document) -> int:
+    return len(doc.page_content)
+
+
+def _tracked_source(
+    telemetry: IngestionTelemetry, name: str, load: Callable[[], Iterable[Any]]
+) -> Iterator[Any]:
+    return telemetry.track(f"crawl.{name}", load(), size=_task_bytes)
+
+
+def _call_all(callbacks: list[Callable[..., None]], *args: Any) -> None:
+    for callback in callbacks:
+        callback(*args)
+
+
+# Metadata key routing each chunk to the record manager of its source.
+_SOURCE_KEY = "_ingest_source"
+
+# Sentinel marking the end of a bounded queue between two pipeline stages.
+_DONE = object()
+
+
+def _put(q: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    """Put an item on a bounded queue, giving up once the consumer has stopped."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _drain_source(
+    name: str,
+    load: Callable[[], Iterable[Any]],
+    q: queue.Queue,
+    stop: threading.Event,
+) -> int:
+    logger.info(f"Loading pages from {name}")
+    start = time.perf_counter()
+    num_docs = 0
+    try:
+        for doc in load():
+            if not _put(q, doc, stop):
+                break
+            num_docs += 1
+    except Exception:
+        elapsed = time.perf_counter() - start
+        logger.exception(
+            f"Failed to load pages from {name} after {num_docs} pages "
+            f"in {elapsed:.1f}s"
+        )
+        raise
+    elapsed = time.perf_counter() - start
+    logger.info(f"Loaded {num_docs} pages from {name} in {elapsed:.1f}s")
+    return num_docs
+
+
+def stream_docs_concurrently(
+    sources: dict[str, Callable[[], Iterable[Any]]],
+    errors: dict[str, BaseException],
+    max_concurrency: Optional[int] = None,
+    queue_size: int = 1000,
+) -> Iterator[Any]:
+    """Crawl the given sources concurrently and yield their items as they arrive.
+
+    Loaders push into a queue of at most `queue_size` items, so a slow consumer
+    throttles the crawl instead of letting the corpus pile up in memory. A
+    source that fails is recorded in `errors` (keyed by source name) once the
+    stream is exhausted and does not affect the others.
+    """
+    max_concurrency = max_concurrency or len(sources)
+    q: queue.Queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    executor = ThreadPoolExecutor(
+        max_workers=max_concurrency, thread_name_prefix="ingest-loader"
     )
-    record_manager.create_schema()
+    futures = {
+        executor.submit(_drain_source, name, load, q, stop): name
+        for name, load in sources.items()
+    }
+
+    def signal_done() -> None:
+        wait(futures)
+        _put(q, _DONE, stop)
 
-    docs_from_documentation = load_langchain_docs()
-    logger.info(f"Loaded {len(docs_from_documentation)} docs from documentation")
-    docs_from_api = load_api_docs()
-    logger.info(f"Loaded {len(docs_from_api)} docs from API")
-    docs_from_langsmith = load_langsmith_docs()
-    logger.info(f"Loaded {len(docs_from_langsmith)} docs from LangSmith")
-    docs_from_langgraph = load_langgraph_docs()
-    logger.info(f"Loaded {len(docs_from_langgraph)} docs from LangGraph")
+    threading.Thread(target=signal_done, daemon=True).start()
+    start = time.perf_counter()
+    try:
+        while (item := q.get()) is not _DONE:
+            yield item
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
 
-    docs_transformed = text_splitter.split_documents(
-        docs_from_documentation
-        + docs_from_api
-        + docs_from_langsmith
-        + docs_from_langgraph
+    num_docs = 0
+    for future, name in futures.items():
+        if future.cancelled():
+            continue
+        if (e := future.exception()) is not None:
+            errors[name] = e
+        else:
+            num_docs += future.result()
+    elapsed = time.perf_counter() - start
+    logger.info(
+        f"Loaded {num_docs} pages from {len(sources) - len(errors)}/{len(sources)} "
+        f"sources in {elapsed:.1f}s"
     )
-    docs_transformed = [doc for doc in docs_transformed if len(doc.page_content) > 10]
 
+
+def iter_in_background(iterable: Iterable[Any], maxsize: int) -> Iterator[Any]:
+    """Run `iterable` in a background thread, buffering at most `maxsize` items.
+
+    This decouples two pipeline stages: the producer keeps working while the
+    consumer is busy, but can never get more than `maxsize` items ahead.
+    """
+    q: queue.Queue = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    error: list[BaseException] = []
+
+    def produce() -> None:
+        try:
+            for item in iterable:
+                if not _put(q, item, stop):
+                    return
+        except BaseException as e:
+            error.append(e)
+        _put(q, _DONE, stop)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while (item := q.get()) is not _DONE:
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+    if error:
+        raise error[0]
+
+
+def index_by_source(
+    docs: Iterable[Document],
+    index_source: Callable[[str, Iterable[Document]], dict],
+    sources: Iterable[str],
+    source_key: str,
+    maxsize: int,
+) -> dict[str, dict]:
+    """Index each source's docs concurrently, with `index_source(name, docs)`.
+
+    Docs are routed by the source name in their `source_key` metadata, which is
+    removed, to one bounded queue per source. Returns the stats of each source;
+    if indexing a source fails, the others are stopped and the error raised.
+    """
+    queues: dict[str, queue.Queue] = {
+        name: queue.Queue(maxsize=maxsize) for name in sources
+    }
+    stop = threading.Event()
+
+    def index_queue(name: str) -> dict:
+        def source_docs() -> Iterator[Document]:
+            while not stop.is_set():
+                try:
+                    doc = queues[name].get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if doc is _DONE:
+                    return
+                yield doc
+
+        try:
+            return index_source(name, source_docs())
+        except BaseException:
+            stop.set()
+            raise
+
+    with ThreadPoolExecutor(
+        max_workers=len(queues), thread_name_prefix="ingest-index"
+    ) as executor:
+        futures = {name: executor.submit(index_queue, name) for name in queues}
+        try:
+            for doc in docs:
+                if not _put(queues[doc.metadata.pop(source_key)], doc, stop):
+                    break
+            for q in queues.values():
+                _put(q, _DONE, stop)
+        except BaseException:
+            stop.set()
+            raise
+    return {name: future.result() for name, future in futures.items()}
+
+
+def filter_short_docs(docs: Iterable[Document]) -> Iterator[Document]:
+    return (doc for doc in docs if len(doc.page_content) > 10)
+
+
+def fill_missing_metadata(docs: Iterable[Document]) -> Iterator[Document]:
     # We try to return 'source' and 'title' metadata when querying vector store and
     # Weaviate will error at query time if one of the attributes is missing from a
     # retrieved document.
-    for doc in docs_transformed:
+    for doc in docs:
         if "source" not in doc.metadata:
             doc.metadata["source"] = ""
         if "title" not in doc.metadata:
             doc.metadata["title"] = ""
+        yield doc
+
+
+def touch_cached_embeddings(
+    docs: Iterable[Document], embedding: CachedEmbeddings, batch_size: int = 500
+) -> Iterator[Document]:
+    # index() skips docs that are already in the record manager without embedding
+    # them, so mark every chunk we see as referenced to keep it out of the cache gc.
+    for batch in batched(docs, batch_size):
+        embedding.touch(doc.page_content for doc in batch)
+        yield from batch
+
+
+def delete_stale_records(
+    record_manager: RecordManager,
+    vectorstore: VectorStore,
+    before: float,
+    batch_size: int = 1000,
+) -> int:
+    """Delete every record (and its vector) not written or refreshed since `before`.
+
+    This is the sweep `index(..., cleanup="full")` performs once all docs have
+    been indexed.
+    """
+    num_deleted = 0
+    while uids := record_manager.list_keys(before=before, limit=batch_size):
+        vectorstore.delete(uids)
+        record_manager.delete_keys(uids)
+        num_deleted += len(uids)
+    return num_deleted
 
-    indexing_stats = index(
-        docs_transformed,
-        record_manager,
-        vectorstore,
-        cleanup="full",
-        source_id_key="source",
-        force_update=(os.environ.get("FORCE_UPDATE") or "false").lower() == "true",
+
+class JournaledBatches:
+    """Feed docs to `index()`, journaling every batch once it has been upserted.
+
+    `index()` takes `batch_size` docs at a time and only asks for the next doc
+    once it has upserted the previous batch, so a batch is journaled when the
+    first doc of the following one is requested. The last batch is journaled by
+    `flush`, after `index()` returns. A page is marked as indexed once the batch
+    holding its last chunk is; chunks of a page are contiguous.
+    """
+
+    def __init__(
+        self, docs: Iterable[Document], journal: IngestionJournal, batch_size: int
+    ):
+        self.docs = docs
+        self.journal = journal
+        self.batch_size = batch_size
+        self._pending: list[Document] = []
+        self._open_url: Optional[str] = None
+
+    def _commit(self, final: bool = False) -> None:
+        urls = list(dict.fromkeys(doc.metadata["source"] for doc in self._pending))
+        if self._open_url is not None and self._open_url not in urls:
+            urls.insert(0, self._open_url)
+        # Unless this is the end, the last page may continue in the next batch.
+        self._open_url = None if final or not urls else urls.pop()
+        self.journal.record_batch(len(self._pending), urls)
+        self._pending = []
+
+    def __iter__(self) -> Iterator[Document]:
+        for batch in batched(self.docs, self.batch_size):
+            if self._pending:
+                self._commit()
+            self._pending = batch
+            yield from batch
+
+    def flush(self) -> None:
+        if self._pending or self._open_url is not None:
+            self._commit(final=True)
+
+
+def ingest_docs(
+    resume: bool = False,
+    from_snapshot: Optional[str] = None,
+    export_snapshot: Optional[str] = None,
+    blue_green: bool = False,
+    source_names: Optional[list[str]] = None,
+):
+    WEAVIATE_URL = os.environ["WEAVIATE_URL"]
+    WEAVIATE_API_KEY = os.environ["WEAVIATE_API_KEY"]
+    RECORD_MANAGER_DB_URL = os.environ["RECORD_MANAGER_DB_URL"]
+    INGEST_MAX_CONCURRENCY = int(
+        os.environ.get("INGEST_MAX_CONCURRENCY") or len(DOC_SOURCES)
+    )
+    INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE") or 1000)
+    # Each index() batch is embedded as several concurrent requests, so it needs
+    # to be large enough to keep them busy.
+    INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE") or 1000)
+    HTTP_CACHE_PATH = os.environ.get("HTTP_CACHE_PATH")
+    INGEST_JOURNAL_PATH = os.environ.get("INGEST_JOURNAL_PATH")
+    # Near-duplicates are ranked against the chunks of the previous run stored
+    # there, see backend.dedup. Defaults to next to the journal, or else to a
+    # temporary database.
+    INGEST_DEDUP_PATH = os.environ.get("INGEST_DEDUP_PATH") or (
+        f"{INGEST_JOURNAL_PATH}.dedup" if INGEST_JOURNAL_PATH else ""
     )
+    # Unset to let the client size batches dynamically.
+    WEAVIATE_BATCH_SIZE = int(os.environ.get("WEAVIATE_BATCH_SIZE") or 0) or None
+    WEAVIATE_BATCH_CONCURRENCY = int(os.environ.get("WEAVIATE_BATCH_CONCURRENCY") or 4)
+    INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS") or os.cpu_count() or 1)
+    INGEST_CHUNK_TOKENS = int(os.environ.get("INGEST_CHUNK_TOKENS") or 1000)
+    # Similarity above which a chunk is dropped as a near-duplicate of another.
+    INGEST_DEDUP_THRESHOLD = float(os.environ.get("INGEST_DEDUP_THRESHOLD") or 0.8)
+    # Where to write the report of each run and the history of reports.
+    INGEST_REPORT_DIR = os.environ.get("INGEST_REPORT_DIR")
+    INGEST_TRACEMALLOC = (
+        os.environ.get("INGEST_TRACEMALLOC") or "false"
+    ).lower() == "true"
 
+    telemetry = IngestionTelemetry(trace_memory=INGEST_TRACEMALLOC)
+
+    text_splitters = {
+        name: get_text_splitter(name, INGEST_CHUNK_TOKENS) for name in DOC_SOURCES
+    }
+    embedding = get_ingestion_embeddings_model()
+
+    client = weaviate.connect_to_wcs(
+        cluster_url=WEAVIATE_URL,
+        auth_credentials=weaviate.classes.init.Auth.api_key(WEAVIATE_API_KEY),
+        skip_init_checks=True,
+    )
+    # A blue-green build goes to a new collection, the alias is pointed at it
+    # once it is complete. Otherwise the collection the alias points to is
+    # updated in place.
+    aliases = IndexAliases(client)
+    if blue_green:
+        index_name = new_build_name(WEAVIATE_DOCS_INDEX_NAME)
+    else:
+        index_name = (
+            aliases.resolve(WEAVIATE_DOCS_INDEX_NAME) or WEAVIATE_DOCS_INDEX_NAME
+        )
+    logger.info(f"Indexing into {index_name}")
+    if from_snapshot is not None:
+        manifest = read_manifest(from_snapshot)
+        available = list(manifest["sources"])
+    else:
+        available = list(DOC_SOURCES)
+    if unknown := set(source_names or ()) - set(available):
+        raise ValueError(f"Unknown sources {sorted(unknown)}, among {available}")
+    source_names = [
+        name for name in available if source_names is None or name in source_names
+    ]
+    # Each source is indexed with its own vectorstore, which batches writes on
+    # its own, and its own record manager namespace, so that it can be
+    # re-indexed and swept on its own.
+    vectorstores = {
+        name: BulkWeaviateVectorStore(
+            client=client,
+            index_name=index_name,
+            text_key="text",
+            embedding=embedding,
+            attributes=["source", "title"],
+            batch_size=WEAVIATE_BATCH_SIZE,
+            concurrent_requests=WEAVIATE_BATCH_CONCURRENCY,
+        )
+        for name in source_names
+    }
+    record_managers = {
+        name: BulkSQLRecordManager(
+            source_namespace(index_name, name), db_url=RECORD_MANAGER_DB_URL
+        )
+        for name in source_names
+    }
+    record_manager = next(iter(record_managers.values()))
+    record_manager.create_schema()
+    # Runs before the record manager was partitioned by source wrote to a single
+    # namespace. Its records would otherwise look new and never be swept.
+    legacy_records = migrate_legacy_records(index_name, RECORD_MANAGER_DB_URL)
+
+    # crawl -> extract + split -> filter -> dedup -> fill metadata -> index, one
+    # page at a time. Crawling runs in background threads and extraction and
+    # splitting in INGEST_WORKERS processes, behind bounded queues, so embedding
+    # and upserting overlap with the crawl and memory does not grow with the corpus.
+    # Records of sources that are still live get refreshed while indexing, so
+    # anything older than this timestamp afterwards is stale. A resumed run keeps
+    # the timestamp of the run it resumes.
+    index_start_dt = record_manager.get_time()
+    journal = IngestionJournal(INGEST_JOURNAL_PATH) if INGEST_JOURNAL_PATH else None
+    resumed = False
+    if journal is not None:
+        if resume and (run := journal.resume()) is not None:
+            logger.info(f"Resuming ingestion run {run.id}")
+            index_start_dt = run.index_start_dt
+            resumed = True
+        else:
+            if resume:
+                logger.warning("No unfinished ingestion run to resume")
+            journal.start(index_start_dt)
+
+    fetcher = CachedFetcher(HTTPCache(HTTP_CACHE_PATH)) if HTTP_CACHE_PATH else None
+    if from_snapshot is not None:
+        # Nothing is fetched, the documents come extracted from the snapshot.
+        fetcher = None
+        logger.info(
+            f"Indexing {sum(manifest['sources'][name] for name in source_names)} "
+            f"docs from the snapshot {from_snapshot}"
+        )
+        sources = {
+            name: partial(iter_snapshot_tasks, from_snapshot, name, journal=journal)
+            for name in source_names
+        }
+    else:
+        sources = {
+            name: partial(
+                iter_extraction_tasks,
+                name,
+                DOC_SOURCES[name],
+                fetcher=fetcher,
+                journal=journal,
+            )
+            for name in source_names
+        }
+    callbacks: list[Callable[..., None]] = []
+    if journal is not None:
+        callbacks.append(partial(journal_extracted, journal))
+    snapshot = SnapshotWriter(export_snapshot) if export_snapshot else None
+    if snapshot is not None:
+        callbacks.append(partial(export_extracted, snapshot))
+    sources = {
+        name: partial(_tracked_source, telemetry, name, load)
+        for name, load in sources.items()
+    }
+    errors: dict[str, BaseException] = {}
+    tasks = stream_docs_concurrently(
+        sources,
+        errors,
+        max_concurrency=INGEST_MAX_CONCURRENCY,
+        queue_size=INGEST_QUEUE_SIZE,
+    )
+    docs = extract_and_split(
+        tasks,
+        DOC_SOURCES,
+        text_splitters,
+        workers=INGEST_WORKERS,
+        fetcher=fetcher,
+        errors=errors,
+        on_extracted=partial(_call_all, callbacks) if callbacks else None,
+        return_documents=snapshot is not None,
+        telemetry=telemetry,
+        source_key=_SOURCE_KEY,
+    )
+    # Time in each stage excludes the stages it pulls from, so this one is the
+    # time spent waiting on the crawl and the extraction workers.
+    docs = telemetry.track("extract_and_split", docs, size=_doc_bytes)
+    docs = telemetry.track("filter", filter_short_docs(docs), size=_doc_bytes)
+    # The filter state lives on disk, so that a resumed run still drops
+    # near-duplicates of the pages indexed before the crash.
+    dedup = NearDuplicateFilter(
+        threshold=INGEST_DEDUP_THRESHOLD, path=INGEST_DEDUP_PATH
+    )
+    if resumed:
+        assert journal is not None
+        # Their chunks are fed to the filter again.
+        dedup.forget(journal.unindexed_pages())
+    else:
+        dedup.start_generation()
+    docs = telemetry.track("dedup", drop_near_duplicates(docs, dedup), size=_doc_bytes)
+    chunks = fill_missing_metadata(docs)
+    if isinstance(embedding, CachedEmbeddings):
+        # The run being resumed already started its generation.
+        if not resumed:
+            embedding.store.start_generation()
+        chunks = touch_cached_embeddings(chunks, embedding)
+
+    force_update = (os.environ.get("FORCE_UPDATE") or "false").lower() == "true"
+
+    def index_source(name: str, docs: Iterable[Document]) -> dict:
+        if journal is not None:
+            docs = journaled_docs = JournaledBatches(
+                docs, journal, batch_size=INGEST_BATCH_SIZE
+            )
+        stats = index(
+            docs,
+            record_managers[name],
+            vectorstores[name],
+            batch_size=INGEST_BATCH_SIZE,
+            cleanup="incremental",
+            source_id_key="source",
+            force_update=force_update,
+        )
+        if journal is not None:
+            journaled_docs.flush()
+        return stats
+
+    index_start = time.perf_counter()
+    try:
+        source_stats = index_by_source(
+            iter_in_background(chunks, maxsize=INGEST_QUEUE_SIZE),
+            index_source,
+            source_names,
+            source_key=_SOURCE_KEY,
+            maxsize=INGEST_QUEUE_SIZE,
+        )
+    except BaseException:
+        if snapshot is not None:
+            snapshot.abort()
+        raise
+    finally:
+        dedup.close()
+    indexing_stats = {
+        key: sum(stats[key] for stats in source_stats.values())
+        for key in ("num_added", "num_updated", "num_skipped", "num_deleted")
+    }
+    telemetry.add(
+        "index",
+        items=sum(
+            indexing_stats[key] for key in ("num_added", "num_updated", "num_skipped")
+        ),
+        seconds=time.perf_counter() - index_start,
+    )
+    if snapshot is not None:
+        # A snapshot missing pages would not reproduce this corpus.
+        if errors:
+            snapshot.abort()
+            logger.warning(f"Left the snapshot {export_snapshot} incomplete")
+        else:
+            snapshot.close()
+            logger.info(f"Exported a snapshot of the corpus to {export_snapshot}")
+
+    # Finish with the sweep of cleanup="full", source by source. It would delete
+    # every vector of a source that failed to load, so such sources are skipped.
+    # A new build has nothing stale, it replaces the whole collection instead.
+    if errors:
+        logger.warning(
+            f"Failed to load docs from {', '.join(errors)}, "
+            + (
+                f"not serving the incomplete build {index_name}"
+                if blue_green
+                else "skipping the cleanup of their stale records"
+            )
+        )
+    if blue_green:
+        if not errors:
+            validate_build(
+                client,
+                index_name,
+                vectorstores[source_names[0]],
+                expected_count=sum(rm.count() for rm in record_managers.values()),
+            )
+            aliases.swap(WEAVIATE_DOCS_INDEX_NAME, index_name)
+            drop_old_builds(client, WEAVIATE_DOCS_INDEX_NAME, RECORD_MANAGER_DB_URL)
+    else:
+        sweep_start = time.perf_counter()
+        num_swept = 0
+        for name in source_names:
+            if name not in errors:
+                num_swept += delete_stale_records(
+                    record_managers[name], vectorstores[name], before=index_start_dt
+                )
+        if legacy_records is not None and not errors:
+            # Keys a source also has were written again by this run, the others
+            # are of pages no source crawls anymore.
+            legacy_records.delete_keys_recorded_in(
+                [source_namespace(index_name, name) for name in DOC_SOURCES]
+            )
+            num_swept += delete_stale_records(
+                legacy_records, vectorstores[source_names[0]], before=index_start_dt
+            )
+        telemetry.add(
+            "sweep", items=num_swept, seconds=time.perf_counter() - sweep_start
+        )
+        indexing_stats["num_deleted"] += num_swept
+    if journal is not None:
+        # A run with failed sources can be resumed to retry them.
+        journal.finish("failed" if errors else "completed")
+
+    if fetcher is not None:
+        logger.info(f"HTTP cache stats: {dict(fetcher.stats)}")
+    if isinstance(embedding, CachedEmbeddings):
+        scheduler = embedding.underlying
+    else:
+        scheduler = embedding
+    embedding_stats = {}
+    if isinstance(scheduler, ScheduledEmbeddings):
+        embedding_stats = {
+            "model": scheduler.model,
+            **scheduler.stats.as_dict(),
+            "cost_usd": embedding_cost(scheduler.model, scheduler.stats.tokens),
+        }
+        telemetry.add(
+            "embed", items=scheduler.stats.texts, seconds=scheduler.stats.seconds
+        )
+        logger.info(f"Embedding stats: {embedding_stats}")
+    write_stats = WriteStats()
+    for vectorstore in vectorstores.values():
+        write_stats.objects += vectorstore.stats.objects
+        write_stats.retries += vectorstore.stats.retries
+        write_stats.seconds += vectorstore.stats.seconds
+    telemetry.add("upsert", items=write_stats.objects, seconds=write_stats.seconds)
+    for name, stats in source_stats.items():
+        logger.info(f"Indexing stats of {name}: {stats}")
     logger.info(f"Indexing stats: {indexing_stats}")
-    num_vecs = (
-        client.collections.get(WEAVIATE_DOCS_INDEX_NAME)
-        .aggregate.over_all()
-        .total_count
+    report = telemetry.report(
+        status="failed" if errors else "completed",
+        failed_sources=sorted(errors),
+        indexing=indexing_stats,
+        embedding=embedding_stats,
+        upsert=write_stats.as_dict(),
+        http_cache=dict(fetcher.stats) if fetcher is not None else {},
+        config={
+            "workers": INGEST_WORKERS,
+            "batch_size": INGEST_BATCH_SIZE,
+            "chunk_tokens": INGEST_CHUNK_TOKENS,
+            "weaviate_batch_size": WEAVIATE_BATCH_SIZE,
+            "from_snapshot": from_snapshot,
+            "resumed": resumed,
+            "index_name": index_name,
+            "sources": source_names,
+        },
     )
+    logger.info(f"Ingestion stages: {report['stages']}")
+    logger.info(f"Peak memory: {report['memory']}")
+    if INGEST_REPORT_DIR:
+        history = read_history(INGEST_REPORT_DIR)
+        logger.info(
+            f"Wrote the ingestion report to {write_report(INGEST_REPORT_DIR, report)}"
+        )
+        if history:
+            for regression in find_regressions(history[-1], report):
+                logger.warning(f"Ingestion throughput regressed in {regression}")
+    num_vecs = client.collections.get(index_name).aggregate.over_all().total_count
     logger.info(
         f"LangChain now has this many vectors: {num_vecs}",
     )
 
 
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume the last unfinished run from INGEST_JOURNAL_PATH",
+    )
+    mode.add_argument(
+        "--restart",
+        action="store_true",
+        help="Start a new run, discarding the journal of the last one (default)",
+    )
+    snapshot = parser.add_mutually_exclusive_group()
+    snapshot.add_argument(
+        "--from-snapshot",
+        metavar="DIR",
+        help="Index the documents of a snapshot instead of crawling the sources",
+    )
+    snapshot.add_argument(
+        "--export-snapshot",
+        metavar="DIR",
+        help="Also write the extracted documents to a new snapshot in DIR",
+    )
+    parser.add_argument(
+        "--blue-green",
+        action="store_true",
+        help="Build a new collection and point the alias at it once validated",
+    )
+    parser.add_argument(
+        "--sources",
+        nargs="+",
+        metavar="SOURCE",
+        help=f"Only ingest these sources, among {', '.join(DOC_SOURCES)}",
+    )
+    args = parser.parse_args()
+    if args.blue_green and args.sources:
+        # A new build must hold every source.
+        parser.error("--sources cannot be used with --blue-green")
+    if args.resume and args.blue_green:
+        # The journal does not record which collection the crashed build was in.
+        parser.error("--blue-green cannot be used with --resume")
+    if args.resume and not os.environ.get("INGEST_JOURNAL_PATH"):
+        parser.error("--resume requires INGEST_JOURNAL_PATH")
+    if args.resume and args.export_snapshot:
+        # Pages indexed before the crash would be missing from the snapshot.
+        parser.error("--export-snapshot cannot be used with --resume")
+    ingest_docs(
+        resume=args.resume,
+        from_snapshot=args.from_snapshot,
+        export_snapshot=args.export_snapshot,
+        blue_green=args.blue_green,
+        source_names=args.sources,
+    )
+
+
 if __name__ == "__main__":
-    ingest_docs()
+    main()
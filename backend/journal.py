@@ -0,0 +1,227 @@
+"""SQLite journal of an ingestion run, so that a crashed run can be resumed.
+
+The journal follows every page through the pipeline:
+
+- a source is "crawled" once all of its pages have been extracted and split,
+- a page is "split" once its chunks are journaled, and "indexed" once all of
+  them have been upserted.
+
+A resumed run re-crawls only the sources that were not fully crawled, takes the
+chunks of "split" pages from the journal instead of fetching them again, and
+skips "indexed" pages entirely. It also reuses the original run's start time, so
+the final sweep of stale records still spares everything the crashed run wrote.
+
+Only the latest run is kept: starting a new run clears the journal.
+"""
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Iterator, Literal, Optional
+
+from backend.extraction import Record
+
+RunStatus = Literal["running", "completed", "failed"]
+PageStatus = Literal["split", "indexed"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at REAL NOT NULL,
+    index_start_dt REAL NOT NULL,
+    status TEXT NOT NULL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS sources (
+    run_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    PRIMARY KEY (run_id, name)
+);
+CREATE TABLE IF NOT EXISTS pages (
+    run_id INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    source TEXT NOT NULL,
+    status TEXT NOT NULL,
+    records BLOB NOT NULL,
+    PRIMARY KEY (run_id, url)
+);
+CREATE TABLE IF NOT EXISTS batches (
+    run_id INTEGER NOT NULL,
+    batch_no INTEGER NOT NULL,
+    num_chunks INTEGER NOT NULL,
+    committed_at REAL NOT NULL,
+    PRIMARY KEY (run_id, batch_no)
+);
+"""
+
+
+@dataclass
+class Run:
+    id: int
+    started_at: float
+    index_start_dt: float
+    status: RunStatus
+
+
+def _dump_records(records: list[Record]) -> bytes:
+    return zlib.compress(json.dumps(records).encode("utf-8"))
+
+
+def _load_records(blob: bytes) -> list[Record]:
+    return [(text, metadata) for text, metadata in json.loads(zlib.decompress(blob))]
+
+
+class IngestionJournal:
+    """Journal of the current ingestion run, see the module docstring."""
+
+    def __init__(self, path: str | Path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self.run: Optional[Run] = None
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    @property
+    def run_id(self) -> int:
+        if self.run is None:
+            raise RuntimeError("No ingestion run was started or resumed")
+        return self.run.id
+
+    def last_run(self) -> Optional[Run]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, started_at, index_start_dt, status FROM runs "
+                "ORDER BY id DESC LIMIT 1"
+            ).fetchone()
+        return Run(*row) if row is not None else None
+
+    def start(self, index_start_dt: float) -> Run:
+        """Start a new run, discarding the journal of previous runs."""
+        with self._lock, self._conn:
+            for table in ("runs", "sources", "pages", "batches"):
+                self._conn.execute(f"DELETE FROM {table}")
+            cursor = self._conn.execute(
+                "INSERT INTO runs (started_at, index_start_dt, status) "
+                "VALUES (?, ?, 'running')",
+                (time.time(), index_start_dt),
+            )
+        self.run = Run(cursor.lastrowid, time.time(), index_start_dt, "running")
+        return self.run
+
+    def resume(self) -> Optional[Run]:
+        """Resume the last run, unless it completed. Returns None if there is none."""
+        run = self.last_run()
+        if run is None or run.status == "completed":
+            return None
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE runs SET status = 'running', finished_at = NULL WHERE id = ?",
+                (run.id,),
+            )
+        run.status = "running"
+        self.run = run
+        return run
+
+    def finish(self, status: RunStatus) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE runs SET status = ?, finished_at = ? WHERE id = ?",
+                (status, time.time(), self.run_id),
+            )
+        assert self.run is not None
+        self.run.status = status
+
+    def is_source_crawled(self, name: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status FROM sources WHERE run_id = ? AND name = ?",
+                (self.run_id, name),
+            ).fetchone()
+        return row is not None and row[0] == "crawled"
+
+    def mark_source_crawled(self, name: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sources VALUES (?, ?, 'crawled')",
+                (self.run_id, name),
+            )
+
+    def page_status(self, url: str) -> Optional[PageStatus]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status FROM pages WHERE run_id = ? AND url = ?",
+                (self.run_id, url),
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def page_records(self, url: str) -> Optional[list[Record]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT records FROM pages WHERE run_id = ? AND url = ?",
+                (self.run_id, url),
+            ).fetchone()
+        return _load_records(row[0]) if row is not None else None
+
+    def record_page(self, source: str, url: str, records: list[Record]) -> None:
+        """Journal the chunks of a page, unless it is already journaled."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO pages VALUES (?, ?, ?, 'split', ?)",
+                (self.run_id, url, source, _dump_records(records)),
+            )
+
+    def pending_pages(self, source: str) -> Iterator[tuple[str, list[Record]]]:
+        """The pages of `source` that were split but not indexed, with their chunks."""
+        with self._lock:
+            urls = [
+                url
+                for (url,) in self._conn.execute(
+                    "SELECT url FROM pages "
+                    "WHERE run_id = ? AND source = ? AND status = 'split' "
+                    "ORDER BY rowid",
+                    (self.run_id, source),
+                )
+            ]
+        for url in urls:
+            records = self.page_records(url)
+            if records is not None:
+                yield url, records
+
+    def unindexed_pages(self) -> list[str]:
+        """The URLs of the pages that were split but not indexed, of any source."""
+        with self._lock:
+            return [
+                url
+                for (url,) in self._conn.execute(
+                    "SELECT url FROM pages WHERE run_id = ? AND status = 'split'",
+                    (self.run_id,),
+                )
+            ]
+
+    def record_batch(self, num_chunks: int, urls: Iterable[str]) -> None:
+        """Journal an upserted batch and mark the pages it completed as indexed."""
+        urls = list(urls)
+        with self._lock, self._conn:
+            (batch_no,) = self._conn.execute(
+                "SELECT COUNT(*) FROM batches WHERE run_id = ?", (self.run_id,)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT INTO batches VALUES (?, ?, ?, ?)",
+                (self.run_id, batch_no, num_chunks, time.time()),
+            )
+            self._conn.executemany(
+                "UPDATE pages SET status = 'indexed', records = ? "
+                "WHERE run_id = ? AND url = ?",
+                # The chunks are not needed anymore.
+                ((_dump_records([]), self.run_id, url) for url in urls),
+            )
@@ -0,0 +1,203 @@
+"""Persistent cache and batching of LLM-as-judge grades.
+
+A grade is keyed by the sha256 of the judge model and the rendered judge prompt,
+which contains the question, the answer and the context or reference answer,
+so an evaluation rerun on unchanged outputs doesn't call the judge again.
+
+`BatchGrader` also combines grade requests made concurrently, as `evaluate`
+does from its worker threads, into a single structured-output call grading
+several examples at once.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Optional
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.pydantic_v1 import BaseModel, Field
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS grades (
+    key TEXT PRIMARY KEY,
+    score REAL NOT NULL,
+    reason TEXT NOT NULL
+);
+"""
+
+BATCH_INSTRUCTIONS = """
+
+You are given {num_examples} examples, each between <example id='...'> tags. \
+Grade each of them independently of the others and return exactly one grade per \
+example, with the id of the example it grades."""
+
+
+class GradeAnswer(BaseModel):
+    """Evaluate correctness of the answer and assign a continuous score."""
+
+    reason: str = Field(
+        description="1-2 short sentences with the reason why the score was assigned"
+    )
+    score: float = Field(
+        description="Score that shows how correct the answer is. Use 1.0 if completely correct and 0.0 if completely incorrect",
+        minimum=0.0,
+        maximum=1.0,
+    )
+
+
+class GradeExample(GradeAnswer):
+    id: int = Field(description="Id of the graded example")
+
+
+class GradeAnswers(BaseModel):
+    """Evaluate correctness of the answer of each example and assign it a score."""
+
+    grades: list[GradeExample] = Field(description="One grade per example")
+
+
+def judge_key(judge_model: str, messages: list[BaseMessage]) -> str:
+    payload = json.dumps(
+        [judge_model, [[message.type, message.content] for message in messages]]
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class JudgeCache:
+    """Grades by judge key, in a SQLite file shared by concurrent evaluators."""
+
+    def __init__(self, path: str | Path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+
+    def get(self, key: str) -> Optional[GradeAnswer]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT score, reason FROM grades WHERE key = ?", (key,)
+            ).fetchone()
+        return GradeAnswer(score=row[0], reason=row[1]) if row is not None else None
+
+    def put(self, key: str, grade: GradeAnswer) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO grades VALUES (?, ?, ?)",
+                (key, grade.score, grade.reason),
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class BatchGrader:
+    """Grades answers with `prompt`, caching grades and batching judge calls.
+
+    A request waits up to `max_wait` seconds for others to fill a batch of
+    `batch_size`. Examples missing from the judge's answer to a batch are graded
+    one by one. With a `batch_size` of 1, every example gets its own call.
+    """
+
+    def __init__(
+        self,
+        llm: Any,
+        prompt: ChatPromptTemplate,
+        judge_model: str,
+        cache: Optional[JudgeCache] = None,
+        batch_size: int = 4,
+        max_wait: float = 1.0,
+    ):
+        self.prompt = prompt
+        self.judge_model = judge_model
+        self.cache = cache
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._single = llm.with_structured_output(GradeAnswer)
+        self._batch = (
+            llm.with_structured_output(GradeAnswers) if batch_size > 1 else None
+        )
+        self._lock = threading.Lock()
+        self._pending: list[tuple[list[BaseMessage], Future]] = []
+        self._generation = 0
+
+    def grade(self, inputs: dict[str, Any]) -> GradeAnswer:
+        messages = self.prompt.format_messages(**inputs)
+        key = judge_key(self.judge_model, messages)
+        if self.cache is not None and (grade := self.cache.get(key)) is not None:
+            return grade
+        if self._batch is None:
+            grade = self._single.invoke(messages)
+        else:
+            grade = self._submit(messages).result()
+        if self.cache is not None:
+            self.cache.put(key, grade)
+        return grade
+
+    def _submit(self, messages: list[BaseMessage]) -> Future:
+        future: Future = Future()
+        batch = None
+        with self._lock:
+            self._pending.append((messages, future))
+            if len(self._pending) >= self.batch_size:
+                batch, self._pending = self._pending, []
+                self._generation += 1
+            elif len(self._pending) == 1:
+                timer = threading.Timer(
+                    self.max_wait, self._flush, args=(self._generation,)
+                )
+                timer.daemon = True
+                timer.start()
+        if batch:
+            self._run(batch)
+        return future
+
+    def _flush(self, generation: int) -> None:
+        with self._lock:
+            # The batch this timer was started for already ran when full.
+            if generation != self._generation:
+                return
+            batch, self._pending = self._pending, []
+            self._generation += 1
+        if batch:
+            self._run(batch)
+
+    def _run(self, batch: list[tuple[list[BaseMessage], Future]]) -> None:
+        try:
+            grades = self._grade_batch([messages for messages, _ in batch])
+        except BaseException as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), grade in zip(batch, grades):
+            future.set_result(grade)
+
+    def _grade_batch(self, batch: list[list[BaseMessage]]) -> list[GradeAnswer]:
+        if len(batch) == 1:
+            return [self._single.invoke(batch[0])]
+        assert self._batch is not None
+        # The system prompt has no variables, only the last message differs.
+        system, *_ = batch[0]
+        examples = "\n\n".join(
+            f"<example id='{i}'>\n{messages[-1].content}\n</example>"
+            for i, messages in enumerate(batch)
+        )
+        result = self._batch.invoke(
+            [
+                SystemMessage(
+                    system.content + BATCH_INSTRUCTIONS.format(num_examples=len(batch))
+                ),
+                HumanMessage(examples),
+            ]
+        )
+        grades = {
+            grade.id: GradeAnswer(reason=grade.reason, score=grade.score)
+            for grade in (result.grades if result is not None else [])
+        }
+        return [
+            grades.get(i) or self._single.invoke(messages)
+            for i, messages in enumerate(batch)
+        ]
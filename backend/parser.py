@@ -1,110 +1,133 @@
 import re
-from typing import Generator
+from typing import Union
 
-from bs4 import BeautifulSoup, Doctype, NavigableString, Tag
+from bs4 import BeautifulSoup, Doctype, Tag
+
+# Remove all the tags that are not meaningful for the extraction.
+SCAPE_TAGS = frozenset(["nav", "footer", "aside", "script", "style"])
+
+HEADING_TAGS = frozenset(["h1", "h2", "h3", "h4", "h5", "h6"])
+
+_LANGUAGE_CLASS_REGEX = re.compile(r"language-\w+")
+_NEWLINES_REGEX = re.compile(r"\n\n+")
+
+
+# `Tag.find_all` goes through BeautifulSoup's generic matching machinery, which
+# dominates the extraction time. A plain scan over the descendants is much faster.
+def _find_all(tag: Tag, name: str, **attrs: str) -> list[Tag]:
+    return [
+        el
+        for el in tag.descendants
+        if isinstance(el, Tag)
+        and el.name == name
+        and all(el.get(key) == value for key, value in attrs.items())
+    ]
+
+
+def _has_class(tag: Tag, cls: str) -> bool:
+    return cls in tag.get("class", ())
+
+
+def _code_block(code: Tag, pre: Tag) -> str:
+    language = next(
+        (cls for cls in pre.get("class", []) if _LANGUAGE_CLASS_REGEX.match(cls)), None
+    )
+    language = "" if language is None else language.split("-")[1]
+    lines = [
+        "".join(token.get_text() for token in _find_all(span, "span"))
+        for span in _find_all(code, "span")
+        if _has_class(span, "token-line")
+    ]
+    code_content = "\n".join(lines)
+    return f"```{language}\n{code_content}\n```\n\n"
+
+
+def _table(table: Tag) -> str:
+    parts: list[str] = []
+    theads = _find_all(table, "thead")
+    if theads:
+        headers = _find_all(theads[0], "th")
+        if headers:
+            parts.append("| " + " | ".join(header.get_text() for header in headers))
+            parts.append(" |\n| " + " | ".join("----" for _ in headers) + " |\n")
+
+    tbodies = _find_all(table, "tbody")
+    if tbodies:
+        for row in _find_all(tbodies[0], "tr"):
+            cells = (cell.get_text(strip=True) for cell in _find_all(row, "td"))
+            parts.append("| " + " | ".join(cells) + " |\n")
+
+    parts.append("\n\n")
+    return "".join(parts)
 
 
 def langchain_docs_extractor(soup: BeautifulSoup) -> str:
-    # Remove all the tags that are not meaningful for the extraction.
-    SCAPE_TAGS = ["nav", "footer", "aside", "script", "style"]
-    [tag.decompose() for tag in soup.find_all(SCAPE_TAGS)]
-
-    def get_text(tag: Tag) -> Generator[str, None, None]:
-        for child in tag.children:
-            if isinstance(child, Doctype):
-                continue
-
-            if isinstance(child, NavigableString):
-                yield child
-            elif isinstance(child, Tag):
-                if child.name in ["h1", "h2", "h3", "h4", "h5", "h6"]:
-                    yield f"{'#' * int(child.name[1:])} {child.get_text()}\n\n"
-                elif child.name == "a":
-                    yield f"[{child.get_text(strip=False)}]({child.get('href')})"
-                elif child.name == "img":
-                    yield f"![{child.get('alt', '')}]({child.get('src')})"
-                elif child.name in ["strong", "b"]:
-                    yield f"**{child.get_text(strip=False)}**"
-                elif child.name in ["em", "i"]:
-                    yield f"_{child.get_text(strip=False)}_"
-                elif child.name == "br":
-                    yield "\n"
-                elif child.name == "code":
-                    parent = child.find_parent()
-                    if parent is not None and parent.name == "pre":
-                        classes = parent.attrs.get("class", "")
-
-                        language = next(
-                            filter(lambda x: re.match(r"language-\w+", x), classes),
-                            None,
-                        )
-                        if language is None:
-                            language = ""
-                        else:
-                            language = language.split("-")[1]
-
-                        lines: list[str] = []
-                        for span in child.find_all("span", class_="token-line"):
-                            line_content = "".join(
-                                token.get_text() for token in span.find_all("span")
-                            )
-                            lines.append(line_content)
-
-                        code_content = "\n".join(lines)
-                        yield f"```{language}\n{code_content}\n```\n\n"
-                    else:
-                        yield f"`{child.get_text(strip=False)}`"
-
-                elif child.name == "p":
-                    yield from get_text(child)
-                    yield "\n\n"
-                elif child.name == "ul":
-                    for li in child.find_all("li", recursive=False):
-                        yield "- "
-                        yield from get_text(li)
-                        yield "\n\n"
-                elif child.name == "ol":
-                    for i, li in enumerate(child.find_all("li", recursive=False)):
-                        yield f"{i + 1}. "
-                        yield from get_text(li)
-                        yield "\n\n"
-                elif child.name == "div" and "tabs-container" in child.attrs.get(
-                    "class", [""]
-                ):
-                    tabs = child.find_all("li", {"role": "tab"})
-                    tab_panels = child.find_all("div", {"role": "tabpanel"})
-                    for tab, tab_panel in zip(tabs, tab_panels):
-                        tab_name = tab.get_text(strip=True)
-                        yield f"{tab_name}\n"
-                        yield from get_text(tab_panel)
-                elif child.name == "table":
-                    thead = child.find("thead")
-                    header_exists = isinstance(thead, Tag)
-                    if header_exists:
-                        headers = thead.find_all("th")
-                        if headers:
-                            yield "| "
-                            yield " | ".join(header.get_text() for header in headers)
-                            yield " |\n"
-                            yield "| "
-                            yield " | ".join("----" for _ in headers)
-                            yield " |\n"
-
-                    tbody = child.find("tbody")
-                    tbody_exists = isinstance(tbody, Tag)
-                    if tbody_exists:
-                        for row in tbody.find_all("tr"):
-                            yield "| "
-                            yield " | ".join(
-                                cell.get_text(strip=True) for cell in row.find_all("td")
-                            )
-                            yield " |\n"
-
-                    yield "\n\n"
-                elif child.name in ["button"]:
-                    continue
-                else:
-                    yield from get_text(child)
-
-    joined = "".join(get_text(soup))
-    return re.sub(r"\n\n+", "\n\n", joined).strip()
+    """Convert a LangChain docs page into Markdown-ish text.
+
+    Walks the tree once with an explicit stack instead of recursing, so the
+    depth of the page does not matter. The stack holds the nodes still to be
+    visited, in reverse order, interleaved with literal strings to emit.
+    """
+    for tag in [
+        el for el in soup.descendants if isinstance(el, Tag) and el.name in SCAPE_TAGS
+    ]:
+        tag.decompose()
+
+    parts: list[str] = []
+    stack: list[Union[str, Tag]] = list(reversed(soup.contents))
+    while stack:
+        node = stack.pop()
+        if isinstance(node, str):
+            # Literal strings we pushed ourselves and text nodes of the page.
+            if not isinstance(node, Doctype):
+                parts.append(node)
+            continue
+        if not isinstance(node, Tag):
+            continue
+
+        name = node.name
+        if name in HEADING_TAGS:
+            parts.append(f"{'#' * int(name[1:])} {node.get_text()}\n\n")
+        elif name == "a":
+            parts.append(f"[{node.get_text(strip=False)}]({node.get('href')})")
+        elif name == "img":
+            parts.append(f"![{node.get('alt', '')}]({node.get('src')})")
+        elif name in ("strong", "b"):
+            parts.append(f"**{node.get_text(strip=False)}**")
+        elif name in ("em", "i"):
+            parts.append(f"_{node.get_text(strip=False)}_")
+        elif name == "br":
+            parts.append("\n")
+        elif name == "code":
+            parent = node.parent
+            if parent is not None and parent.name == "pre":
+                parts.append(_code_block(node, parent))
+            else:
+                parts.append(f"`{node.get_text(strip=False)}`")
+        elif name == "p":
+            stack.append("\n\n")
+            stack.extend(reversed(node.contents))
+        elif name in ("ul", "ol"):
+            items = [
+                child
+                for child in node.contents
+                if isinstance(child, Tag) and child.name == "li"
+            ]
+            for i in reversed(range(len(items))):
+                stack.append("\n\n")
+                stack.extend(reversed(items[i].contents))
+                stack.append("- " if name == "ul" else f"{i + 1}. ")
+        elif name == "div" and _has_class(node, "tabs-container"):
+            tabs = _find_all(node, "li", role="tab")
+            tab_panels = _find_all(node, "div", role="tabpanel")
+            for tab, tab_panel in reversed(list(zip(tabs, tab_panels))):
+                stack.extend(reversed(tab_panel.contents))
+                stack.append(f"{tab.get_text(strip=True)}\n")
+        elif name == "table":
+            parts.append(_table(node))
+        elif name == "button":
+            continue
+        else:
+            stack.extend(reversed(node.contents))
+
+    return _NEWLINES_REGEX.sub("\n\n", "".join(parts)).strip()
@@ -0,0 +1,120 @@
+"""Sampling profiler for a fraction of graph runs.
+
+A run is profiled with probability `profile_rate`, from the graph's
+`Configuration` or GRAPH_PROFILE_RATE. The decision hashes the id of the run's
+last message, so every node of a run makes the same one. While a node of a
+profiled run executes, a background thread samples its stack every
+`SAMPLE_INTERVAL` seconds, catching network waits as well as Python-side work.
+The samples are written to GRAPH_PROFILE_DIR as collapsed stacks, rooted at the
+node's name, one file per node and run::
+
+    <profile dir>/<time>-<run key>-<node>.folded
+
+which `flamegraph.pl` or speedscope render directly. Nodes of runs that are
+not profiled only pay for the rate lookup.
+"""
+import hashlib
+import inspect
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from types import CodeType
+from typing import Any, Callable, Optional
+
+from langchain_core.runnables import RunnableConfig
+
+SAMPLE_INTERVAL = 0.005
+DEFAULT_PROFILE_DIR = "profiles"
+
+
+def profile_rate(config: RunnableConfig) -> float:
+    rate = config.get("configurable", {}).get("profile_rate")
+    if rate is None:
+        rate = os.environ.get("GRAPH_PROFILE_RATE") or 0.0
+    return float(rate)
+
+
+def should_profile(run_key: Optional[str], rate: float) -> bool:
+    if rate <= 0:
+        return False
+    if run_key is None:
+        return random.random() < rate
+    digest = hashlib.sha256(run_key.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64 < rate
+
+
+def _frame_name(frame: Any) -> str:
+    return f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_qualname}"
+
+
+class StackSampler:
+    """Counts the stacks of a thread, below the frame running `root`."""
+
+    def __init__(
+        self, thread_id: int, root: CodeType, interval: float = SAMPLE_INTERVAL
+    ):
+        self.thread_id = thread_id
+        self.root = root
+        self.interval = interval
+        self.stacks: Counter[tuple[str, ...]] = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="stack-sampler", daemon=True
+        )
+
+    def __enter__(self) -> "StackSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and frame.f_code is not self.root:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            # Outside of `root`, the thread is not running the node.
+            if frame is not None and stack:
+                self.stacks[tuple(reversed(stack))] += 1
+
+    def write_collapsed(self, path: Path, root_name: str) -> None:
+        with open(path, "w") as f:
+            for stack, count in self.stacks.items():
+                f.write(f"{';'.join((root_name, *stack))} {count}\n")
+
+
+def _run_node(
+    func: Callable, state: Any, config: RunnableConfig, accepts_config: bool
+) -> Any:
+    return func(state, config=config) if accepts_config else func(state)
+
+
+def profiled(node: str, func: Callable) -> Callable:
+    """Wrap the function of graph node `node` to profile sampled runs."""
+    accepts_config = "config" in inspect.signature(func).parameters
+
+    def wrapper(state: Any, config: RunnableConfig) -> Any:
+        rate = profile_rate(config)
+        messages = state.get("messages") or [None]
+        run_key = getattr(messages[-1], "id", None)
+        if not should_profile(run_key, rate):
+            return _run_node(func, state, config, accepts_config)
+
+        sampler = StackSampler(threading.get_ident(), _run_node.__code__)
+        with sampler:
+            result = _run_node(func, state, config, accepts_config)
+        profile_dir = Path(os.environ.get("GRAPH_PROFILE_DIR") or DEFAULT_PROFILE_DIR)
+        profile_dir.mkdir(parents=True, exist_ok=True)
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{(run_key or 'run')[:12]}-{node}"
+        sampler.write_collapsed(profile_dir / f"{name}.folded", node)
+        return result
+
+    return wrapper
@@ -0,0 +1,186 @@
+"""Compact storage of embeddings, with exact rescoring of the best candidates.
+
+`text-embedding-3-small` vectors take 6 KiB each as float32. Two encodings
+shrink them:
+
+- float16 halves them, at a negligible loss of precision,
+- int8 quarters them. `Int8Quantizer` calibrates a range per dimension on a
+  sample of vectors, clipping outliers, and maps it onto the 256 levels.
+
+The embedding cache stores vectors in either encoding with
+`EmbeddingStore(dtype=...)`.
+
+`QuantizedIndex` searches in two phases: every vector is scored against the
+query from its int8 codes, then the `oversample * k` best candidates are
+rescored exactly from their float vectors. Only the int8 codes need to be held
+in RAM, the float vectors are only read for the candidates and can stay memory
+mapped on disk::
+
+    <index dir>/codes.npy        int8 codes
+    <index dir>/quantizer.npz    per-dimension offsets and scales
+    <index dir>/vectors.npy      float16 (or float32) vectors for rescoring
+"""
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+# Rows scored at a time, which bounds the memory of the coarse phase.
+SCORE_BLOCK_SIZE = 16_384
+
+
+def to_float16(vectors: np.ndarray) -> np.ndarray:
+    return np.asarray(vectors, dtype=np.float16)
+
+
+class Int8Quantizer:
+    """Scalar int8 quantization with a range calibrated per dimension.
+
+    Each dimension's range spans the `clip` and `100 - clip` percentiles of the
+    calibration vectors; values outside of it are clipped.
+    """
+
+    def __init__(self, offset: np.ndarray, scale: np.ndarray):
+        self.offset = np.asarray(offset, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float32)
+
+    @classmethod
+    def fit(cls, vectors: np.ndarray, clip: float = 0.01) -> "Int8Quantizer":
+        vectors = np.asarray(vectors, dtype=np.float32)
+        low, high = np.percentile(vectors, [clip, 100 - clip], axis=0)
+        scale = np.maximum(high - low, 1e-12) / 255
+        return cls(offset=low, scale=scale)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        levels = np.rint(
+            (np.asarray(vectors, dtype=np.float32) - self.offset) / self.scale
+        )
+        return (np.clip(levels, 0, 255) - 128).astype(np.int8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return (codes.astype(np.float32) + 128) * self.scale + self.offset
+
+    def save(self, path: str | Path) -> None:
+        np.savez(path, offset=self.offset, scale=self.scale)
+
+    @classmethod
+    def load(cls, path: str | Path) -> "Int8Quantizer":
+        with np.load(path) as data:
+            return cls(offset=data["offset"], scale=data["scale"])
+
+
+class QuantizedIndex:
+    """Inner-product search over int8 codes, rescored with float vectors.
+
+    `vectors` may be None, in which case the coarse int8 scores are final.
+    """
+
+    def __init__(
+        self,
+        quantizer: Int8Quantizer,
+        codes: np.ndarray,
+        vectors: Optional[np.ndarray] = None,
+    ):
+        self.quantizer = quantizer
+        self.codes = codes
+        self.vectors = vectors
+
+    @classmethod
+    def build(
+        cls,
+        vectors: np.ndarray,
+        rescore_dtype: Optional[str] = "float16",
+        calibration_size: int = 10_000,
+        seed: int = 0,
+    ) -> "QuantizedIndex":
+        """Calibrate on a sample of `vectors` and encode them all."""
+        rng = np.random.default_rng(seed)
+        sample = rng.choice(
+            len(vectors), size=min(calibration_size, len(vectors)), replace=False
+        )
+        quantizer = Int8Quantizer.fit(vectors[np.sort(sample)])
+        codes = np.concatenate(
+            [
+                quantizer.encode(vectors[start : start + SCORE_BLOCK_SIZE])
+                for start in range(0, len(vectors), SCORE_BLOCK_SIZE)
+            ]
+        )
+        rescore = np.asarray(vectors, dtype=rescore_dtype) if rescore_dtype else None
+        return cls(quantizer, codes, rescore)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held in RAM: the codes, plus the float vectors if not mapped."""
+        nbytes = self.codes.nbytes + self.quantizer.offset.nbytes * 2
+        if self.vectors is not None and not isinstance(self.vectors, np.memmap):
+            nbytes += self.vectors.nbytes
+        return nbytes
+
+    def coarse_scores(self, queries: np.ndarray) -> np.ndarray:
+        """Approximate inner products of `queries` with every vector."""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        # With x = (c + 128) * scale + offset, q . x is the sum of (q * scale) . c
+        # and a constant per query, q . (128 * scale + offset).
+        scaled = queries * self.quantizer.scale
+        bias = queries @ (128 * self.quantizer.scale + self.quantizer.offset)
+        scores = np.empty((len(queries), len(self.codes)), dtype=np.float32)
+        for start in range(0, len(self.codes), SCORE_BLOCK_SIZE):
+            block = self.codes[start : start + SCORE_BLOCK_SIZE].astype(np.float32)
+            scores[:, start : start + len(block)] = scaled @ block.T
+        return scores + bias[:, None]
+
+    def search(
+        self, queries: np.ndarray, k: int, oversample: int = 4
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """The `k` best rows for each query and their scores, best first."""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        k = min(k, len(self))
+        scores = self.coarse_scores(queries)
+        num_candidates = min(
+            len(self), k * oversample if self.vectors is not None else k
+        )
+        candidates = np.argpartition(-scores, num_candidates - 1, axis=1)[
+            :, :num_candidates
+        ]
+        if self.vectors is not None:
+            scores = np.stack(
+                [
+                    self.vectors[np.sort(rows)].astype(np.float32) @ query
+                    for rows, query in zip(candidates, queries)
+                ]
+            )
+            candidates = np.sort(candidates, axis=1)
+        else:
+            scores = np.take_along_axis(scores, candidates, axis=1)
+        order = np.argsort(-scores, axis=1)[:, :k]
+        return (
+            np.take_along_axis(candidates, order, axis=1),
+            np.take_along_axis(scores, order, axis=1),
+        )
+
+    def save(self, path: str | Path) -> None:
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        self.quantizer.save(path / "quantizer.npz")
+        np.save(path / "codes.npy", self.codes)
+        if self.vectors is not None:
+            np.save(path / "vectors.npy", self.vectors)
+
+    @classmethod
+    def load(cls, path: str | Path, map_vectors: bool = True) -> "QuantizedIndex":
+        """Load an index, leaving its float vectors on disk with `map_vectors`."""
+        path = Path(path)
+        vectors_path = path / "vectors.npy"
+        vectors = (
+            np.load(vectors_path, mmap_mode="r" if map_vectors else None)
+            if vectors_path.exists()
+            else None
+        )
+        return cls(
+            Int8Quantizer.load(path / "quantizer.npz"),
+            np.load(path / "codes.npy"),
+            vectors,
+        )
@@ -0,0 +1,307 @@
+"""Opt-in log of the queries answered by the graph, for replaying real traffic.
+
+With QUERY_LOG_DIR set, every answered query is appended to rotating gzipped
+JSONL files in that directory::
+
+    <log dir>/queries-<start time>-00000.jsonl.gz
+    <log dir>/queries-<start time>-00001.jsonl.gz
+
+Records are put on a bounded queue and written by a background thread, so
+logging never blocks a request: when the queue is full, records are dropped and
+counted. A file is rotated once `max_bytes` of JSON were written to it.
+
+    python -m backend.query_log replay --log-dir logs --speed 10
+    python -m backend.query_log usage --log-dir logs
+"""
+import argparse
+import asyncio
+import atexit
+import gzip
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Iterable, Iterator, Optional, Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.messages import BaseMessage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 64 * 2**20
+DEFAULT_QUEUE_SIZE = 10_000
+# Idle time after which buffered records are flushed to disk.
+FLUSH_INTERVAL = 1.0
+
+
+def thread_hash(thread_id: Optional[str]) -> Optional[str]:
+    if thread_id is None:
+        return None
+    return hashlib.sha256(str(thread_id).encode("utf-8")).hexdigest()[:16]
+
+
+def query_record(
+    messages: Sequence[BaseMessage],
+    documents: Sequence[Document],
+    configurable: dict[str, Any],
+    latencies: dict[str, float],
+    usage: Optional[dict[str, dict[str, Any]]] = None,
+) -> dict[str, Any]:
+    return {
+        "ts": time.time(),
+        "thread": thread_hash(configurable.get("thread_id")),
+        "messages": [
+            {"role": message.type, "content": message.content} for message in messages
+        ],
+        "model_name": configurable.get("model_name"),
+        "k": configurable.get("k"),
+        "doc_ids": [doc.id or doc.metadata.get("source") for doc in documents],
+        "latencies": latencies,
+        "usage": usage,
+    }
+
+
+class QueryLogger:
+    """Appends records to rotating gzipped JSONL files from a background thread."""
+
+    def __init__(
+        self,
+        path: str | Path,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+    ):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.dropped = 0
+        self._prefix = f"queries-{time.strftime('%Y%m%dT%H%M%S')}"
+        self._queue: queue.Queue[Optional[dict]] = queue.Queue(maxsize=queue_size)
+        self._file: Optional[gzip.GzipFile] = None
+        self._file_no = 0
+        self._file_bytes = 0
+        self._thread = threading.Thread(
+            target=self._write_loop, name="query-logger", daemon=True
+        )
+        self._thread.start()
+
+    def log(self, record: dict[str, Any]) -> None:
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self) -> None:
+        """Write the queued records and close the current file."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self.dropped:
+            logger.warning(f"Query log dropped {self.dropped} records")
+
+    def _write_loop(self) -> None:
+        while True:
+            try:
+                record = self._queue.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                if self._file is not None:
+                    self._file.flush()
+                continue
+            if record is None:
+                break
+            try:
+                self._write(record)
+            except Exception:
+                logger.exception("Failed to write query log record")
+        if self._file is not None:
+            self._file.close()
+
+    def _write(self, record: dict[str, Any]) -> None:
+        line = (json.dumps(record, default=str) + "\n").encode("utf-8")
+        if self._file is not None and self._file_bytes >= self.max_bytes:
+            self._file.close()
+            self._file = None
+            self._file_no += 1
+        if self._file is None:
+            self._file = gzip.open(
+                self.path / f"{self._prefix}-{self._file_no:05d}.jsonl.gz", "wb"
+            )
+            self._file_bytes = 0
+        self._file.write(line)
+        self._file_bytes += len(line)
+
+
+_query_logger: Optional[QueryLogger] = None
+_query_logger_lock = threading.Lock()
+
+
+def get_query_logger() -> Optional[QueryLogger]:
+    """The process-wide logger, or None unless QUERY_LOG_DIR is set."""
+    global _query_logger
+    if _query_logger is None and (log_dir := os.environ.get("QUERY_LOG_DIR")):
+        with _query_logger_lock:
+            if _query_logger is None:
+                _query_logger = QueryLogger(
+                    log_dir,
+                    max_bytes=int(
+                        os.environ.get("QUERY_LOG_MAX_BYTES") or DEFAULT_MAX_BYTES
+                    ),
+                    queue_size=int(
+                        os.environ.get("QUERY_LOG_QUEUE_SIZE") or DEFAULT_QUEUE_SIZE
+                    ),
+                )
+                atexit.register(_query_logger.close)
+    return _query_logger
+
+
+def read_query_log(path: str | Path) -> Iterator[dict[str, Any]]:
+    """The records of every log file in `path`, oldest file first."""
+    for log_path in sorted(Path(path).glob("queries-*.jsonl.gz")):
+        try:
+            with gzip.open(log_path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    yield json.loads(line)
+        except EOFError:
+            # The file of a running or crashed process ends mid-stream.
+            logger.warning(f"Truncated query log file {log_path}")
+
+
+async def replay(
+    records: list[dict[str, Any]], speed: float, max_concurrency: int
+) -> list[dict[str, Any]]:
+    """Re-run `records` against the graph, `speed` times faster than logged.
+
+    With a `speed` of 0, records are replayed as fast as `max_concurrency`
+    allows. Returns, per record, the latency of the replay and the overlap of
+    its retrieved docs with the logged ones.
+    """
+    from backend.graph import graph
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+    start = time.perf_counter()
+    first_ts = records[0]["ts"] if records else 0.0
+
+    async def run(record: dict[str, Any]) -> dict[str, Any]:
+        if speed:
+            delay = (record["ts"] - first_ts) / speed - (time.perf_counter() - start)
+            await asyncio.sleep(max(0.0, delay))
+        configurable = {
+            key: record[key] for key in ("model_name", "k") if record.get(key)
+        }
+        async with semaphore:
+            request_start = time.perf_counter()
+            try:
+                state = await graph.ainvoke(
+                    {"messages": record["messages"]},
+                    {"configurable": configurable},
+                )
+            except Exception as e:
+                return {"ok": False, "error": repr(e)}
+            seconds = time.perf_counter() - request_start
+        logged = set(record["doc_ids"])
+        replayed = {doc.id or doc.metadata.get("source") for doc in state["documents"]}
+        return {
+            "ok": True,
+            "seconds": seconds,
+            "logged_seconds": sum(record["latencies"].values()),
+            "doc_overlap": len(logged & replayed) / len(logged | replayed)
+            if logged | replayed
+            else 1.0,
+        }
+
+    return await asyncio.gather(*(run(record) for record in records))
+
+
+def usage_by_model(records: Iterable[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Token and cost totals by model_name, turn kind and k, costliest first."""
+    groups: dict[tuple, list[dict[str, Any]]] = defaultdict(list)
+    for record in records:
+        if not record.get("usage"):
+            continue
+        key = (
+            record["model_name"],
+            "follow_up" if len(record["messages"]) > 1 else "first_turn",
+            record["k"],
+        )
+        groups[key].append(record)
+    rows = []
+    for (model_name, turn, k), group in groups.items():
+        totals = [record["usage"]["total"] for record in group]
+        cost = sum(total["cost_usd"] for total in totals)
+        rows.append(
+            {
+                "model_name": model_name,
+                "turn": turn,
+                "k": k,
+                "queries": len(group),
+                "cost_usd": cost,
+                "mean_cost_usd": cost / len(group),
+                "mean_input_tokens": np.mean([t["input_tokens"] for t in totals]),
+                "mean_output_tokens": np.mean([t["output_tokens"] for t in totals]),
+                "mean_history_messages": np.mean(
+                    [len(record["messages"]) - 1 for record in group]
+                ),
+            }
+        )
+    return sorted(rows, key=lambda row: row["cost_usd"], reverse=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    replay_parser = subparsers.add_parser(
+        "replay", help="Re-run logged queries against this build of the graph"
+    )
+    replay_parser.add_argument("--log-dir", required=True)
+    replay_parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="Pace relative to the logged traffic, 0 for as fast as possible",
+    )
+    replay_parser.add_argument("--max-concurrency", type=int, default=16)
+    replay_parser.add_argument("--limit", type=int, help="Replay the first N only")
+    replay_parser.add_argument("--output", help="Write the results as JSON lines")
+    usage_parser = subparsers.add_parser(
+        "usage", help="Sum logged tokens and cost by model, turn kind and k"
+    )
+    usage_parser.add_argument("--log-dir", required=True)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "usage":
+        for row in usage_by_model(read_query_log(args.log_dir)):
+            print(
+                f"{row['model_name'] or 'default'} {row['turn']} k={row['k']}: "
+                f"{row['queries']} queries, ${row['cost_usd']:.4f} "
+                f"(${row['mean_cost_usd']:.5f} each), "
+                f"{row['mean_input_tokens']:.0f} in / "
+                f"{row['mean_output_tokens']:.0f} out tokens, "
+                f"{row['mean_history_messages']:.1f} history messages"
+            )
+        return
+    records = sorted(read_query_log(args.log_dir), key=lambda record: record["ts"])
+    records = records[: args.limit] if args.limit else records
+    results = asyncio.run(replay(records, args.speed, args.max_concurrency))
+    if args.output:
+        with open(args.output, "w") as f:
+            for record, result in zip(records, results):
+                f.write(json.dumps({**record, "replay": result}) + "\n")
+
+    ok = [result for result in results if result["ok"]]
+    logger.info(f"Replayed {len(results)} queries, {len(results) - len(ok)} failed")
+    if ok:
+        for name in ("seconds", "logged_seconds"):
+            p50, p95, p99 = np.percentile([result[name] for result in ok], [50, 95, 99])
+            logger.info(f"{name}: p50 {p50:.3f}s, p95 {p95:.3f}s, p99 {p99:.3f}s")
+        overlap = np.mean([result["doc_overlap"] for result in ok])
+        logger.info(f"Mean overlap with the logged docs: {overlap:.1%}")
+
+
+if __name__ == "__main__":
+    main()
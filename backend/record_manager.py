@@ -0,0 +1,144 @@
+"""Record manager partitioned by doc source, with bulk key listing and deletes.
+
+Each source has its own namespace, `weaviate/{index_name}/{source}`, so that a
+single source can be re-indexed, and its stale records swept, without loading
+or touching the others. Records written before this partitioning are in the
+index namespace, `weaviate/{index_name}`, and are moved with `move_groups`.
+"""
+from typing import Optional, Sequence
+
+from langchain.indexes import SQLRecordManager
+from langchain.indexes._sql_record_manager import UpsertionRecord
+from sqlalchemy import delete, func, or_, select, update
+
+from backend.crawl import batched
+
+# Keys per DELETE statement, below the bound parameter limits of SQLite and
+# Postgres.
+DELETE_BATCH_SIZE = 10_000
+
+
+def index_namespace(index_name: str) -> str:
+    return f"weaviate/{index_name}"
+
+
+def source_namespace(index_name: str, source: str) -> str:
+    return f"{index_namespace(index_name)}/{source}"
+
+
+class BulkSQLRecordManager(SQLRecordManager):
+    """`SQLRecordManager` listing only keys and deleting them in bulk.
+
+    `list_keys` selects the key column rather than whole records and
+    `delete_keys` issues one DELETE per `DELETE_BATCH_SIZE` keys, without
+    syncing the session.
+    """
+
+    def list_keys(
+        self,
+        *,
+        before: Optional[float] = None,
+        after: Optional[float] = None,
+        group_ids: Optional[Sequence[str]] = None,
+        limit: Optional[int] = None,
+    ) -> list[str]:
+        query = select(UpsertionRecord.key).where(
+            UpsertionRecord.namespace == self.namespace
+        )
+        if after:
+            query = query.where(UpsertionRecord.updated_at > after)
+        if before:
+            query = query.where(UpsertionRecord.updated_at < before)
+        if group_ids:
+            query = query.where(UpsertionRecord.group_id.in_(group_ids))
+        if limit:
+            query = query.limit(limit)
+        with self._make_session() as session:
+            return list(session.scalars(query))
+
+    def delete_keys(self, keys: Sequence[str]) -> None:
+        with self._make_session() as session:
+            for batch in batched(keys, DELETE_BATCH_SIZE):
+                session.execute(
+                    delete(UpsertionRecord)
+                    .where(UpsertionRecord.namespace == self.namespace)
+                    .where(UpsertionRecord.key.in_(batch))
+                    .execution_options(synchronize_session=False)
+                )
+            session.commit()
+
+    def count(self) -> int:
+        with self._make_session() as session:
+            return session.scalar(
+                select(func.count())
+                .select_from(UpsertionRecord)
+                .where(UpsertionRecord.namespace == self.namespace)
+            )
+
+    def delete_namespace(self) -> int:
+        """Delete every record of this namespace and of its partitions."""
+        with self._make_session() as session:
+            result = session.execute(
+                delete(UpsertionRecord)
+                .where(
+                    or_(
+                        UpsertionRecord.namespace == self.namespace,
+                        UpsertionRecord.namespace.startswith(
+                            f"{self.namespace}/", autoescape=True
+                        ),
+                    )
+                )
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+        return result.rowcount
+
+    def move_groups(self, namespace: str, group_prefix: str) -> int:
+        """Move the records whose group id starts with `group_prefix` to
+        `namespace`, returning how many were moved.
+
+        Records whose key `namespace` already has are deleted instead.
+        """
+        in_groups = (
+            UpsertionRecord.namespace == self.namespace,
+            UpsertionRecord.group_id.startswith(group_prefix, autoescape=True),
+        )
+        with self._make_session() as session:
+            session.execute(
+                delete(UpsertionRecord)
+                .where(*in_groups)
+                .where(
+                    UpsertionRecord.key.in_(
+                        select(UpsertionRecord.key).where(
+                            UpsertionRecord.namespace == namespace
+                        )
+                    )
+                )
+                .execution_options(synchronize_session=False)
+            )
+            result = session.execute(
+                update(UpsertionRecord)
+                .where(*in_groups)
+                .values(namespace=namespace)
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+        return result.rowcount
+
+    def delete_keys_recorded_in(self, namespaces: Sequence[str]) -> int:
+        """Delete the records whose key one of `namespaces` also has."""
+        with self._make_session() as session:
+            result = session.execute(
+                delete(UpsertionRecord)
+                .where(UpsertionRecord.namespace == self.namespace)
+                .where(
+                    UpsertionRecord.key.in_(
+                        select(UpsertionRecord.key).where(
+                            UpsertionRecord.namespace.in_(namespaces)
+                        )
+                    )
+                )
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+        return result.rowcount
@@ -0,0 +1,159 @@
+"""Offline snapshots of the crawled and extracted corpus.
+
+A snapshot is a directory of gzipped JSONL shards, one document per line, and a
+manifest listing the shards with their source, size and checksum::
+
+    <snapshot>/manifest.json
+    <snapshot>/<source>-00000.jsonl.gz
+    <snapshot>/<source>-00001.jsonl.gz
+
+Documents are stored as extracted, before splitting, so a snapshot can be
+re-indexed with different chunking or embeddings without any network access.
+The manifest is written last: a directory without one is an incomplete snapshot.
+"""
+import gzip
+import hashlib
+import json
+import os
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, TextIO
+
+from langchain_core.documents import Document
+
+MANIFEST_NAME = "manifest.json"
+SNAPSHOT_VERSION = 1
+DEFAULT_SHARD_SIZE = 1000
+
+
+@dataclass
+class ShardInfo:
+    file: str
+    source: str
+    num_docs: int
+    bytes: int
+    sha256: str
+
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(1 << 20):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class SnapshotWriter:
+    """Write documents into a new snapshot, `shard_size` documents per shard."""
+
+    def __init__(self, path: str | Path, shard_size: int = DEFAULT_SHARD_SIZE):
+        self.path = Path(path)
+        if (self.path / MANIFEST_NAME).exists():
+            raise FileExistsError(f"{self.path} already holds a snapshot")
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.shard_size = shard_size
+        self.shards: list[ShardInfo] = []
+        # Open shard of each source: file, shard path and number of docs.
+        self._open: dict[str, tuple[TextIO, Path, int]] = {}
+        self._num_shards: dict[str, int] = {}
+
+    def __enter__(self) -> "SnapshotWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, source: str, doc: Document) -> None:
+        if source not in self._open:
+            index = self._num_shards.get(source, 0)
+            self._num_shards[source] = index + 1
+            shard_path = self.path / f"{source}-{index:05d}.jsonl.gz"
+            self._open[source] = (
+                gzip.open(shard_path, "wt", encoding="utf-8"),
+                shard_path,
+                0,
+            )
+        f, shard_path, num_docs = self._open[source]
+        f.write(
+            json.dumps(
+                {"page_content": doc.page_content, "metadata": doc.metadata},
+                default=str,
+            )
+            + "\n"
+        )
+        self._open[source] = (f, shard_path, num_docs + 1)
+        if num_docs + 1 >= self.shard_size:
+            self._close_shard(source)
+
+    def _close_shard(self, source: str) -> None:
+        f, shard_path, num_docs = self._open.pop(source)
+        f.close()
+        self.shards.append(
+            ShardInfo(
+                file=shard_path.name,
+                source=source,
+                num_docs=num_docs,
+                bytes=shard_path.stat().st_size,
+                sha256=_file_sha256(shard_path),
+            )
+        )
+
+    def abort(self) -> None:
+        """Close the shards but leave the snapshot without a manifest, incomplete."""
+        for f, _, _ in self._open.values():
+            f.close()
+        self._open.clear()
+
+    def close(self) -> None:
+        """Close the shards and write the manifest, completing the snapshot."""
+        for source in list(self._open):
+            self._close_shard(source)
+        sources: dict[str, int] = {}
+        for shard in self.shards:
+            sources[shard.source] = sources.get(shard.source, 0) + shard.num_docs
+        manifest = {
+            "version": SNAPSHOT_VERSION,
+            "created_at": time.time(),
+            "num_docs": sum(sources.values()),
+            "sources": sources,
+            "shards": [asdict(shard) for shard in self.shards],
+        }
+        tmp_path = self.path / f"{MANIFEST_NAME}.tmp"
+        tmp_path.write_text(json.dumps(manifest, indent=2))
+        os.replace(tmp_path, self.path / MANIFEST_NAME)
+
+
+def read_manifest(path: str | Path) -> dict:
+    manifest_path = Path(path) / MANIFEST_NAME
+    if not manifest_path.exists():
+        raise FileNotFoundError(f"{path} is not a complete snapshot: no manifest")
+    manifest = json.loads(manifest_path.read_text())
+    if manifest["version"] != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {manifest['version']}")
+    return manifest
+
+
+def iter_snapshot(
+    path: str | Path, sources: Optional[Iterable[str]] = None, verify: bool = True
+) -> Iterator[tuple[str, Document]]:
+    """Stream the documents of a snapshot, one shard at a time.
+
+    With `verify`, each shard is checked against its manifest checksum before
+    any of its documents are yielded.
+    """
+    path = Path(path)
+    manifest = read_manifest(path)
+    wanted = set(sources) if sources is not None else None
+    for shard in manifest["shards"]:
+        if wanted is not None and shard["source"] not in wanted:
+            continue
+        shard_path = path / shard["file"]
+        if verify and _file_sha256(shard_path) != shard["sha256"]:
+            raise ValueError(f"Checksum mismatch for snapshot shard {shard_path}")
+        with gzip.open(shard_path, "rt", encoding="utf-8") as f:
+            for line in f:
+                yield shard["source"], Document(**json.loads(line))
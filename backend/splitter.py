@@ -0,0 +1,235 @@
+"""Structure-aware splitting of the Markdown produced by the extractors.
+
+`langchain_docs_extractor` emits `#` headings and fenced code blocks.
+`MarkdownSectionSplitter` cuts the text at heading boundaries, never inside a
+code fence, and packs small adjacent sections together up to a token target.
+Each chunk records the headings it sits under in its `heading_path` metadata.
+It is only used for sources whose extractor emits Markdown (see
+`backend.ingest.MARKDOWN_SOURCES`), as in plain text a `# ` line may as well be a
+code comment.
+
+Only sections longer than the target are split further: between paragraphs and
+code blocks first, then code blocks between lines (each piece re-fenced so it
+stays a valid block) and paragraphs with `RecursiveCharacterTextSplitter`.
+"""
+import re
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Optional
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter, TextSplitter
+from langchain_core.documents import Document
+
+_HEADING_REGEX = re.compile(r"^(#{1,6}) +(.+?)[ #]*$")
+_FENCE_REGEX = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+
+HEADING_PATH_SEPARATOR = " > "
+
+
+class TokenLength:
+    """Length function counting tiktoken tokens.
+
+    The encoding is loaded lazily and left out when pickling, so splitters
+    using it can be shipped to worker processes.
+    """
+
+    def __init__(self, encoding_name: str = "cl100k_base"):
+        self.encoding_name = encoding_name
+        self._encoding: Any = None
+
+    def __call__(self, text: str) -> int:
+        if self._encoding is None:
+            import tiktoken
+
+            self._encoding = tiktoken.get_encoding(self.encoding_name)
+        return len(self._encoding.encode_ordinary(text))
+
+    def __getstate__(self) -> dict:
+        return {"encoding_name": self.encoding_name, "_encoding": None}
+
+
+@dataclass
+class _Piece:
+    text: str
+    length: int
+    path: tuple[str, ...]
+
+
+@dataclass
+class _Block:
+    text: str
+    # The opening fence line of a code block.
+    fence: Optional[str] = None
+    is_heading: bool = False
+
+
+def _parse_sections(text: str) -> list[tuple[tuple[str, ...], list[_Block]]]:
+    """Split Markdown into sections, each a heading path and its blocks."""
+    sections: list[tuple[tuple[str, ...], list[_Block]]] = []
+    path: list[tuple[int, str]] = []
+    blocks: list[_Block] = []
+    paragraph: list[str] = []
+    code: list[str] = []
+    fence: Optional[str] = None
+
+    def flush_paragraph() -> None:
+        if paragraph:
+            blocks.append(_Block("\n".join(paragraph)))
+            paragraph.clear()
+
+    for line in text.splitlines():
+        if fence is not None:
+            code.append(line)
+            stripped = line.strip()
+            if stripped.startswith(fence) and not stripped.strip(fence[0]):
+                blocks.append(_Block("\n".join(code), fence=code[0]))
+                code, fence = [], None
+            continue
+        if match := _FENCE_REGEX.match(line):
+            flush_paragraph()
+            fence, code = match.group(1), [line]
+        elif match := _HEADING_REGEX.match(line):
+            flush_paragraph()
+            if blocks:
+                sections.append((tuple(title for _, title in path), blocks))
+            level = len(match.group(1))
+            path = [(lvl, title) for lvl, title in path if lvl < level]
+            # The docs append a zero-width space (the anchor link) to headings.
+            path.append((level, match.group(2).strip("\u200b ")))
+            blocks = [_Block(line, is_heading=True)]
+        elif line.strip():
+            paragraph.append(line)
+        else:
+            flush_paragraph()
+
+    flush_paragraph()
+    if code:
+        # Unterminated fence, keep it as it is.
+        blocks.append(_Block("\n".join(code), fence=code[0]))
+    if blocks:
+        sections.append((tuple(title for _, title in path), blocks))
+    return sections
+
+
+def _common_prefix(paths: Iterable[tuple[str, ...]]) -> tuple[str, ...]:
+    paths = list(paths)
+    prefix = paths[0]
+    for path in paths[1:]:
+        n = 0
+        while n < min(len(prefix), len(path)) and prefix[n] == path[n]:
+            n += 1
+        prefix = prefix[:n]
+    return prefix
+
+
+class MarkdownSectionSplitter(TextSplitter):
+    """Split Markdown on headings into chunks of at most `chunk_size` tokens."""
+
+    def __init__(
+        self,
+        chunk_size: int = 1000,
+        length_function: Optional[Callable[[str], int]] = None,
+        **kwargs: Any,
+    ):
+        length_function = length_function or TokenLength()
+        super().__init__(
+            chunk_size=chunk_size,
+            chunk_overlap=0,
+            length_function=length_function,
+            **kwargs,
+        )
+        self._text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=0, length_function=length_function
+        )
+        self._separator_length = length_function("\n\n")
+
+    def _split_code(self, block: _Block) -> list[str]:
+        assert block.fence is not None
+        fence = block.fence.strip()
+        closing = fence[0] * (len(fence) - len(fence.lstrip(fence[0])))
+        lines = block.text.splitlines()[1:]
+        if lines and lines[-1].strip().startswith(closing):
+            lines = lines[:-1]
+        overhead = self._length_function(f"{block.fence}\n\n{closing}")
+        pieces: list[str] = []
+        group: list[str] = []
+        group_length = overhead
+        for line in lines:
+            line_length = self._length_function(line) + 1
+            if group and group_length + line_length > self._chunk_size:
+                pieces.append("\n".join([block.fence, *group, closing]))
+                group, group_length = [], overhead
+            group.append(line)
+            group_length += line_length
+        if group:
+            pieces.append("\n".join([block.fence, *group, closing]))
+        return pieces
+
+    def _section_pieces(
+        self, path: tuple[str, ...], blocks: list[_Block]
+    ) -> list[_Piece]:
+        pieces: list[_Piece] = []
+        heading: Optional[str] = None
+        for block in blocks:
+            if block.is_heading:
+                heading = block.text
+                continue
+            length = self._length_function(block.text)
+            if length <= self._chunk_size:
+                texts = [block.text]
+            elif block.fence is not None:
+                texts = self._split_code(block)
+            else:
+                texts = self._text_splitter.split_text(block.text)
+            for text in texts:
+                pieces.append(_Piece(text, self._length_function(text), path))
+            if heading is not None and texts:
+                # Keep the heading with the start of its section.
+                first = pieces[-len(texts)]
+                first.text = f"{heading}\n\n{first.text}"
+                first.length += self._length_function(heading) + self._separator_length
+                heading = None
+        if heading is not None:
+            pieces.append(_Piece(heading, self._length_function(heading), path))
+        return pieces
+
+    def _split_with_paths(self, text: str) -> list[tuple[str, tuple[str, ...]]]:
+        chunks: list[tuple[str, tuple[str, ...]]] = []
+        current: list[_Piece] = []
+        current_length = 0
+
+        def flush() -> None:
+            if current:
+                chunk = "\n\n".join(piece.text for piece in current)
+                chunks.append((chunk, _common_prefix(piece.path for piece in current)))
+                current.clear()
+
+        for path, blocks in _parse_sections(text):
+            for piece in self._section_pieces(path, blocks):
+                added_length = piece.length + (self._separator_length if current else 0)
+                if current and current_length + added_length > self._chunk_size:
+                    flush()
+                    added_length = piece.length
+                    current_length = 0
+                current.append(piece)
+                current_length += added_length
+        flush()
+        return chunks
+
+    def split_text(self, text: str) -> list[str]:
+        return [chunk for chunk, _ in self._split_with_paths(text)]
+
+    def create_documents(
+        self, texts: list[str], metadatas: Optional[list[dict]] = None
+    ) -> list[Document]:
+        metadatas = metadatas or [{}] * len(texts)
+        return [
+            Document(
+                page_content=chunk,
+                metadata={
+                    **metadata,
+                    "heading_path": HEADING_PATH_SEPARATOR.join(path),
+                },
+            )
+            for text, metadata in zip(texts, metadatas)
+            for chunk, path in self._split_with_paths(text)
+        ]
@@ -0,0 +1,186 @@
+"""Telemetry of ingestion runs: per-stage timings, throughput and memory.
+
+Every stage of the pipeline records the items it produced, their size in bytes
+and the time spent in it:
+
+- `track` wraps a stage's iterator and times each `next()` call, minus the time
+  spent in tracked stages nested inside it on the same thread, so chained
+  generators are not counted twice,
+- other stages, such as the extraction workers, the embedding requests or the
+  writes to Weaviate, `add` their own measurements.
+
+At the end of a run, `report` gathers them with the peak memory into a JSON
+report. `write_report` saves it and appends it to a `history.jsonl` next to it,
+and `find_regressions` compares it with the previous run of the history.
+"""
+import json
+import threading
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional, TypeVar
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore[assignment]
+
+T = TypeVar("T")
+
+HISTORY_NAME = "history.jsonl"
+
+# USD per million tokens.
+EMBEDDING_PRICES = {
+    "text-embedding-3-small": 0.02,
+    "text-embedding-3-large": 0.13,
+    "text-embedding-ada-002": 0.10,
+}
+
+
+def embedding_cost(model: str, tokens: int) -> Optional[float]:
+    """The estimated cost of embedding `tokens` tokens, None if the price is unknown."""
+    price = EMBEDDING_PRICES.get(model)
+    return tokens * price / 1e6 if price is not None else None
+
+
+@dataclass
+class StageStats:
+    items: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+    _lock: threading.Lock = field(
+        default_factory=threading.Lock, repr=False, compare=False
+    )
+
+    def add(self, items: int = 0, bytes: int = 0, seconds: float = 0.0) -> None:
+        with self._lock:
+            self.items += items
+            self.bytes += bytes
+            self.seconds += seconds
+
+    @property
+    def items_per_second(self) -> float:
+        return self.items / self.seconds if self.seconds else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "items": self.items,
+            "bytes": self.bytes,
+            "seconds": round(self.seconds, 3),
+            "items_per_second": round(self.items_per_second, 1),
+        }
+
+
+def peak_rss_mb() -> dict[str, float]:
+    """Peak resident memory of this process and of its largest child process."""
+    if resource is None:
+        return {}
+    # Kilobytes on Linux.
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+class IngestionTelemetry:
+    """Measurements of an ingestion run, see the module docstring.
+
+    With `trace_memory`, Python allocations are also traced with `tracemalloc`,
+    which is precise but slows the run down.
+    """
+
+    def __init__(self, trace_memory: bool = False):
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.stages: dict[str, StageStats] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.trace_memory = trace_memory
+        if trace_memory:
+            tracemalloc.start()
+
+    def stage(self, name: str) -> StageStats:
+        with self._lock:
+            if name not in self.stages:
+                self.stages[name] = StageStats()
+            return self.stages[name]
+
+    def add(self, name: str, items: int = 0, bytes: int = 0, seconds: float = 0.0):
+        self.stage(name).add(items, bytes, seconds)
+
+    def track(
+        self,
+        name: str,
+        items: Iterable[T],
+        size: Optional[Callable[[T], int]] = None,
+    ) -> Iterator[T]:
+        """Yield `items`, timing how long each takes to produce."""
+        stage = self.stage(name)
+        iterator = iter(items)
+        while True:
+            # Time spent in the stages nested in this one, on this thread.
+            nested = self._local.__dict__.setdefault("nested", [])
+            nested.append(0.0)
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed = time.perf_counter() - start
+                stage.add(seconds=elapsed - nested.pop())
+                if nested:
+                    nested[-1] += elapsed
+            stage.add(items=1, bytes=size(item) if size is not None else 0)
+            yield item
+
+    def report(self, **extra) -> dict:
+        """The report of the run so far, with `extra` top-level entries."""
+        memory: dict = {"peak_rss_mb": peak_rss_mb()}
+        if self.trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            memory["tracemalloc_peak_mb"] = peak / 2**20
+        return {
+            "started_at": self.started_at,
+            "seconds": round(time.perf_counter() - self._start, 3),
+            "stages": {name: stats.as_dict() for name, stats in self.stages.items()},
+            "memory": memory,
+            **extra,
+        }
+
+
+def read_history(report_dir: str | Path) -> list[dict]:
+    path = Path(report_dir) / HISTORY_NAME
+    if not path.exists():
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_report(report_dir: str | Path, report: dict) -> Path:
+    """Save `report` in its own file and append it to the history."""
+    report_dir = Path(report_dir)
+    report_dir.mkdir(parents=True, exist_ok=True)
+    timestamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime(report["started_at"]))
+    path = report_dir / f"ingest-{timestamp}.json"
+    path.write_text(json.dumps(report, indent=2))
+    with open(report_dir / HISTORY_NAME, "a") as f:
+        f.write(json.dumps(report) + "\n")
+    return path
+
+
+def find_regressions(previous: dict, report: dict, tolerance: float = 0.2) -> list[str]:
+    """Describe the stages whose throughput dropped by more than `tolerance`."""
+    regressions = []
+    for name, stats in report["stages"].items():
+        before = previous.get("stages", {}).get(name)
+        if not before or not before["items_per_second"]:
+            continue
+        change = stats["items_per_second"] / before["items_per_second"] - 1
+        if change < -tolerance:
+            regressions.append(
+                f"{name}: {stats['items_per_second']} items/s, "
+                f"{before['items_per_second']} in the previous run ({change:+.0%})"
+            )
+    return regressions
@@ -1,15 +1,31 @@
-from typing import Any
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
 
 import pandas as pd
+import pytest
 from langchain_anthropic import ChatAnthropic
 from langchain_core.documents import Document
-from langchain_core.messages import AIMessage
+from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.pydantic_v1 import BaseModel, Field
+from langchain_core.runnables import RunnableLambda
+from langsmith import Client as LangsmithClient
 from langsmith.evaluation import EvaluationResults, evaluate
 from langsmith.schemas import Example, Run
 
-from backend.graph import OPENAI_MODEL_KEY, format_docs, graph
+from backend.graph import (
+    OPENAI_MODEL_KEY,
+    format_docs,
+    graph,
+    retrieve_documents,
+    route_to_response_synthesizer,
+    synthesize_response_cohere,
+    synthesize_response_default,
+)
+from backend.judge_cache import BatchGrader, GradeAnswer, JudgeCache
+
+logger = logging.getLogger(__name__)
 
 DATASET_NAME = "chat-langchain-qa"
 EXPERIMENT_PREFIX = "chat-langchain-ci"
@@ -23,6 +39,14 @@ JUDGE_MODEL_NAME = "claude-3-haiku-20240307"
 
 judge_llm = ChatAnthropic(model_name=JUDGE_MODEL_NAME)
 
+# Grades of unchanged examples are reused across runs. Set to an empty string
+# to always call the judge.
+JUDGE_CACHE_PATH = os.environ.get("JUDGE_CACHE_PATH", ".cache/judge.sqlite")
+# Examples graded per judge call, at most the concurrency of `evaluate`.
+JUDGE_BATCH_SIZE = int(os.environ.get("JUDGE_BATCH_SIZE") or 4)
+
+judge_cache = JudgeCache(JUDGE_CACHE_PATH) if JUDGE_CACHE_PATH else None
+
 
 # Evaluate retrieval
 
@@ -37,22 +61,6 @@ def evaluate_retrieval_recall(run: Run, example: Example) -> dict:
     return {"key": SCORE_RETRIEVAL_RECALL, "score": score}
 
 
-# QA Evaluation Schema
-
-
-class GradeAnswer(BaseModel):
-    """Evaluate correctness of the answer and assign a continuous score."""
-
-    reason: str = Field(
-        description="1-2 short sentences with the reason why the score was assigned"
-    )
-    score: float = Field(
-        description="Score that shows how correct the answer is. Use 1.0 if completely correct and 0.0 if completely incorrect",
-        minimum=0.0,
-        maximum=1.0,
-    )
-
-
 # Evaluate the answer based on the reference answers
 
 
@@ -71,7 +79,13 @@ QA_PROMPT = ChatPromptTemplate.from_messages(
     ]
 )
 
-qa_chain = QA_PROMPT | judge_llm.with_structured_output(GradeAnswer)
+qa_grader = BatchGrader(
+    judge_llm,
+    QA_PROMPT,
+    JUDGE_MODEL_NAME,
+    cache=judge_cache,
+    batch_size=JUDGE_BATCH_SIZE,
+)
 
 
 def evaluate_qa(run: Run, example: Example) -> dict:
@@ -83,7 +97,7 @@ def evaluate_qa(run: Run, example: Example) -> dict:
     if not isinstance(last_message, AIMessage):
         return {"score": 0.0}
 
-    score: GradeAnswer = qa_chain.invoke(
+    score: GradeAnswer = qa_grader.grade(
         {
             "question": example.inputs["question"],
             "true_answer": example.outputs["answer"],
@@ -110,7 +124,13 @@ CONTEXT_QA_PROMPT = ChatPromptTemplate.from_messages(
     ]
 )
 
-context_qa_chain = CONTEXT_QA_PROMPT | judge_llm.with_structured_output(GradeAnswer)
+context_qa_grader = BatchGrader(
+    judge_llm,
+    CONTEXT_QA_PROMPT,
+    JUDGE_MODEL_NAME,
+    cache=judge_cache,
+    batch_size=JUDGE_BATCH_SIZE,
+)
 
 
 def evaluate_qa_context(run: Run, example: Example) -> dict:
@@ -128,7 +148,7 @@ def evaluate_qa_context(run: Run, example: Example) -> dict:
     if not isinstance(last_message, AIMessage):
         return {"score": 0.0}
 
-    score: GradeAnswer = context_qa_chain.invoke(
+    score: GradeAnswer = context_qa_grader.grade(
         {
             "question": example.inputs["question"],
             "context": context,
@@ -161,6 +181,122 @@ def evaluate_model(*, model_name: str):
     return results
 
 
+# Compare models
+
+# Concurrent synthesis calls per provider when comparing models, to stay below
+# their rate limits.
+PROVIDER_MAX_CONCURRENCY = {
+    "openai": 8,
+    "anthropic": 4,
+    "fireworks": 4,
+    "google": 4,
+    "cohere": 2,
+    "groq": 2,
+}
+DEFAULT_PROVIDER_MAX_CONCURRENCY = 2
+
+# Comma-separated model keys to compare, e.g. "openai_gpt_4o_mini,groq_llama_3".
+EVAL_MODEL_NAMES = [
+    name for name in os.environ.get("EVAL_MODEL_NAMES", "").split(",") if name
+]
+
+
+def model_provider(model_name: str) -> str:
+    # Model keys are prefixed with their provider, e.g. "openai_gpt_4o_mini".
+    return model_name.split("_", 1)[0]
+
+
+def retrieve(question: str) -> dict[str, Any]:
+    state = {"messages": [HumanMessage(content=question)]}
+    return {**state, **retrieve_documents(state)}
+
+
+def synthesize(state: dict[str, Any], model_name: str) -> dict[str, Any]:
+    config = {"configurable": {"model_name": model_name}}
+    if route_to_response_synthesizer(state, config) == "response_synthesizer_cohere":
+        node = synthesize_response_cohere
+    else:
+        node = synthesize_response_default
+    # Run as a runnable, as in the graph, so that the model sees `model_name`.
+    update = RunnableLambda(node).invoke(state, config)
+    return {
+        **state,
+        **update,
+        "messages": [*state["messages"], *update["messages"]],
+    }
+
+
+def generate_answers(
+    examples: list[Example], model_names: list[str], max_concurrency: int = 4
+) -> dict[str, dict[str, dict[str, Any]]]:
+    """Graph outputs by model and question, retrieving once per question.
+
+    First-turn retrieval doesn't depend on the model, so only the synthesis is
+    run per model, concurrently, within each provider's concurrency limit.
+    """
+    questions = list(dict.fromkeys(example.inputs["question"] for example in examples))
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        retrieved = dict(zip(questions, executor.map(retrieve, questions)))
+
+    executors = {
+        provider: ThreadPoolExecutor(
+            max_workers=PROVIDER_MAX_CONCURRENCY.get(
+                provider, DEFAULT_PROVIDER_MAX_CONCURRENCY
+            )
+        )
+        for provider in {model_provider(name) for name in model_names}
+    }
+    try:
+        futures = {
+            (name, question): executors[model_provider(name)].submit(
+                synthesize, retrieved[question], name
+            )
+            for name in model_names
+            for question in questions
+        }
+        return {
+            name: {
+                question: futures[(name, question)].result() for question in questions
+            }
+            for name in model_names
+        }
+    finally:
+        for executor in executors.values():
+            executor.shutdown(cancel_futures=True)
+
+
+def lookup_outputs(
+    outputs: dict[str, dict[str, Any]],
+) -> Callable[[dict[str, Any]], dict[str, Any]]:
+    return lambda inputs: outputs[inputs["question"]]
+
+
+def evaluate_models(*, model_names: list[str]) -> pd.DataFrame:
+    """Average scores of each model, side by side, one column per model."""
+    examples = list(LangsmithClient().list_examples(dataset_name=DATASET_NAME))
+    outputs = generate_answers(examples, model_names)
+    scores = {}
+    for model_name in model_names:
+        # Still one experiment per model, but only the evaluators run here.
+        results = evaluate(
+            lookup_outputs(outputs[model_name]),
+            data=examples,
+            evaluators=[evaluate_retrieval_recall, evaluate_qa, evaluate_qa_context],
+            experiment_prefix=EXPERIMENT_PREFIX,
+            metadata={
+                "model_name": model_name,
+                "judge_model_name": JUDGE_MODEL_NAME,
+                "shared_retrieval": True,
+            },
+            max_concurrency=4,
+        )
+        scores[model_name] = pd.DataFrame(
+            convert_single_example_results(result["evaluation_results"])
+            for result in results._results
+        ).mean()
+    return pd.DataFrame(scores)
+
+
 # Check results
 
 
@@ -184,3 +320,10 @@ def test_scores_regression():
     assert average_scores[SCORE_RETRIEVAL_RECALL] >= 0.65
     assert average_scores[SCORE_ANSWER_CORRECTNESS] >= 0.9
     assert average_scores[SCORE_ANSWER_VS_CONTEXT_CORRECTNESS] >= 0.9
+
+
+@pytest.mark.skipif(not EVAL_MODEL_NAMES, reason="EVAL_MODEL_NAMES is not set")
+def test_compare_models():
+    scores = evaluate_models(model_names=EVAL_MODEL_NAMES)
+    logger.info(f"Average scores by model:\n{scores.to_string()}")
+    assert set(scores.columns) == set(EVAL_MODEL_NAMES)
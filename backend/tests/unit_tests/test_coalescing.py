@@ -0,0 +1,85 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from backend.coalescing import (
+    FlightPublisher,
+    ReplayChatModel,
+    SingleFlight,
+    coalescing_enabled,
+    coalescing_key,
+)
+
+
+def test_coalescing_is_opt_in(monkeypatch):
+    monkeypatch.delenv("COALESCE_REQUESTS", raising=False)
+    assert not coalescing_enabled({"configurable": {}})
+    assert coalescing_enabled({"configurable": {"coalesce": True}})
+
+    monkeypatch.setenv("COALESCE_REQUESTS", "true")
+    assert coalescing_enabled({"configurable": {}})
+    assert not coalescing_enabled({"configurable": {"coalesce": False}})
+
+
+def test_identical_queries_share_a_key():
+    assert coalescing_key(" How do I  create a Page? ", "model", None) == (
+        coalescing_key("how do i create a page?", "model", 6)
+    )
+    assert coalescing_key("query", "model", 4) != coalescing_key("query", "other", 4)
+
+
+def test_concurrent_calls_share_the_leader_result():
+    flights = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def search():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return ["doc"]
+
+    with ThreadPoolExecutor(4) as executor:
+        leader = executor.submit(flights.do, "key", search)
+        started.wait()
+        followers = [executor.submit(flights.do, "key", search) for _ in range(3)]
+        while flights._flights["key"].followers < 3:
+            time.sleep(0.001)
+        release.set()
+        assert leader.result() == (["doc"], False)
+        assert [f.result() for f in followers] == [(["doc"], True)] * 3
+    assert len(calls) == 1
+    # once the leader finished, the next call runs again
+    assert flights.do("key", search) == (["doc"], False)
+
+
+def test_followers_replay_the_leader_stream():
+    flights = SingleFlight()
+    with flights.join("key") as (flight, leader):
+        assert leader
+        with flights.join("key") as (follower_flight, follower_leads):
+            assert not follower_leads and follower_flight is flight
+        with ThreadPoolExecutor(1) as executor:
+            replayed = executor.submit(ReplayChatModel(flight=flight).invoke, "q")
+            publisher = FlightPublisher(flight)
+            for token in ["Hello", " world"]:
+                publisher.on_llm_new_token(token, run_id=None)
+            flight.finish({"message": AIMessage(content="Hello world")})
+            assert replayed.result().content == "Hello world"
+    assert list(flight.stream()) == [
+        AIMessageChunk(content="Hello"),
+        AIMessageChunk(content=" world"),
+    ]
+
+
+def test_followers_get_the_leader_error():
+    flights = SingleFlight()
+    with pytest.raises(ValueError):
+        with flights.join("key") as (flight, _):
+            raise ValueError("provider error")
+    with pytest.raises(ValueError):
+        flight.wait()
+    assert not flights._flights
@@ -0,0 +1,64 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator
+
+import pytest
+from langchain_community.document_loaders import RecursiveUrlLoader
+
+from backend.crawl import iter_pages, page_to_document
+
+PAGES = {
+    "/": '<html><title>Home</title><a href="/a">a</a> <a href="/b">b</a></html>',
+    "/a": '<html><title>A</title><a href="/c">c</a> <a href="/">home</a></html>',
+    "/b": '<html><title>B</title><a href="/missing">missing</a></html>',
+    "/c": "<html><title>C</title>leaf</html>",
+}
+
+
+class _PageHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        body = PAGES.get(self.path)
+        self.send_response(200 if body is not None else 404)
+        # Header names are case-insensitive, some servers send them lowercase.
+        self.send_header("content-type", "text/html")
+        self.end_headers()
+        self.wfile.write((body or "not found").encode())
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+@pytest.fixture
+def site_url() -> Iterator[str]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _PageHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/"
+    server.shutdown()
+
+
+def crawl_titles(loader: RecursiveUrlLoader) -> list[str]:
+    docs = [page_to_document(loader, page) for page in iter_pages(loader)]
+    return sorted(doc.metadata["title"] for doc in docs if doc is not None)
+
+
+def test_crawl_follows_links_and_skips_failures(site_url: str):
+    loader = RecursiveUrlLoader(url=site_url, max_depth=3, check_response_status=True)
+
+    assert crawl_titles(loader) == ["A", "B", "C", "Home"]
+
+
+def test_crawl_respects_max_depth(site_url: str):
+    loader = RecursiveUrlLoader(url=site_url, max_depth=2)
+
+    assert crawl_titles(loader) == ["A", "B", "Home"]
+
+
+def test_crawl_reads_lowercase_headers(site_url: str):
+    loader = RecursiveUrlLoader(url=site_url, max_depth=1)
+
+    (page,) = iter_pages(loader)
+    doc = page_to_document(loader, page)
+
+    assert doc is not None
+    assert doc.metadata["content_type"] == "text/html"
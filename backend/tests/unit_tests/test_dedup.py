@@ -0,0 +1,86 @@
+from langchain_core.documents import Document
+
+from backend.dedup import NearDuplicateFilter, drop_near_duplicates
+
+TEXT = " ".join(f"word{i}" for i in range(300))
+OTHER = " ".join(f"other{i}" for i in range(300))
+
+
+def test_flags_near_duplicates_but_not_distinct_texts():
+    dedup = NearDuplicateFilter(threshold=0.8)
+
+    assert not dedup.add(TEXT)
+    assert dedup.add(TEXT)
+    # One changed word out of 300.
+    assert dedup.add(TEXT.replace("word150", "changed"))
+    # Half of the text.
+    assert not dedup.add(" ".join(f"word{i}" for i in range(150)))
+    assert not dedup.add(" ".join(f"other{i}" for i in range(300)))
+
+
+def test_texts_without_words_are_never_duplicates():
+    dedup = NearDuplicateFilter()
+
+    assert not dedup.add("...")
+    assert not dedup.add("...")
+
+
+def test_drop_near_duplicates_keeps_smallest_copy_and_logs_rates(caplog):
+    docs = [
+        Document(page_content=TEXT, metadata={"source": "https://a.com/1"}),
+        Document(page_content=TEXT + " extra", metadata={"source": "https://b.com/1"}),
+        Document(page_content="something else entirely", metadata={"source": "x"}),
+        Document(page_content=TEXT, metadata={"source": "https://a.com/2"}),
+    ]
+
+    with caplog.at_level("INFO"):
+        kept = list(drop_near_duplicates(docs, NearDuplicateFilter()))
+
+    assert kept == [docs[0], docs[2]]
+    assert "Dropped 1/2 chunks from a.com as near-duplicates (50.0%)" in caplog.text
+    assert "Dropped 1/1 chunks from b.com" in caplog.text
+    assert "Dropped 0/1 chunks from unknown" in caplog.text
+
+
+def test_keeps_the_same_copy_whatever_the_order():
+    docs = [
+        Document(page_content=TEXT, metadata={"source": "https://b.com/1"}),
+        Document(page_content=TEXT + " extra", metadata={"source": "https://a.com/1"}),
+    ]
+
+    for order in (docs, docs[::-1]):
+        dedup = NearDuplicateFilter()
+        # Without a previous run, a copy seen before the smallest one is kept too.
+        assert docs[1] in list(drop_near_duplicates(order, dedup))
+        for next_order in (docs, docs[::-1]):
+            dedup.start_generation()
+            assert list(drop_near_duplicates(next_order, dedup)) == [docs[1]]
+
+
+def test_persisted_filter_survives_reopen_and_forgets_pages(tmp_path):
+    path = tmp_path / "journal.dedup"
+    dedup = NearDuplicateFilter(path=path)
+    dedup.start_generation()
+    assert not dedup.add(TEXT, key="https://a.com/indexed")
+    assert not dedup.add(OTHER, key="https://a.com/split")
+    dedup.close()
+
+    dedup = NearDuplicateFilter(path=path)
+    dedup.forget(["https://a.com/split"])
+
+    assert dedup.add(TEXT, key="https://b.com/1")
+    assert not dedup.add(OTHER, key="https://b.com/1")
+    # The previous run is kept as a reference, older ones are not.
+    dedup.start_generation()
+    assert dedup.add(TEXT, key="https://b.com/1")
+    dedup.start_generation()
+    assert not dedup.add(TEXT, key="https://b.com/1")
+    dedup.close()
+
+
+def test_memory_filter_forgets_pages():
+    dedup = NearDuplicateFilter()
+    assert not dedup.add(TEXT, key="https://a.com/1")
+    dedup.forget(["https://a.com/1"])
+
+    assert not dedup.add(TEXT, key="https://b.com/1")
@@ -0,0 +1,108 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from backend.embedding_cache import CachedEmbeddings, EmbeddingStore, text_key
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    embedded: list[str] = []
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+@pytest.fixture
+def underlying() -> CountingEmbeddings:
+    return CountingEmbeddings(size=8, embedded=[])
+
+
+def test_only_embeds_missing_texts(underlying: CountingEmbeddings, tmp_path: Path):
+    embeddings = CachedEmbeddings(underlying, EmbeddingStore.open(tmp_path, "fake"))
+
+    first = embeddings.embed_documents(["a", "b", "a"])
+    second = embeddings.embed_documents(["b", "c"])
+
+    assert underlying.embedded == ["a", "b", "c"]
+    assert first[0] == first[2]
+    assert second[0] == first[1]
+    assert np.allclose(first[0], underlying.embed_query("a"))
+
+
+def test_persists_across_reopen(underlying: CountingEmbeddings, tmp_path: Path):
+    CachedEmbeddings(underlying, EmbeddingStore.open(tmp_path, "fake")).embed_documents(
+        ["a", "b"]
+    )
+    underlying.embedded.clear()
+
+    store = EmbeddingStore.open(tmp_path, "fake")
+    vectors = CachedEmbeddings(underlying, store).embed_documents(["b", "a"])
+
+    assert underlying.embedded == []
+    assert len(store) == 2
+    assert np.allclose(vectors[0], underlying.embed_query("b"))
+
+
+def test_float16_store_rounds_consistently(
+    underlying: CountingEmbeddings, tmp_path: Path
+):
+    embeddings = CachedEmbeddings(
+        underlying, EmbeddingStore.open(tmp_path, "fake", dtype="float16")
+    )
+
+    miss = embeddings.embed_documents(["a"])[0]
+    hit = embeddings.embed_documents(["a"])[0]
+
+    assert miss == hit
+    assert np.allclose(miss, underlying.embed_query("a"), atol=1e-3)
+
+
+def test_int8_store_survives_reopen(underlying: CountingEmbeddings, tmp_path: Path):
+    texts = [f"text {i}" for i in range(100)]
+    store = EmbeddingStore.open(tmp_path, "fake", dtype="int8")
+    first = CachedEmbeddings(underlying, store).embed_documents(texts)
+    store.close()
+    underlying.embedded.clear()
+
+    store = EmbeddingStore.open(tmp_path, "fake", dtype="int8")
+    second = CachedEmbeddings(underlying, store).embed_documents(texts)
+
+    assert underlying.embedded == []
+    assert second == first
+    assert store.all_vectors().dtype == np.float32
+    assert (tmp_path / "fake").joinpath("vectors.0.bin").stat().st_size == 100 * 8
+    exact = np.asarray(underlying.embed_documents(texts))
+    assert np.abs(np.asarray(second) - exact).max() < 0.05
+
+
+def test_rejects_store_of_other_model(tmp_path: Path):
+    EmbeddingStore(tmp_path, "model-a")
+    with pytest.raises(ValueError, match="model-a"):
+        EmbeddingStore(tmp_path, "model-b")
+
+
+def test_gc_drops_unreferenced_entries(underlying: CountingEmbeddings, tmp_path: Path):
+    store = EmbeddingStore.open(tmp_path, "fake")
+    embeddings = CachedEmbeddings(underlying, store)
+    store.start_generation()
+    embeddings.embed_documents(["a", "b", "c"])
+    store.start_generation()
+    embeddings.touch(["c"])
+    embeddings.embed_documents(["d"])
+
+    assert store.gc(keep_generations=1) == 2
+
+    assert set(store.get_many([text_key(t) for t in "abcd"])) == {
+        text_key("c"),
+        text_key("d"),
+    }
+    underlying.embedded.clear()
+    assert np.allclose(
+        embeddings.embed_documents(["d", "c"]),
+        [underlying.embed_query("d"), underlying.embed_query("c")],
+    )
+    assert underlying.embedded == []
+    assert sorted(p.name for p in store.path.glob("vectors.*.bin")) == ["vectors.1.bin"]
@@ -0,0 +1,220 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Iterator, Optional
+
+import numpy as np
+import openai
+import pytest
+
+from backend.embedding_scheduler import ScheduledEmbeddings, pack_batches
+
+
+def count_words(texts: list[str]) -> list[int]:
+    return [len(text.split()) for text in texts]
+
+
+def fake_embedding(text: str) -> list[float]:
+    return [float(len(text)), float(text.count(" "))]
+
+
+class _FakeEmbeddingsServer:
+    """OpenAI-compatible embeddings endpoint answering every nth request with a 429."""
+
+    def __init__(self, rate_limit_every: int) -> None:
+        self.rate_limit_every = rate_limit_every
+        self.num_requests = 0
+        self.num_rate_limited = 0
+        self.batches: list[list[str]] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.url = ""
+
+
+@pytest.fixture
+def server() -> Iterator[_FakeEmbeddingsServer]:
+    server = _FakeEmbeddingsServer(rate_limit_every=3)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self) -> None:
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            with server.lock:
+                server.num_requests += 1
+                rate_limited = server.num_requests % server.rate_limit_every == 0
+                server.num_rate_limited += rate_limited
+                server.in_flight += 1
+                server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            try:
+                if rate_limited:
+                    payload = {"error": {"message": "Rate limit", "type": "requests"}}
+                    self._send(429, payload, {"Retry-After": "0"})
+                    return
+                server.batches.append(body["input"])
+                data = [
+                    {"object": "embedding", "index": i, "embedding": fake_embedding(t)}
+                    for i, t in enumerate(body["input"])
+                ]
+                usage = {"prompt_tokens": 0, "total_tokens": 0}
+                payload = {
+                    "object": "list",
+                    "data": data,
+                    "model": body["model"],
+                    "usage": usage,
+                }
+                self._send(200, payload)
+            finally:
+                with server.lock:
+                    server.in_flight -= 1
+
+        def _send(
+            self, status: int, payload: dict, headers: Optional[dict] = None
+        ) -> None:
+            encoded = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(encoded)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(encoded)
+
+        def log_message(self, *args) -> None:
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.url = f"http://127.0.0.1:{httpd.server_address[1]}/v1"
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_pack_batches_respects_token_and_input_limits():
+    assert pack_batches([3, 3, 3, 5, 1], max_tokens=6, max_inputs=10) == [
+        [0, 1],
+        [2],
+        [3, 4],
+    ]
+    assert pack_batches([1] * 5, max_tokens=100, max_inputs=2) == [[0, 1], [2, 3], [4]]
+    # A text over the token limit still gets a batch of its own.
+    assert pack_batches([1, 9, 1], max_tokens=4, max_inputs=10) == [[0], [1], [2]]
+
+
+def test_scheduled_embeddings_retries_rate_limited_requests(server):
+    client = openai.OpenAI(api_key="test", base_url=server.url, max_retries=0)
+    embeddings = ScheduledEmbeddings(
+        "fake-model",
+        client=client,
+        max_tokens_per_request=20,
+        max_concurrency=4,
+        initial_concurrency=4,
+        initial_backoff=0.01,
+        count_tokens=count_words,
+    )
+    texts = [" ".join(["word"] * (i % 7 + 1)) + f" {i}" for i in range(200)]
+
+    vectors = embeddings.embed_documents(texts)
+
+    assert vectors == [fake_embedding(text) for text in texts]
+    assert all(sum(count_words(batch)) <= 20 for batch in server.batches)
+    assert server.num_rate_limited > 0
+    assert embeddings.stats.rate_limited == server.num_rate_limited
+    assert embeddings.stats.requests == len(server.batches)
+    assert embeddings.stats.tokens == sum(count_words(texts))
+    assert embeddings.stats.tokens_per_second > 0
+    assert server.max_in_flight <= 4
+    # Every 429 halves the concurrency.
+    assert embeddings.limiter.limit < 4
+
+
+def test_scheduled_embeddings_gives_up_after_max_retries(server):
+    server.rate_limit_every = 1
+    client = openai.OpenAI(api_key="test", base_url=server.url, max_retries=0)
+    embeddings = ScheduledEmbeddings(
+        "fake-model",
+        client=client,
+        max_retries=2,
+        initial_backoff=0.01,
+        count_tokens=count_words,
+    )
+
+    with pytest.raises(openai.RateLimitError):
+        embeddings.embed_documents(["hello world"])
+    assert server.num_requests == 3
+
+
+def split_words(text: str, max_tokens: int) -> list[str]:
+    words = text.split()
+    return [
+        " ".join(words[i : i + max_tokens]) for i in range(0, len(words), max_tokens)
+    ]
+
+
+def test_scheduled_embeddings_splits_texts_over_the_context_length(server):
+    client = openai.OpenAI(api_key="test", base_url=server.url, max_retries=0)
+    embeddings = ScheduledEmbeddings(
+        "fake-model",
+        client=client,
+        max_tokens_per_input=4,
+        initial_backoff=0.01,
+        count_tokens=count_words,
+        split_text=split_words,
+    )
+    long_text = " ".join(f"w{i}" for i in range(10))
+
+    short, long = embeddings.embed_documents(["a b", long_text])
+
+    assert short == fake_embedding("a b")
+    assert all(len(text.split()) <= 4 for batch in server.batches for text in batch)
+    pieces = split_words(long_text, 4)
+    expected = np.average(
+        [fake_embedding(piece) for piece in pieces],
+        axis=0,
+        weights=count_words(pieces),
+    )
+    assert long == pytest.approx(list(expected / np.linalg.norm(expected)))
+
+
+def test_scheduled_embeddings_counts_concurrent_calls_once(server):
+    client = openai.OpenAI(api_key="test", base_url=server.url, max_retries=0)
+    embeddings = ScheduledEmbeddings(
+        "fake-model",
+        client=client,
+        max_tokens_per_request=5,
+        initial_backoff=0.01,
+        count_tokens=count_words,
+    )
+    texts = [f"text number {i}" for i in range(20)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(embeddings.embed_documents, [texts] * 4))
+    elapsed = time.perf_counter() - start
+
+    assert 0 < embeddings.stats.seconds <= elapsed
+
+
+def test_backoff_caps_and_jitters_retry_after():
+    embeddings = ScheduledEmbeddings(
+        "fake-model",
+        client=openai.OpenAI(api_key="test"),
+        initial_backoff=1.0,
+        max_backoff=10.0,
+        count_tokens=count_words,
+    )
+
+    def backoff(retry_after: str) -> float:
+        response = SimpleNamespace(headers={"Retry-After": retry_after})
+        return embeddings._backoff(0, SimpleNamespace(response=response))
+
+    assert 5.0 <= backoff("3600") <= 10.0
+    assert len({backoff("4") for _ in range(10)}) > 1
+    assert all(2.0 <= backoff("4") <= 4.0 for _ in range(10))
+    # Falls back to the exponential backoff.
+    assert 0.5 <= backoff("soon") <= 1.0
+    assert 0.5 <= backoff("-1") <= 1.0
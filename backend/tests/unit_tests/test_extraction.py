@@ -0,0 +1,82 @@
+from functools import partial
+from pathlib import Path
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.document_loaders import RecursiveUrlLoader
+from langchain_core.documents import Document
+
+from backend.crawl import RawPage
+from backend.extraction import ExtractionTask, extract_and_split
+from backend.ingest import get_langchain_docs_loader, simple_extractor
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures" / "html"
+
+# Partials of importable callables, so that spawned workers can unpickle them.
+LOADER_FACTORIES = {
+    "sitemap": get_langchain_docs_loader,
+    "crawl": partial(
+        RecursiveUrlLoader, url="https://example.com/", extractor=simple_extractor
+    ),
+}
+
+
+def make_tasks() -> list[ExtractionTask]:
+    tasks = []
+    for _ in range(3):
+        for path in sorted(FIXTURES_DIR.glob("*.html")):
+            url = f"https://example.com/{path.stem}"
+            html = path.read_text()
+            tasks.append(
+                ExtractionTask("sitemap", RawPage(url, html, meta={"loc": url}))
+            )
+            tasks.append(ExtractionTask("crawl", RawPage(url, html)))
+    tasks.append(
+        ExtractionTask(
+            "sitemap", document=Document(page_content="cached", metadata={"a": 1})
+        )
+    )
+    return tasks
+
+
+def extract(workers: int, tasks: list[ExtractionTask], **kwargs) -> list[Document]:
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
+    return list(
+        extract_and_split(
+            tasks,
+            LOADER_FACTORIES,
+            text_splitter,
+            workers=workers,
+            chunk_size=4,
+            **kwargs,
+        )
+    )
+
+
+def test_extract_and_split_in_processes_matches_serial_output():
+    tasks = make_tasks()
+
+    serial = extract(1, tasks)
+    parallel = extract(2, tasks, max_in_flight=2)
+
+    assert len(serial) > len(tasks)
+    assert parallel == serial
+    # Chunks come out in the order their pages went in.
+    sources = [doc.metadata.get("source") for doc in serial]
+    assert sources[0] == "https://example.com/how_to_streaming"
+    assert serial[-1] == Document(page_content="cached", metadata={"a": 1})
+
+
+def test_extract_and_split_skips_failed_pages_and_records_their_source():
+    tasks = [
+        ExtractionTask("sitemap", RawPage("https://example.com/a", "<p>a</p>")),
+        # Missing the sitemap entry the meta function reads.
+        ExtractionTask("sitemap", RawPage("https://example.com/b", "<p>b</p>")),
+        ExtractionTask("crawl", RawPage("https://example.com/c", "<p>c</p>")),
+    ]
+    tasks[0].page.meta["loc"] = "https://example.com/a"
+    errors: dict[str, BaseException] = {}
+
+    docs = extract(2, tasks, errors=errors)
+
+    assert [doc.page_content for doc in docs] == ["a", "c"]
+    assert list(errors) == ["sitemap"]
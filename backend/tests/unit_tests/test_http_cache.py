@@ -0,0 +1,199 @@
+import hashlib
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Iterator
+from unittest.mock import patch
+
+import pytest
+from langchain_community.document_loaders import RecursiveUrlLoader, SitemapLoader
+from langchain_core.documents import Document
+
+from backend.crawl import (
+    WebLoader,
+    cache_document,
+    get_cached_document,
+    iter_pages,
+    page_to_document,
+)
+from backend.http_cache import CachedFetcher, HTTPCache
+
+LAST_MODIFIED = "Wed, 01 Jan 2025 00:00:00 GMT"
+
+
+class _Site:
+    def __init__(self) -> None:
+        self.pages = {
+            "/": '<html><title>Home</title><a href="/a">a</a></html>',
+            "/a": "<html><title>A</title>first version</html>",
+        }
+        self.lastmods = {"/": "2025-01-01", "/a": "2025-01-01"}
+        self.requests: Counter[str] = Counter()
+        self.user_agents: dict[str, str] = {}
+        # Seconds before answering, by path.
+        self.delays: dict[str, float] = {}
+        self.not_modified: Counter[str] = Counter()
+        self.url = ""
+
+    def sitemap(self) -> str:
+        urls = "".join(
+            f"<url><loc>{self.url}{path}</loc><lastmod>{lastmod}</lastmod></url>"
+            for path, lastmod in self.lastmods.items()
+        )
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+            f"{urls}</urlset>"
+        )
+
+
+@pytest.fixture
+def site() -> Iterator[_Site]:
+    site = _Site()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            site.requests[self.path] = site.requests[self.path] + 1
+            site.user_agents[self.path] = self.headers.get("User-Agent", "")
+            time.sleep(site.delays.get(self.path, 0))
+            if self.path == "/sitemap.xml":
+                body = site.sitemap()
+                etag = None
+            else:
+                body = site.pages.get(self.path)
+                if body is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                etag = '"' + hashlib.sha256(body.encode()).hexdigest()[:16] + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    site.not_modified[self.path] += 1
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            if etag is not None:
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", LAST_MODIFIED)
+            self.end_headers()
+            self.wfile.write(body.encode())
+
+        def log_message(self, *args) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    site.url = f"http://127.0.0.1:{server.server_port}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield site
+    server.shutdown()
+
+
+def test_fetcher_sends_conditional_requests(site: _Site, tmp_path: Path):
+    fetcher = CachedFetcher(HTTPCache(tmp_path / "cache.sqlite"))
+    url = f"{site.url}/a"
+
+    first = fetcher.fetch(url)
+    second = fetcher.fetch(url)
+    site.pages["/a"] = "<html><title>A</title>second version</html>"
+    third = fetcher.fetch(url)
+
+    assert (first.status, second.status, third.status) == (
+        "fetched",
+        "not_modified",
+        "fetched",
+    )
+    assert second.text == first.text
+    assert "second version" in third.text
+    assert site.requests["/a"] == 3
+    assert site.not_modified["/a"] == 1
+
+
+def test_fetcher_skips_urls_with_unchanged_lastmod(site: _Site, tmp_path: Path):
+    fetcher = CachedFetcher(HTTPCache(tmp_path / "cache.sqlite"))
+    url = f"{site.url}/a"
+
+    fetcher.fetch(url, lastmod="2025-01-01")
+    skipped = fetcher.fetch(url, lastmod="2025-01-01")
+    revalidated = fetcher.fetch(url, lastmod="2025-02-01")
+
+    assert skipped.status == "skipped"
+    assert revalidated.status == "not_modified"
+    assert site.requests["/a"] == 2
+
+
+def test_fetcher_does_not_cache_error_pages(site: _Site, tmp_path: Path):
+    cache = HTTPCache(tmp_path / "cache.sqlite")
+    result = CachedFetcher(cache).fetch(f"{site.url}/missing")
+
+    assert result.status_code == 404
+    assert cache.get(f"{site.url}/missing") is None
+
+
+def load_documents(loader: WebLoader, fetcher: CachedFetcher) -> list[Document]:
+    """Extract the pages of a crawl the way ingestion does, through the cache."""
+    docs = []
+    for page in iter_pages(loader, fetcher=fetcher):
+        doc = get_cached_document(fetcher, "source", page)
+        if doc is None:
+            doc = page_to_document(loader, page)
+            cache_document(fetcher, "source", page, doc)
+        if doc is not None:
+            docs.append(doc)
+    return docs
+
+
+def test_sitemap_crawl_reuses_cache(site: _Site, tmp_path: Path):
+    cache = HTTPCache(tmp_path / "cache.sqlite")
+    loader = SitemapLoader(f"{site.url}/sitemap.xml")
+
+    def load() -> list[str]:
+        fetcher = CachedFetcher(cache)
+        return sorted(doc.page_content for doc in load_documents(loader, fetcher))
+
+    first = load()
+    with patch.object(
+        loader, "parsing_function", side_effect=AssertionError("re-parsed")
+    ):
+        second = load()
+    site.lastmods["/a"] = "2025-02-01"
+    site.pages["/a"] = "<html><title>A</title>second version</html>"
+    third = load()
+
+    assert first == second
+    assert site.requests["/a"] == 2
+    assert "second version" in third[0]
+
+
+def test_recursive_crawl_reuses_cache(site: _Site, tmp_path: Path):
+    cache = HTTPCache(tmp_path / "cache.sqlite")
+    loader = RecursiveUrlLoader(url=f"{site.url}/", max_depth=2)
+
+    def crawl() -> list[str]:
+        fetcher = CachedFetcher(cache)
+        return sorted(doc.metadata["title"] for doc in load_documents(loader, fetcher))
+
+    assert crawl() == ["A", "Home"]
+    with patch.object(loader, "extractor", side_effect=AssertionError("re-parsed")):
+        assert crawl() == ["A", "Home"]
+    assert site.not_modified == {"/": 1, "/a": 1}
+
+
+def test_sitemap_crawl_sends_loader_headers_and_timeout(site: _Site, tmp_path: Path):
+    site.delays["/a"] = 2
+    loader = SitemapLoader(
+        f"{site.url}/sitemap.xml",
+        header_template={"User-Agent": "docs-crawler"},
+        requests_kwargs={"timeout": 0.2},
+        continue_on_failure=True,
+    )
+    fetcher = CachedFetcher(HTTPCache(tmp_path / "cache.sqlite"))
+
+    pages = list(iter_pages(loader, fetcher=fetcher))
+
+    # The stalled page is skipped instead of hanging the crawl.
+    assert [page.url for page in pages] == [f"{site.url}/"]
+    assert site.user_agents["/"] == "docs-crawler"
@@ -0,0 +1,127 @@
+from types import SimpleNamespace
+
+import pytest
+
+from backend import index_alias
+from backend.index_alias import (
+    IndexAliases,
+    drop_old_builds,
+    list_builds,
+    resolve_index_name,
+)
+
+
+class _FakeData:
+    def __init__(self):
+        self.objects: dict[str, dict] = {}
+
+    def exists(self, uuid):
+        return uuid in self.objects
+
+    def insert(self, properties, uuid):
+        self.objects[uuid] = properties
+
+    def replace(self, uuid, properties):
+        self.objects[uuid] = properties
+
+    def delete_by_id(self, uuid):
+        self.objects.pop(uuid, None)
+
+
+class _FakeCollection:
+    def __init__(self):
+        self.data = _FakeData()
+        self.query = SimpleNamespace(fetch_object_by_id=self._fetch)
+
+    def _fetch(self, uuid):
+        properties = self.data.objects.get(uuid)
+        return SimpleNamespace(properties=properties) if properties else None
+
+
+class _FakeCollections:
+    def __init__(self, names):
+        self.collections = {name: _FakeCollection() for name in names}
+
+    def exists(self, name):
+        return name in self.collections
+
+    def create(self, name, **kwargs):
+        self.collections[name] = _FakeCollection()
+
+    def get(self, name):
+        return self.collections[name]
+
+    def delete(self, name):
+        del self.collections[name]
+
+    def list_all(self, simple=True):
+        return dict.fromkeys(self.collections)
+
+
+ALIAS = "Docs"
+
+
+@pytest.fixture
+def client():
+    index_alias._resolved.clear()
+    return SimpleNamespace(
+        collections=_FakeCollections(
+            [ALIAS, f"{ALIAS}_20240101T000000", f"{ALIAS}_20240201T000000"]
+        )
+    )
+
+
+def test_swap_and_rollback(client):
+    aliases = IndexAliases(client)
+    assert aliases.resolve(ALIAS) is None
+    assert resolve_index_name(client, ALIAS) == ALIAS
+
+    assert aliases.swap(ALIAS, f"{ALIAS}_20240101T000000") == ALIAS
+    assert aliases.swap(ALIAS, f"{ALIAS}_20240201T000000") == f"{ALIAS}_20240101T000000"
+    assert resolve_index_name(client, ALIAS) == f"{ALIAS}_20240201T000000"
+
+    assert aliases.rollback(ALIAS) == f"{ALIAS}_20240101T000000"
+    assert resolve_index_name(client, ALIAS) == f"{ALIAS}_20240101T000000"
+    assert aliases.previous(ALIAS) == f"{ALIAS}_20240201T000000"
+
+    aliases.remove(ALIAS)
+    assert resolve_index_name(client, ALIAS) == ALIAS
+
+
+def test_resolution_is_cached(client):
+    IndexAliases(client).swap(ALIAS, f"{ALIAS}_20240101T000000")
+    assert resolve_index_name(client, ALIAS) == f"{ALIAS}_20240101T000000"
+
+    # Another process moves the alias, which this one notices after the TTL.
+    pointers = client.collections.get(index_alias.ALIAS_COLLECTION).data.objects
+    for pointer in pointers.values():
+        pointer["target"] = f"{ALIAS}_20240201T000000"
+    assert resolve_index_name(client, ALIAS, ttl=60) == f"{ALIAS}_20240101T000000"
+    assert resolve_index_name(client, ALIAS, ttl=0) == f"{ALIAS}_20240201T000000"
+
+
+def test_drop_old_builds_keeps_current_previous_and_newer(client):
+    for month in ("03", "04"):
+        client.collections.create(f"{ALIAS}_2024{month}01T000000")
+    aliases = IndexAliases(client)
+    aliases.swap(ALIAS, f"{ALIAS}_20240201T000000")
+    aliases.swap(ALIAS, f"{ALIAS}_20240301T000000")
+
+    assert drop_old_builds(client, ALIAS) == [ALIAS, f"{ALIAS}_20240101T000000"]
+    assert list_builds(client, ALIAS) == [
+        f"{ALIAS}_20240201T000000",
+        f"{ALIAS}_20240301T000000",
+        # Possibly still being built.
+        f"{ALIAS}_20240401T000000",
+    ]
+
+
+def test_list_builds_ignores_collections_sharing_the_prefix(client):
+    client.collections.create(f"{ALIAS}_archive")
+    client.collections.create(f"{ALIAS}_20240301T000000_copy")
+
+    assert list_builds(client, ALIAS) == [
+        ALIAS,
+        f"{ALIAS}_20240101T000000",
+        f"{ALIAS}_20240201T000000",
+    ]
@@ -0,0 +1,112 @@
+from typing import Iterator
+
+import pytest
+from langchain_core.documents import Document
+
+from backend.ingest import (
+    DOC_SOURCES,
+    index_by_source,
+    iter_in_background,
+    source_url_prefix,
+    stream_docs_concurrently,
+)
+
+
+def test_stream_docs_concurrently_isolates_failures():
+    def load_ok() -> Iterator[Document]:
+        for i in range(5):
+            yield Document(page_content=f"doc {i}", metadata={"source": "ok"})
+
+    def load_broken() -> Iterator[Document]:
+        yield Document(page_content="partial", metadata={"source": "broken"})
+        raise ConnectionError("crawl failed")
+
+    errors: dict[str, BaseException] = {}
+    docs = list(
+        stream_docs_concurrently(
+            {"broken": load_broken, "ok": load_ok}, errors, queue_size=2
+        )
+    )
+
+    assert sorted(doc.page_content for doc in docs) == [
+        "doc 0",
+        "doc 1",
+        "doc 2",
+        "doc 3",
+        "doc 4",
+        "partial",
+    ]
+    assert list(errors) == ["broken"]
+    assert isinstance(errors["broken"], ConnectionError)
+
+
+def test_stream_docs_concurrently_stops_producers_when_consumer_stops():
+    def load_forever() -> Iterator[Document]:
+        while True:
+            yield Document(page_content="again")
+
+    errors: dict[str, BaseException] = {}
+    stream = stream_docs_concurrently({"forever": load_forever}, errors, queue_size=1)
+    assert next(stream).page_content == "again"
+    stream.close()
+    assert errors == {}
+
+
+def test_iter_in_background_propagates_errors():
+    def produce() -> Iterator[int]:
+        yield 1
+        yield 2
+        raise ValueError("boom")
+
+    results = []
+    with pytest.raises(ValueError, match="boom"):
+        for item in iter_in_background(produce(), maxsize=1):
+            results.append(item)
+    assert results == [1, 2]
+
+
+def test_index_by_source_routes_docs_to_their_source():
+    docs = [
+        Document(page_content=f"{name} {i}", metadata={"_src": name})
+        for i in range(10)
+        for name in ("a", "b")
+    ]
+
+    def index_source(name, source_docs):
+        source_docs = list(source_docs)
+        assert all(doc.metadata == {} for doc in source_docs)
+        return {"num_added": len(source_docs), "first": source_docs[0].page_content}
+
+    stats = index_by_source(docs, index_source, ["a", "b"], "_src", maxsize=2)
+
+    assert stats == {
+        "a": {"num_added": 10, "first": "a 0"},
+        "b": {"num_added": 10, "first": "b 0"},
+    }
+
+
+def test_index_by_source_stops_all_sources_when_one_fails():
+    def forever() -> Iterator[Document]:
+        while True:
+            for name in ("ok", "broken"):
+                yield Document(page_content=name, metadata={"_src": name})
+
+    def index_source(name, source_docs):
+        for _ in source_docs:
+            if name == "broken":
+                raise ConnectionError("upsert failed")
+        return {}
+
+    with pytest.raises(ConnectionError):
+        index_by_source(forever(), index_source, ["ok", "broken"], "_src", maxsize=2)
+
+
+def test_source_url_prefixes_tell_the_sources_apart():
+    prefixes = {name: source_url_prefix(name) for name in DOC_SOURCES}
+
+    assert prefixes == {
+        "langchain": "https://python.langchain.com/",
+        "api": "https://api.python.langchain.com/en/latest/",
+        "langsmith": "https://docs.smith.langchain.com/",
+        "langgraph": "https://langchain-ai.github.io/langgraph/",
+    }
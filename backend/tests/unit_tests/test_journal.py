@@ -0,0 +1,118 @@
+from pathlib import Path
+
+import pytest
+from langchain.indexes import SQLRecordManager, index
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.vectorstores import InMemoryVectorStore
+
+from backend.ingest import JournaledBatches
+from backend.journal import IngestionJournal
+
+
+class FlakyVectorStore(InMemoryVectorStore):
+    def __init__(self, fail_on_call: int):
+        super().__init__(DeterministicFakeEmbedding(size=4))
+        self.fail_on_call = fail_on_call
+        self.num_calls = 0
+
+    def add_documents(self, documents, **kwargs):
+        self.num_calls += 1
+        if self.num_calls == self.fail_on_call:
+            raise ConnectionError("upsert failed")
+        return super().add_documents(documents, **kwargs)
+
+
+@pytest.fixture
+def journal(tmp_path: Path) -> IngestionJournal:
+    return IngestionJournal(tmp_path / "journal.sqlite")
+
+
+def chunks(url: str, n: int) -> list[Document]:
+    return [
+        Document(page_content=f"{url} chunk {i}", metadata={"source": url})
+        for i in range(n)
+    ]
+
+
+def test_resume_keeps_the_run_start_time(journal: IngestionJournal):
+    assert journal.resume() is None
+    run = journal.start(index_start_dt=123.0)
+    journal.record_page("docs", "https://a", [("a", {"source": "https://a"})])
+    journal.record_page("docs", "https://b", [("b", {"source": "https://b"})])
+    journal.record_batch(1, ["https://a"])
+    journal.mark_source_crawled("docs")
+    journal.finish("failed")
+
+    resumed = journal.resume()
+
+    assert resumed is not None
+    assert (resumed.id, resumed.index_start_dt) == (run.id, 123.0)
+    assert journal.is_source_crawled("docs")
+    assert not journal.is_source_crawled("api")
+    assert journal.page_status("https://a") == "indexed"
+    assert list(journal.pending_pages("docs")) == [
+        ("https://b", [("b", {"source": "https://b"})])
+    ]
+    assert journal.unindexed_pages() == ["https://b"]
+
+    journal.finish("completed")
+    assert journal.resume() is None
+    journal.start(index_start_dt=456.0)
+    assert journal.page_status("https://b") is None
+
+
+def test_journaled_batches_only_marks_upserted_pages(journal: IngestionJournal):
+    journal.start(index_start_dt=0.0)
+    pages = {"https://a": 3, "https://b": 2, "https://c": 2, "https://d": 1}
+    docs = [doc for url, n in pages.items() for doc in chunks(url, n)]
+    for url, n in pages.items():
+        records = [(doc.page_content, doc.metadata) for doc in chunks(url, n)]
+        journal.record_page("docs", url, records)
+    record_manager = SQLRecordManager("test", db_url="sqlite:///:memory:")
+    record_manager.create_schema()
+    # Batches of 3: [a a a] [b b c] [c d], the third upsert fails.
+    batches = JournaledBatches(docs, journal, batch_size=3)
+
+    with pytest.raises(ConnectionError):
+        index(
+            batches,
+            record_manager,
+            FlakyVectorStore(fail_on_call=3),
+            batch_size=3,
+            cleanup="incremental",
+            source_id_key="source",
+        )
+
+    assert [journal.page_status(url) for url in pages] == [
+        "indexed",
+        "indexed",
+        # c continues in the batch that failed.
+        "split",
+        "split",
+    ]
+
+
+def test_journaled_batches_flush_marks_the_last_batch(journal: IngestionJournal):
+    journal.start(index_start_dt=0.0)
+    docs = chunks("https://a", 2) + chunks("https://b", 2)
+    for url in ("https://a", "https://b"):
+        journal.record_page("docs", url, [])
+    record_manager = SQLRecordManager("test", db_url="sqlite:///:memory:")
+    record_manager.create_schema()
+    batches = JournaledBatches(docs, journal, batch_size=3)
+
+    index(
+        batches,
+        record_manager,
+        FlakyVectorStore(fail_on_call=0),
+        batch_size=3,
+        cleanup="incremental",
+        source_id_key="source",
+    )
+    # The partial last batch is only journaled once index() returned.
+    assert journal.page_status("https://b") == "split"
+    batches.flush()
+
+    assert journal.page_status("https://a") == "indexed"
+    assert journal.page_status("https://b") == "indexed"
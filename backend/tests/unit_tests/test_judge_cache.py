@@ -0,0 +1,91 @@
+import re
+import threading
+from pathlib import Path
+
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableLambda
+
+from backend.judge_cache import (
+    BatchGrader,
+    GradeAnswer,
+    GradeAnswers,
+    GradeExample,
+    JudgeCache,
+)
+
+PROMPT = ChatPromptTemplate.from_messages(
+    [("system", "Grade the answer."), ("human", "Q: {question} A: {answer}")]
+)
+
+
+class FakeJudge:
+    """Scores answers by their length, recording the examples of each call."""
+
+    def __init__(self, skip_ids: tuple[int, ...] = ()):
+        self.calls: list[list[str]] = []
+        self.skip_ids = skip_ids
+
+    def with_structured_output(self, schema):
+        def grade(messages):
+            answers = re.findall(r"A: (\w+)", messages[-1].content)
+            self.calls.append(answers)
+            if schema is GradeAnswer:
+                return GradeAnswer(reason="single", score=len(answers[0]) / 10)
+            return GradeAnswers(
+                grades=[
+                    GradeExample(id=i, reason="batch", score=len(answer) / 10)
+                    for i, answer in enumerate(answers)
+                    if i not in self.skip_ids
+                ]
+            )
+
+        return RunnableLambda(grade)
+
+
+def test_cached_grades_skip_the_judge(tmp_path: Path):
+    judge = FakeJudge()
+    cache = JudgeCache(tmp_path / "judge.sqlite")
+    grader = BatchGrader(judge, PROMPT, "judge", cache=cache, batch_size=1)
+
+    assert grader.grade({"question": "q", "answer": "abc"}).score == 0.3
+    assert grader.grade({"question": "q", "answer": "abc"}).score == 0.3
+    # A different judge model doesn't reuse the grade.
+    other = BatchGrader(judge, PROMPT, "other", cache=cache, batch_size=1)
+    other.grade({"question": "q", "answer": "abc"})
+
+    assert judge.calls == [["abc"], ["abc"]]
+
+
+def test_concurrent_grades_are_batched():
+    judge = FakeJudge(skip_ids=(2,))
+    grader = BatchGrader(judge, PROMPT, "judge", batch_size=3, max_wait=10)
+    answers = ["a", "bb", "ccc"]
+    grades: dict[str, GradeAnswer] = {}
+
+    def grade(answer: str) -> None:
+        grades[answer] = grader.grade({"question": "q", "answer": answer})
+
+    threads = [threading.Thread(target=grade, args=(answer,)) for answer in answers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(judge.calls[0]) == answers
+    # The example the judge left out of its batch answer is graded on its own.
+    missing = judge.calls[0][2]
+    assert judge.calls[1:] == [[missing]]
+    assert {answer: grade.score for answer, grade in grades.items()} == {
+        "a": 0.1,
+        "bb": 0.2,
+        "ccc": 0.3,
+    }
+    assert grades[missing].reason == "single"
+
+
+def test_partial_batch_is_flushed_after_max_wait():
+    judge = FakeJudge()
+    grader = BatchGrader(judge, PROMPT, "judge", batch_size=8, max_wait=0.01)
+
+    assert grader.grade({"question": "q", "answer": "abcd"}).score == 0.4
+    assert judge.calls == [["abcd"]]
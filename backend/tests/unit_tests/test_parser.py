@@ -0,0 +1,34 @@
+from pathlib import Path
+
+import pytest
+from bs4 import BeautifulSoup, SoupStrainer
+
+from backend.parser import langchain_docs_extractor
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures" / "html"
+
+
+def load_fixture_soup(path: Path) -> BeautifulSoup:
+    # Same parser options as `get_langchain_docs_loader`.
+    return BeautifulSoup(
+        path.read_text(),
+        "lxml",
+        parse_only=SoupStrainer(name=("article", "title", "html", "lang", "content")),
+    )
+
+
+@pytest.mark.parametrize(
+    "path", sorted(FIXTURES_DIR.glob("*.html")), ids=lambda path: path.stem
+)
+def test_langchain_docs_extractor_matches_expected_output(path: Path):
+    expected = path.with_suffix(".md").read_text()
+
+    assert langchain_docs_extractor(load_fixture_soup(path)) == expected
+
+
+def test_langchain_docs_extractor_handles_deeply_nested_pages():
+    depth = 5000
+    html = "<div>" * depth + "<p>deep <b>text</b></p>" + "</div>" * depth
+    soup = BeautifulSoup(f"<article>{html}</article>", "html.parser")
+
+    assert langchain_docs_extractor(soup) == "deep **text**"
@@ -0,0 +1,49 @@
+import time
+from pathlib import Path
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from backend.profiling import profiled, should_profile
+
+
+def busy_node(state: dict) -> dict:
+    deadline = time.perf_counter() + 0.05
+    while time.perf_counter() < deadline:
+        pass
+    return {"answer": "done"}
+
+
+@pytest.fixture
+def profile_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    monkeypatch.setenv("GRAPH_PROFILE_DIR", str(tmp_path))
+    monkeypatch.delenv("GRAPH_PROFILE_RATE", raising=False)
+    return tmp_path
+
+
+def test_sampled_runs_write_collapsed_stacks(profile_dir: Path):
+    node = profiled("busy", busy_node)
+    state = {"messages": [HumanMessage(content="q", id="run-1")]}
+
+    assert node(state, {"configurable": {"profile_rate": 1.0}}) == {"answer": "done"}
+
+    (profile,) = profile_dir.glob("*-run-1-busy.folded")
+    lines = profile.read_text().splitlines()
+    assert lines
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert stack.startswith("busy;test_profiling:busy_node")
+        assert int(count) > 0
+
+
+def test_runs_are_not_profiled_by_default(profile_dir: Path):
+    node = profiled("busy", busy_node)
+    node({"messages": [HumanMessage(content="q", id="run-1")]}, {})
+
+    assert not list(profile_dir.iterdir())
+
+
+def test_sampling_decision_is_per_run():
+    decisions = [should_profile(f"run-{i}", 0.3) for i in range(1000)]
+    assert decisions == [should_profile(f"run-{i}", 0.3) for i in range(1000)]
+    assert 200 < sum(decisions) < 400
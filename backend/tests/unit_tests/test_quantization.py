@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from backend.quantization import Int8Quantizer, QuantizedIndex
+
+
+@pytest.fixture
+def vectors() -> np.ndarray:
+    rng = np.random.default_rng(0)
+    # Dimensions with very different ranges, as in real embeddings.
+    vectors = rng.standard_normal((2000, 64)).astype(np.float32) * np.linspace(
+        0.1, 3, 64, dtype=np.float32
+    )
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_int8_round_trip_error_is_bounded_per_dimension(vectors):
+    quantizer = Int8Quantizer.fit(vectors, clip=0)
+    codes = quantizer.encode(vectors)
+
+    assert codes.dtype == np.int8
+    error = np.abs(quantizer.decode(codes) - vectors)
+    assert np.all(error <= quantizer.scale / 2 + 1e-6)
+
+
+def test_rescoring_recovers_exact_neighbors(vectors, tmp_path):
+    queries = vectors[:20] + 0.05 * np.random.default_rng(1).standard_normal(
+        (20, 64)
+    ).astype(np.float32)
+    scores = queries @ vectors.T
+    expected = np.argsort(-scores, axis=1)[:, :5]
+
+    QuantizedIndex.build(vectors, rescore_dtype="float32").save(tmp_path)
+    index = QuantizedIndex.load(tmp_path)
+    assert isinstance(index.vectors, np.memmap)
+    assert index.nbytes < vectors.nbytes / 3
+
+    rows, found_scores = index.search(queries, k=5, oversample=4)
+    np.testing.assert_array_equal(rows, expected)
+    np.testing.assert_allclose(
+        found_scores, np.take_along_axis(scores, expected, axis=1), rtol=1e-5
+    )
+
+    coarse = QuantizedIndex(index.quantizer, index.codes)
+    rows, _ = coarse.search(queries, k=5)
+    assert rows.shape == (20, 5)
+    assert np.mean([len(set(r) & set(e)) / 5 for r, e in zip(rows, expected)]) > 0.8
@@ -0,0 +1,47 @@
+import threading
+from pathlib import Path
+
+from langchain_core.documents import Document
+from langchain_core.messages import HumanMessage
+
+from backend.query_log import QueryLogger, query_record, read_query_log
+
+
+def make_record(i: int) -> dict:
+    return query_record(
+        [HumanMessage(content=f"question {i}")],
+        [Document(page_content="text", metadata={"source": f"https://docs/{i}"})],
+        {"thread_id": "thread", "model_name": "model", "k": 4},
+        {"retrieval": 0.1, "synthesis": 0.2},
+    )
+
+
+def test_records_are_written_and_rotated(tmp_path: Path):
+    query_logger = QueryLogger(tmp_path, max_bytes=500)
+    for i in range(10):
+        query_logger.log(make_record(i))
+    query_logger.close()
+
+    records = list(read_query_log(tmp_path))
+    assert [record["messages"][0]["content"] for record in records] == [
+        f"question {i}" for i in range(10)
+    ]
+    assert records[0]["doc_ids"] == ["https://docs/0"]
+    assert records[0]["thread"] != "thread"
+    assert records[0]["k"] == 4
+    assert len(list(tmp_path.glob("queries-*.jsonl.gz"))) > 1
+
+
+def test_records_are_dropped_when_the_queue_is_full(tmp_path: Path):
+    query_logger = QueryLogger(tmp_path, queue_size=2)
+    # Hold the writer up on its first record.
+    blocked = threading.Event()
+    write = query_logger._write
+    query_logger._write = lambda record: (blocked.wait(), write(record))
+    for i in range(10):
+        query_logger.log(make_record(i))
+    blocked.set()
+    query_logger.close()
+
+    assert query_logger.dropped > 0
+    assert len(list(read_query_log(tmp_path))) == 10 - query_logger.dropped
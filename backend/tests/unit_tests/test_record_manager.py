@@ -0,0 +1,70 @@
+import pytest
+
+from backend.record_manager import (
+    BulkSQLRecordManager,
+    index_namespace,
+    source_namespace,
+)
+
+
+@pytest.fixture
+def db_url(tmp_path):
+    return f"sqlite:///{tmp_path / 'records.sqlite'}"
+
+
+def record_manager(db_url, namespace) -> BulkSQLRecordManager:
+    manager = BulkSQLRecordManager(namespace, db_url=db_url)
+    manager.create_schema()
+    return manager
+
+
+def test_partitions_are_listed_and_deleted_separately(db_url, monkeypatch):
+    monkeypatch.setattr("backend.record_manager.DELETE_BATCH_SIZE", 3)
+    api = record_manager(db_url, source_namespace("Docs", "api"))
+    langgraph = record_manager(db_url, source_namespace("Docs", "langgraph"))
+    api.update([f"api-{i}" for i in range(10)], group_ids=["x"] * 10)
+    langgraph.update(["lg-0", "lg-1"], group_ids=["y", "z"])
+
+    assert sorted(langgraph.list_keys()) == ["lg-0", "lg-1"]
+    assert langgraph.list_keys(group_ids=["z"]) == ["lg-1"]
+    assert len(api.list_keys(limit=4)) == 4
+    assert api.count() == 10
+
+    api.delete_keys([f"api-{i}" for i in range(8)] + ["lg-0"])
+    assert sorted(api.list_keys()) == ["api-8", "api-9"]
+    assert langgraph.count() == 2
+
+
+def test_delete_namespace_drops_all_partitions_of_an_index(db_url):
+    for source in ("api", "langgraph"):
+        record_manager(db_url, source_namespace("Docs_1", source)).update(["k"])
+    other = record_manager(db_url, source_namespace("Docs_2", "api"))
+    other.update(["k"])
+
+    assert record_manager(db_url, index_namespace("Docs_1")).delete_namespace() == 2
+    assert other.count() == 1
+    assert record_manager(db_url, source_namespace("Docs_1", "api")).count() == 0
+
+
+def test_legacy_records_move_to_their_source_namespace(db_url):
+    legacy = record_manager(db_url, index_namespace("Docs"))
+    legacy.update(
+        ["a", "b", "c", "d"],
+        group_ids=[
+            "https://api.example.com/1",
+            "https://api.example.com/2",
+            "https://docs.example.com/1",
+            "https://gone.example.com/1",
+        ],
+    )
+    api = record_manager(db_url, source_namespace("Docs", "api"))
+    api.update(["b"], group_ids=["https://api.example.com/2"])
+
+    assert legacy.move_groups(api.namespace, "https://api.example.com/") == 1
+    assert sorted(api.list_keys()) == ["a", "b"]
+    assert sorted(legacy.list_keys()) == ["c", "d"]
+
+    docs = record_manager(db_url, source_namespace("Docs", "docs"))
+    docs.update(["c"], group_ids=["https://docs.example.com/1"])
+    assert legacy.delete_keys_recorded_in([api.namespace, docs.namespace]) == 1
+    assert legacy.list_keys() == ["d"]
@@ -0,0 +1,82 @@
+import gzip
+from pathlib import Path
+
+import pytest
+from langchain_core.documents import Document
+
+from backend.extraction import extract_and_split
+from backend.ingest import iter_snapshot_tasks
+from backend.snapshot import SnapshotWriter, iter_snapshot, read_manifest
+from backend.splitter import MarkdownSectionSplitter
+
+
+def docs(source: str, n: int) -> list[Document]:
+    return [
+        Document(
+            page_content=f"# {source} page {i}\n\nSome text about {source}.",
+            metadata={"source": f"https://{source}.example/{i}", "title": str(i)},
+        )
+        for i in range(n)
+    ]
+
+
+def write_snapshot(path: Path, shard_size: int = 2) -> None:
+    with SnapshotWriter(path, shard_size=shard_size) as writer:
+        for a, b in zip(docs("a", 5), docs("b", 5)):
+            writer.write("a", a)
+            writer.write("b", b)
+
+
+def test_round_trip_is_sharded_per_source(tmp_path: Path):
+    write_snapshot(tmp_path)
+
+    manifest = read_manifest(tmp_path)
+    assert manifest["num_docs"] == 10
+    assert manifest["sources"] == {"a": 5, "b": 5}
+    assert sorted(shard["file"] for shard in manifest["shards"]) == [
+        f"{source}-{i:05d}.jsonl.gz" for source in "ab" for i in range(3)
+    ]
+    read = list(iter_snapshot(tmp_path))
+    assert [doc for source, doc in read if source == "a"] == docs("a", 5)
+    assert [doc for source, doc in read if source == "b"] == docs("b", 5)
+    assert [doc for _, doc in iter_snapshot(tmp_path, sources=["b"])] == docs("b", 5)
+
+
+def test_incomplete_snapshot_is_rejected(tmp_path: Path):
+    with pytest.raises(RuntimeError):
+        with SnapshotWriter(tmp_path) as writer:
+            writer.write("a", docs("a", 1)[0])
+            raise RuntimeError("crawl failed")
+
+    with pytest.raises(FileNotFoundError):
+        list(iter_snapshot(tmp_path))
+    # It can be written over, unlike a complete snapshot.
+    write_snapshot(tmp_path)
+    with pytest.raises(FileExistsError):
+        SnapshotWriter(tmp_path)
+
+
+def test_corrupted_shard_is_rejected(tmp_path: Path):
+    write_snapshot(tmp_path)
+    with gzip.open(tmp_path / "b-00001.jsonl.gz", "wt") as f:
+        f.write('{"page_content": "tampered", "metadata": {}}\n')
+
+    assert len(list(iter_snapshot(tmp_path, sources=["a"]))) == 5
+    with pytest.raises(ValueError, match="b-00001"):
+        list(iter_snapshot(tmp_path))
+
+
+def test_index_from_snapshot_without_crawling(tmp_path: Path):
+    write_snapshot(tmp_path)
+    splitter = MarkdownSectionSplitter(chunk_size=100, length_function=len)
+
+    chunks = list(
+        extract_and_split(
+            iter_snapshot_tasks(str(tmp_path), "a"), {}, splitter, workers=1
+        )
+    )
+
+    assert [chunk.metadata["source"] for chunk in chunks] == [
+        f"https://a.example/{i}" for i in range(5)
+    ]
+    assert chunks[0].page_content == "# a page 0\n\nSome text about a."
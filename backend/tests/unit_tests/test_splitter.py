@@ -0,0 +1,111 @@
+import pickle
+
+from langchain_core.documents import Document
+
+from backend.ingest import get_text_splitter
+from backend.splitter import MarkdownSectionSplitter
+
+PAGE = """Intro paragraph.
+
+# Guide
+
+Some text about the guide.
+
+## Install
+
+```bash
+pip install langchain
+```
+
+## Usage
+
+Usage text.
+
+```python
+# Not a heading
+print("hello")
+```
+
+# Reference
+
+Reference text.
+"""
+
+
+def test_splits_on_headings_with_heading_path():
+    splitter = MarkdownSectionSplitter(chunk_size=50, length_function=len)
+
+    docs = splitter.split_documents(
+        [Document(page_content=PAGE, metadata={"source": "page"})]
+    )
+
+    assert [doc.metadata["heading_path"] for doc in docs] == [
+        "",
+        "Guide",
+        "Guide > Install",
+        "Guide > Usage",
+        "Guide > Usage",
+        "Reference",
+    ]
+    assert all(doc.metadata["source"] == "page" for doc in docs)
+    assert docs[2].page_content == "## Install\n\n```bash\npip install langchain\n```"
+    # Comments inside code are not headings.
+    assert docs[4].page_content == '```python\n# Not a heading\nprint("hello")\n```'
+
+
+def test_packs_small_adjacent_sections():
+    splitter = MarkdownSectionSplitter(chunk_size=1000, length_function=len)
+
+    docs = splitter.create_documents([PAGE])
+
+    assert len(docs) == 1
+    assert docs[0].metadata["heading_path"] == ""
+    assert "# Reference" in docs[0].page_content
+
+
+def test_never_splits_inside_code_fences():
+    code = "\n".join(f"line_{i} = {i}" for i in range(50))
+    text = f"# Big\n\n```python\n{code}\n```\n"
+    splitter = MarkdownSectionSplitter(chunk_size=200, length_function=len)
+
+    chunks = splitter.split_text(text)
+
+    assert len(chunks) > 1
+    assert chunks[0].startswith("# Big\n\n```python\n")
+    for chunk in chunks:
+        assert chunk.count("```") == 2
+        assert chunk.rstrip().endswith("```")
+    lines = [line for chunk in chunks for line in chunk.splitlines() if "line_" in line]
+    assert lines == code.splitlines()
+
+
+def test_is_picklable():
+    splitter = MarkdownSectionSplitter(chunk_size=40, length_function=len)
+
+    restored = pickle.loads(pickle.dumps(splitter))
+
+    assert restored.split_text(PAGE) == splitter.split_text(PAGE)
+
+
+def test_code_comments_are_not_headings():
+    text = "# Install\n\n```bash\n# install the package\npip install x\n```\n"
+    splitter = MarkdownSectionSplitter(chunk_size=1000, length_function=len)
+
+    docs = splitter.create_documents([text])
+
+    assert [doc.metadata["heading_path"] for doc in docs] == ["Install"]
+
+
+def test_plain_text_sources_are_not_split_on_headings():
+    # The plain text extracted from a page, with a shell comment from a sample.
+    text = "Install\n\n# install the package\npip install x\n\nUsage\n\nimport x"
+
+    splitter = get_text_splitter("api", 1000, length_function=len)
+    docs = splitter.create_documents([text])
+
+    assert [doc.page_content for doc in docs] == [text]
+    assert "heading_path" not in docs[0].metadata
+    assert isinstance(
+        get_text_splitter("langchain", 1000, length_function=len),
+        MarkdownSectionSplitter,
+    )
@@ -0,0 +1,64 @@
+import json
+import time
+import tracemalloc
+from pathlib import Path
+
+import pytest
+
+from backend.telemetry import (
+    IngestionTelemetry,
+    embedding_cost,
+    find_regressions,
+    read_history,
+    write_report,
+)
+
+
+def slow(items, delay: float):
+    for item in items:
+        time.sleep(delay)
+        yield item
+
+
+def test_nested_stages_are_timed_separately():
+    telemetry = IngestionTelemetry()
+    inner = telemetry.track("inner", slow(["ab", "cde"], 0.05), size=len)
+    outer = telemetry.track("outer", slow(inner, 0.01))
+
+    assert list(outer) == ["ab", "cde"]
+
+    inner_stats, outer_stats = telemetry.stages["inner"], telemetry.stages["outer"]
+    assert (inner_stats.items, inner_stats.bytes) == (2, 5)
+    assert inner_stats.seconds == pytest.approx(0.1, abs=0.04)
+    assert (outer_stats.items, outer_stats.bytes) == (2, 0)
+    assert outer_stats.seconds == pytest.approx(0.02, abs=0.04)
+    assert outer_stats.seconds < inner_stats.seconds
+
+
+def test_reports_are_kept_in_a_history(tmp_path: Path):
+    telemetry = IngestionTelemetry(trace_memory=True)
+    telemetry.add("embed", items=100, seconds=1.0)
+    first = telemetry.report(status="completed")
+    tracemalloc.stop()
+    assert first["memory"]["tracemalloc_peak_mb"] >= 0
+    assert first["memory"]["peak_rss_mb"]["self"] > 0
+
+    path = write_report(tmp_path, first)
+    second = {**first, "started_at": first["started_at"] + 60}
+    second["stages"] = {"embed": {**first["stages"]["embed"], "items_per_second": 50}}
+    write_report(tmp_path, second)
+
+    assert json.loads(path.read_text()) == first
+    assert [report["stages"] for report in read_history(tmp_path)] == [
+        first["stages"],
+        second["stages"],
+    ]
+    assert find_regressions(first, second) == [
+        "embed: 50 items/s, 100.0 in the previous run (-50%)"
+    ]
+    assert find_regressions(second, first) == []
+
+
+def test_embedding_cost():
+    assert embedding_cost("text-embedding-3-small", 2_000_000) == pytest.approx(0.04)
+    assert embedding_cost("unknown-model", 1000) is None
@@ -0,0 +1,59 @@
+import pytest
+from langchain_core.messages import AIMessage
+
+from backend.query_log import usage_by_model
+from backend.usage import chat_cost, message_usage, total_usage
+
+
+def test_chat_cost_uses_the_longest_matching_prefix():
+    assert chat_cost("gpt-4o-mini-2024-07-18", 1_000_000, 0) == pytest.approx(0.15)
+    assert chat_cost("gpt-4o-2024-08-06", 0, 1_000_000) == pytest.approx(10.0)
+    assert chat_cost("unknown-model", 1000, 1000) is None
+
+
+def test_message_usage_prefers_the_provider_counts():
+    message = AIMessage(
+        content="answer",
+        response_metadata={"model_name": "gpt-4o-mini-2024-07-18"},
+        usage_metadata={
+            "input_tokens": 1000,
+            "output_tokens": 100,
+            "total_tokens": 1100,
+        },
+    )
+    usage = message_usage(message, "openai_gpt_4o_mini", lambda: pytest.fail())
+    assert usage["model"] == "gpt-4o-mini-2024-07-18"
+    assert (usage["input_tokens"], usage["output_tokens"]) == (1000, 100)
+    assert not usage["estimated"]
+    assert usage["cost_usd"] == pytest.approx((1000 * 0.15 + 100 * 0.60) / 1e6)
+
+
+def test_message_usage_estimates_without_provider_counts():
+    message = AIMessage(content="a short answer")
+    usage = message_usage(message, "gpt-4o", lambda: "a much longer prompt " * 10)
+    assert usage["estimated"]
+    assert usage["input_tokens"] > usage["output_tokens"] > 0
+
+
+def test_usage_is_aggregated_by_model_turn_and_k():
+    def record(model_name, messages, cost):
+        steps = {
+            "synthesis": {"input_tokens": 10, "output_tokens": 5, "cost_usd": cost},
+            "embedding": {"input_tokens": 2, "output_tokens": 0, "cost_usd": None},
+        }
+        return {
+            "model_name": model_name,
+            "k": 6,
+            "messages": [{"role": "human", "content": "q"}] * messages,
+            "usage": {**steps, "total": total_usage(steps)},
+        }
+
+    rows = usage_by_model(
+        [record("a", 1, 0.01), record("a", 3, 0.02), record("a", 3, 0.04)]
+    )
+    assert [(row["turn"], row["queries"]) for row in rows] == [
+        ("follow_up", 2),
+        ("first_turn", 1),
+    ]
+    assert rows[0]["mean_cost_usd"] == pytest.approx(0.03)
+    assert rows[0]["mean_input_tokens"] == 12
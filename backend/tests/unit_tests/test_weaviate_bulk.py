@@ -0,0 +1,81 @@
+from contextlib import contextmanager
+from dataclasses import dataclass
+from types import SimpleNamespace
+from uuid import uuid4
+
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from backend.weaviate_bulk import (
+    BulkWeaviateVectorStore,
+    BulkWriteError,
+    WriteStats,
+)
+
+
+@dataclass
+class _ErrorObject:
+    message: str
+    original_uuid: str
+
+
+class _FakeBatching:
+    """Collection batching that fails each object the first `failures[uuid]` times."""
+
+    def __init__(self, failures: dict[str, int]):
+        self.failures = failures
+        self.written: dict[str, dict] = {}
+        self.failed_objects: list[_ErrorObject] = []
+        self.num_batches = 0
+
+    @contextmanager
+    def dynamic(self):
+        self.failed_objects = []
+        self.num_batches += 1
+        yield self
+
+    def add_object(self, properties, uuid, vector):
+        if self.failures.get(uuid, 0) > 0:
+            self.failures[uuid] -= 1
+            self.failed_objects.append(_ErrorObject("overloaded", uuid))
+        else:
+            self.written[uuid] = {"properties": properties, "vector": vector}
+
+
+def make_store(failures: dict[str, int], max_retries: int) -> BulkWeaviateVectorStore:
+    # Skip the constructor, which needs a live Weaviate client.
+    store = BulkWeaviateVectorStore.__new__(BulkWeaviateVectorStore)
+    store._text_key = "text"
+    store._embedding = DeterministicFakeEmbedding(size=4)
+    store._collection = SimpleNamespace(batch=_FakeBatching(failures))
+    store.batch_size = None
+    store.concurrent_requests = 1
+    store.max_retries = max_retries
+    store.retry_backoff = 0.0
+    store.stats = WriteStats()
+    return store
+
+
+def test_add_texts_retries_failed_objects():
+    ids = [str(uuid4()) for _ in range(3)]
+    store = make_store({ids[1]: 2}, max_retries=2)
+
+    assert store.add_texts(["a", "b", "c"], [{"source": s} for s in "abc"], ids=ids)
+
+    batching = store._collection.batch
+    assert batching.num_batches == 3
+    assert sorted(batching.written) == sorted(ids)
+    assert batching.written[ids[1]]["properties"] == {"text": "b", "source": "b"}
+    assert len(batching.written[ids[1]]["vector"]) == 4
+    assert (store.stats.objects, store.stats.retries) == (3, 2)
+
+
+def test_add_texts_raises_on_persistent_failures():
+    ids = [str(uuid4()) for _ in range(2)]
+    store = make_store({ids[0]: 5}, max_retries=1)
+
+    with pytest.raises(BulkWriteError) as excinfo:
+        store.add_texts(["a", "b"], ids=ids, vectors=[[0.0] * 4, [1.0] * 4])
+
+    assert excinfo.value.failed == [ids[0]]
+    assert store._collection.batch.written[ids[1]]["vector"] == [1.0] * 4
@@ -0,0 +1,107 @@
+"""Token counts and estimated cost of the model calls of a graph run.
+
+Counts come from the usage metadata the provider returns with a message. Without
+it, they are estimated with a local tiktoken encoding, or from the text length
+if the encoding can't be loaded.
+"""
+from functools import lru_cache
+from typing import Any, Callable, Optional
+
+from langchain_core.messages import AIMessage
+
+from backend.telemetry import embedding_cost
+
+# USD per million input and output tokens, by model id prefix.
+CHAT_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "claude-3-haiku": (0.25, 1.25),
+    "claude-3-5-sonnet": (3.00, 15.00),
+    "accounts/fireworks/models/mixtral-8x7b-instruct": (0.50, 0.50),
+    "gemini-pro": (0.50, 1.50),
+    "command": (1.00, 2.00),
+    "llama3-70b-8192": (0.59, 0.79),
+}
+
+
+def chat_cost(model: str, input_tokens: int, output_tokens: int) -> Optional[float]:
+    """The estimated cost of a chat call, None if the price is unknown."""
+    model = model.removeprefix("models/")
+    prefixes = [prefix for prefix in CHAT_PRICES if model.startswith(prefix)]
+    if not prefixes:
+        return None
+    input_price, output_price = CHAT_PRICES[max(prefixes, key=len)]
+    return (input_tokens * input_price + output_tokens * output_price) / 1e6
+
+
+@lru_cache(maxsize=1)
+def _encoding() -> Any:
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text: Any) -> int:
+    text = text if isinstance(text, str) else str(text)
+    encoding = _encoding()
+    if encoding is None:
+        return len(text) // 4
+    return len(encoding.encode_ordinary(text))
+
+
+def message_usage(
+    message: AIMessage, model: str, render_prompt: Callable[[], str]
+) -> dict[str, Any]:
+    """Usage of the call that returned `message`, for the model it reports."""
+    model = (
+        message.response_metadata.get("model_name")
+        or message.response_metadata.get("model")
+        or model
+    )
+    if message.usage_metadata:
+        input_tokens = message.usage_metadata["input_tokens"]
+        output_tokens = message.usage_metadata["output_tokens"]
+    else:
+        input_tokens = count_tokens(render_prompt())
+        output_tokens = count_tokens(message.content)
+    return {
+        "model": model,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "estimated": not message.usage_metadata,
+        "cost_usd": chat_cost(model, input_tokens, output_tokens),
+    }
+
+
+def embedding_usage(text: str, model: str) -> dict[str, Any]:
+    tokens = count_tokens(text)
+    return {
+        "model": model,
+        "input_tokens": tokens,
+        "output_tokens": 0,
+        "estimated": True,
+        "cost_usd": embedding_cost(model, tokens),
+    }
+
+
+def coalesced_usage(step: dict[str, Any]) -> dict[str, Any]:
+    """Usage of a step whose call was shared with a concurrent request."""
+    return {
+        **step,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "cost_usd": 0.0,
+        "coalesced": True,
+    }
+
+
+def total_usage(steps: dict[str, dict[str, Any]]) -> dict[str, Any]:
+    """Tokens and cost summed over the steps of a run, unknown costs as 0."""
+    return {
+        "input_tokens": sum(step["input_tokens"] for step in steps.values()),
+        "output_tokens": sum(step["output_tokens"] for step in steps.values()),
+        "cost_usd": sum(step["cost_usd"] or 0.0 for step in steps.values()),
+    }
@@ -0,0 +1,180 @@
+"""Bulk writes to Weaviate through the v4 client's batching.
+
+`WeaviateVectorStore.add_texts` batches through the client but only logs the
+objects that failed, so `index()` goes on to record them as written.
+`BulkWeaviateVectorStore` batches on the collection with either automatic
+(dynamic) or fixed batch sizes and concurrent requests, retries the objects that
+failed and raises if some still fail. `index()` then stops before updating the
+record manager, which therefore never lists objects missing from Weaviate.
+"""
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Iterable, Optional
+from uuid import uuid4
+
+import weaviate
+from langchain_weaviate import WeaviateVectorStore
+from langchain_weaviate.vectorstores import _json_serializable
+from weaviate.util import get_valid_uuid
+
+from backend.crawl import batched
+
+logger = logging.getLogger(__name__)
+
+# Weaviate caps the number of objects a single delete_many can match.
+DEFAULT_DELETE_BATCH_SIZE = 1000
+
+
+class BulkWriteError(Exception):
+    """Objects could not be written to or deleted from Weaviate."""
+
+    def __init__(self, message: str, failed: Iterable[str] = ()):
+        super().__init__(message)
+        self.failed = list(failed)
+
+
+@dataclass
+class WriteStats:
+    objects: int = 0
+    retries: int = 0
+    seconds: float = 0.0
+
+    @property
+    def objects_per_second(self) -> float:
+        return self.objects / self.seconds if self.seconds else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "objects": self.objects,
+            "retries": self.retries,
+            "seconds": round(self.seconds, 3),
+            "objects_per_second": round(self.objects_per_second, 1),
+        }
+
+
+class BulkWeaviateVectorStore(WeaviateVectorStore):
+    """`WeaviateVectorStore` with reliable, configurable batched writes.
+
+    With `batch_size=None` the client sizes batches dynamically from the
+    server's load, otherwise it sends batches of `batch_size` objects with
+    `concurrent_requests` in flight. Failed objects are retried up to
+    `max_retries` times, after an exponential backoff. `stats` sums up the
+    writes, leaving out the time spent embedding.
+    """
+
+    def __init__(
+        self,
+        *args: Any,
+        batch_size: Optional[int] = None,
+        concurrent_requests: int = 4,
+        max_retries: int = 3,
+        retry_backoff: float = 2.0,
+        delete_batch_size: int = DEFAULT_DELETE_BATCH_SIZE,
+        **kwargs: Any,
+    ):
+        super().__init__(*args, **kwargs)
+        self.batch_size = batch_size
+        self.concurrent_requests = concurrent_requests
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.delete_batch_size = delete_batch_size
+        self.stats = WriteStats()
+
+    def _write(self, objects: dict[str, tuple[dict, Optional[list[float]]]]) -> dict:
+        start = time.perf_counter()
+        try:
+            return self._write_batch(objects)
+        finally:
+            self.stats.seconds += time.perf_counter() - start
+
+    def _write_batch(
+        self, objects: dict[str, tuple[dict, Optional[list[float]]]]
+    ) -> dict:
+        if self.batch_size is None:
+            batching = self._collection.batch.dynamic()
+        else:
+            batching = self._collection.batch.fixed_size(
+                batch_size=self.batch_size,
+                concurrent_requests=self.concurrent_requests,
+            )
+        with batching as batch:
+            for uuid, (properties, vector) in objects.items():
+                batch.add_object(properties=properties, uuid=uuid, vector=vector)
+        return {
+            str(obj.original_uuid): obj.message
+            for obj in self._collection.batch.failed_objects
+        }
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[list[dict]] = None,
+        tenant: Optional[str] = None,
+        vectors: Optional[list[list[float]]] = None,
+        **kwargs: Any,
+    ) -> list[str]:
+        """Upload texts with their metadata, embedding them unless `vectors` is set."""
+        if tenant is not None:
+            return super().add_texts(texts, metadatas, tenant=tenant, **kwargs)
+
+        texts = list(texts)
+        ids = kwargs.get("uuids") or kwargs.get("ids")
+        # In the canonical form of the UUIDs Weaviate reports failed objects with.
+        ids = (
+            [get_valid_uuid(id) for id in ids] if ids else [str(uuid4()) for _ in texts]
+        )
+        if vectors is None and self._embedding is not None:
+            vectors = self._embedding.embed_documents(texts)
+
+        objects: dict[str, tuple[dict, Optional[list[float]]]] = {}
+        for i, (text, id) in enumerate(zip(texts, ids)):
+            properties = {self._text_key: text}
+            for key, value in (metadatas[i] if metadatas else {}).items():
+                properties[key] = _json_serializable(value)
+            objects[id] = (properties, vectors[i] if vectors else None)
+
+        pending = objects
+        for attempt in range(self.max_retries + 1):
+            failed = self._write(pending)
+            if not failed:
+                self.stats.objects += len(objects)
+                break
+            if attempt == self.max_retries:
+                uuid, message = next(iter(failed.items()))
+                raise BulkWriteError(
+                    f"Failed to write {len(failed)} objects to Weaviate after "
+                    f"{attempt + 1} attempts, e.g. {uuid}: {message}",
+                    failed,
+                )
+            delay = self.retry_backoff * 2**attempt
+            logger.warning(
+                f"Failed to write {len(failed)}/{len(pending)} objects to Weaviate, "
+                f"retrying in {delay:.0f}s: {next(iter(failed.values()))}"
+            )
+            time.sleep(delay)
+            self.stats.retries += 1
+            pending = {uuid: objects[uuid] for uuid in failed}
+        return ids
+
+    def delete(
+        self,
+        ids: Optional[list[str]] = None,
+        tenant: Optional[str] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Delete by IDs, `delete_batch_size` at a time, raising if any fails."""
+        if ids is None:
+            raise ValueError("No ids provided to delete.")
+
+        with self._tenant_context(tenant) as collection:
+            for batch in batched(ids, self.delete_batch_size):
+                result = collection.data.delete_many(
+                    where=weaviate.classes.query.Filter.by_id().contains_any(batch)
+                )
+                if result.failed:
+                    raise BulkWriteError(
+                        f"Failed to delete {result.failed}/{result.matches} objects "
+                        "from Weaviate",
+                        batch,
+                    )